@@ -0,0 +1,162 @@
+# bench/bench_importador.py
+# -*- coding: utf-8 -*-
+"""
+Benchmark del importador (importer/import_eess.py) sobre CSV sintéticos (generar_csv.py) o reales.
+
+Por cada fichero mide la lectura (find_header_and_rows), map_columns y la normalización de los
+bloques con cada IMPORT_PARSER. Con --bd mide además la escritura de las instantáneas, en orden,
+con cada modo de --modos: el volcado (volcar_en_bd; en modo sombra incluye la copia de las tablas)
+y la publicación de los resúmenes (construir_resumenes). Antes de cada modo VACÍA estacion y precio,
+así que úsalo solo contra la base de datos desechable de bench/docker-compose.yml.
+Se repite --repeticiones veces y se informa del mínimo y la mediana.
+
+    python bench/bench_importador.py bench/datos --json bench/resultados/importador.json
+    docker compose -f bench/docker-compose.yml run --rm importer \\
+        python bench/bench_importador.py /app/csv --bd --comparar bench/resultados/importador.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import sys
+import time
+
+DIR_BENCH = os.path.dirname(os.path.abspath(__file__))
+# en el repositorio el importador está en ../importer; en el contenedor (bench montado en /app/bench), en ..
+for ruta in (os.path.join(DIR_BENCH, '..', 'importer'), os.path.join(DIR_BENCH, '..')):
+    if os.path.exists(os.path.join(ruta, 'import_eess.py')):
+        sys.path.insert(0, os.path.abspath(ruta))
+        break
+
+import import_eess as imp
+from comun import mediana, imprimir_tabla, guardar_json, comparar
+
+MODOS = ('lotes', 'incremental', 'loaddata', 'sombra', 'filas')
+
+def medir(funcion, repeticiones):
+    """Ejecuta `funcion` `repeticiones` veces (sin su salida por consola) y devuelve (tiempos, último resultado)."""
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            resultado = funcion()
+            tiempos.append(time.perf_counter() - t0)
+    return tiempos, resultado
+
+def fila_resultado(fase, caso, filas, tiempos, fichero=None):
+    minimo = min(tiempos)
+    return {'fase': fase, 'caso': caso, 'filas': filas, 'min_s': minimo, 'mediana_s': mediana(tiempos),
+            'filas_s': filas / minimo if minimo else None, 'fichero': fichero}
+
+def bench_parseo(rutas, repeticiones):
+    """`rutas`: {caso: ruta}; el caso (no el nombre del fichero) empareja los resultados entre ejecuciones."""
+    resultados = []
+    parser_original = imp.IMPORT_PARSER
+    for caso, ruta in rutas.items():
+        nombre = os.path.basename(ruta)
+        tiempos, (header, rows) = medir(lambda: imp.find_header_and_rows(ruta, delimiter=';'), repeticiones)
+        resultados.append(fila_resultado('find_header_and_rows', caso, len(rows), tiempos, nombre))
+        # map_columns tarda microsegundos: se mide un bucle de 1000 llamadas (filas/s = llamadas/s)
+        tiempos, mapping = medir(lambda: [imp.map_columns(header) for _ in range(1000)][-1], repeticiones)
+        resultados.append(fila_resultado('map_columns x1000', caso, 1000, tiempos, nombre))
+        for parser in ('pandas', 'python'):
+            imp.IMPORT_PARSER = parser
+            tiempos, _ = medir(lambda: list(imp.normalizar_bloques(rows, mapping, chunk_size=imp.BATCH_SIZE)), repeticiones)
+            resultados.append(fila_resultado(f'normalizar ({parser})', caso, len(rows), tiempos, nombre))
+    imp.IMPORT_PARSER = parser_original
+    return resultados
+
+def vaciar_bd():
+    with imp.connect(host=imp.MYSQL_HOST, port=imp.MYSQL_PORT, user=imp.MYSQL_USER, password=imp.MYSQL_PASSWORD,
+                     database=imp.MYSQL_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM precio")
+        cur.execute("DELETE FROM estacion")
+        conn.commit()
+        cur.close()
+
+def bench_escritura(rutas, modos, repeticiones):
+    """Tiempos de volcado y publicación por modo: la primera instantánea (carga inicial) y las siguientes."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        dims = imp.cargar_dimensiones()
+        # parsear_fichero devuelve filas crudas en modo 'filas' y bloques normalizados en los demás
+        parseados = {}
+        for tipo in {'filas' if modo == 'filas' else 'bloques' for modo in modos}:
+            imp.IMPORT_MODE = 'filas' if tipo == 'filas' else 'lotes'
+            parseados[tipo] = [imp.parsear_fichero(r) for r in rutas]
+    resultados = []
+    for modo in modos:
+        imp.IMPORT_MODE = modo
+        datos = parseados['filas' if modo == 'filas' else 'bloques']
+        volcados = {'inicial': [], 'siguientes': []}
+        publicados = {'inicial': [], 'siguientes': []}
+        filas = {'inicial': 0, 'siguientes': 0}
+        for _ in range(repeticiones):
+            with contextlib.redirect_stdout(io.StringIO()):
+                vaciar_bd()
+            for n, p in enumerate(datos):
+                caso = 'inicial' if n == 0 else 'siguientes'
+                bloques = None if modo == 'filas' else p['datos']
+                rows = p['datos'] if modo == 'filas' else None
+
+                def volcar():
+                    if modo == 'sombra':
+                        imp.preparar_sombra()
+                    imp.volcar_en_bd(rows, p['header'], p['mapping'], p['fuente'], os.path.basename(p['ruta']),
+                                     dims=dims, bloques=bloques)
+                tiempos, _ = medir(volcar, 1)
+                volcados[caso] += tiempos
+                tiempos, _ = medir(lambda: imp.construir_resumenes(sombra=modo == 'sombra'), 1)
+                publicados[caso] += tiempos
+                filas[caso] = len(p['datos']) if modo == 'filas' else sum(b['n'] for b in p['datos'])
+        for caso in ('inicial', 'siguientes'):
+            if volcados[caso]:
+                resultados.append(fila_resultado(f'volcar ({modo})', caso, filas[caso], volcados[caso]))
+                resultados.append(fila_resultado(f'publicar ({modo})', caso, filas[caso], publicados[caso]))
+    return resultados
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del importador")
+    parser.add_argument('fuentes', nargs='+', help="CSV, directorios o patrones glob (instantáneas en orden de 'Fecha:')")
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--bd', action='store_true', help="medir también la escritura en MySQL (VACÍA estacion y precio)")
+    parser.add_argument('--modos', default='lotes,incremental,loaddata,sombra',
+                        help=f"modos de escritura a medir con --bd ({', '.join(MODOS)})")
+    parser.add_argument('--json', help="guardar los resultados en este fichero")
+    parser.add_argument('--comparar', help="JSON de una ejecución anterior con el que comparar")
+    args = parser.parse_args(argv)
+
+    rutas = imp.expandir_fuentes(args.fuentes)
+    if not rutas:
+        print("No hay ficheros que medir.")
+        return 1
+    rutas.sort(key=lambda r: (imp.parse_date(imp.leer_preambulo(r).get('fecha')) or datetime.datetime.min, r))
+    modos = [m.strip() for m in args.modos.split(',') if m.strip()]
+    desconocidos = set(modos) - set(MODOS)
+    if desconocidos:
+        parser.error(f"modos desconocidos: {', '.join(sorted(desconocidos))}")
+
+    # el parseo se mide sobre la primera y la última instantánea
+    resultados = bench_parseo({'primera': rutas[0], 'ultima': rutas[-1]} if len(rutas) > 1 else {'primera': rutas[0]},
+                              args.repeticiones)
+    if args.bd:
+        if not imp.wait_for_db():
+            print("La base de datos no está disponible.")
+            return 1
+        resultados += bench_escritura(rutas, modos, args.repeticiones)
+
+    imprimir_tabla(resultados, [('fase', 'fase', '{}'), ('caso', 'caso', '{}'), ('filas', 'filas', '{}'),
+                                ('min_s', 'mín (s)', '{:.4f}'), ('mediana_s', 'mediana (s)', '{:.4f}'),
+                                ('filas_s', 'filas/s', '{:,.0f}')])
+    parametros = {'fuentes': rutas, 'repeticiones': args.repeticiones, 'bd': args.bd, 'modos': modos,
+                  'batch_size': imp.BATCH_SIZE}
+    if args.json:
+        guardar_json(args.json, 'importador', parametros, resultados)
+    if args.comparar:
+        comparar(args.comparar, resultados, lambda f: (f['fase'], f['caso']), [('min_s', False), ('mediana_s', False)])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# bench/bench_web.py
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga de las rutas de la web. Para cada ruta lanza --concurrencia clientes HTTP
+(una conexión keep-alive cada uno) durante --duracion segundos, tras --calentamiento peticiones
+que no cuentan, y muestra peticiones/s, latencias p50/p95/p99/máx, errores y bytes por respuesta.
+La latencia incluye leer la respuesta completa (también las de ndjson y /exportar).
+
+Pensado para la pila desechable de bench/docker-compose.yml (web en el puerto 5001), cargada con
+datos de generar_csv.py. Solo usa la biblioteca estándar.
+
+    python bench/bench_web.py --url http://localhost:5001 --json bench/resultados/web.json
+    python bench/bench_web.py --concurrencia 16 --duracion 20 --comparar bench/resultados/web.json '/buscar?page=3'
+"""
+import argparse
+import http.client
+import json
+import sys
+import threading
+import time
+import urllib.parse
+
+from comun import percentil, imprimir_tabla, guardar_json, comparar
+
+# {provincia}, {combustible} y {cursor} se rellenan con valores de la propia web
+RUTAS = [
+    '/',
+    '/buscar?page=1',
+    '/buscar?page=50&sort=precio_desc',
+    '/buscar?paginacion=cursor&provincia={provincia}&combustible={combustible}',
+    '/empresa_mayor?fuente=terrestre',
+    '/gas95_madrid?provincia={provincia}',
+    '/gas95_maritima_top',
+    '/precios_provincia',
+    '/cercanas?lat=40.4168&lon=-3.7038&k=10',
+    '/gasoleo_cercano?lat=40.4168&lon=-3.7038&km=10',
+    '/api/v1/precios?combustible={combustible}&limite=100',
+    '/api/v1/precios?combustible={combustible}&limite=100&conteo=no&cursor={cursor}',
+    '/api/v1/empresas?fuente=terrestre',
+    '/api/v1/precios_provincia?combustible={combustible}',
+    '/api/v1/cercanas?lat=40.4168&lon=-3.7038&k=10',
+    '/api/v1/tendencia/provincia?provincia={provincia}&combustible={combustible}',
+    '/exportar?formato=csv&fuente=maritima',
+]
+
+class Cliente:
+    """Conexión HTTP persistente; se reabre si el servidor la cierra."""
+    def __init__(self, url, timeout):
+        partes = urllib.parse.urlsplit(url)
+        self.clase = http.client.HTTPSConnection if partes.scheme == 'https' else http.client.HTTPConnection
+        self.destino = partes.netloc
+        self.prefijo = partes.path.rstrip('/')
+        self.timeout = timeout
+        self.conn = None
+
+    def get(self, ruta):
+        """(estado, bytes del cuerpo); reintenta una vez si la conexión keep-alive estaba cerrada."""
+        for intento in range(2):
+            if self.conn is None:
+                self.conn = self.clase(self.destino, timeout=self.timeout)
+            try:
+                self.conn.request('GET', self.prefijo + ruta)
+                resp = self.conn.getresponse()
+                cuerpo = resp.read()
+                if resp.getheader('Connection', '').lower() == 'close':
+                    self.cerrar()
+                return resp.status, cuerpo
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.cerrar()
+                if intento:
+                    raise
+
+    def cerrar(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+def valores_rutas(url, provincia, timeout):
+    """Combustible (el primer código con '95') y cursor de la segunda página de /api/v1/precios."""
+    cliente = Cliente(url, timeout)
+    try:
+        estado, cuerpo = cliente.get('/api/v1/combustibles')
+        codigos = [c['codigo'] or str(c['id']) for c in json.loads(cuerpo)['datos']] if estado == 200 else []
+        combustible = next((c for c in codigos if '95' in c), codigos[0] if codigos else '')
+        estado, cuerpo = cliente.get('/api/v1/precios?' + urllib.parse.urlencode({'combustible': combustible, 'limite': 100}))
+        cursor = json.loads(cuerpo).get('cursor_siguiente') if estado == 200 else None
+    finally:
+        cliente.cerrar()
+    return {'provincia': urllib.parse.quote(provincia), 'combustible': urllib.parse.quote(combustible),
+            'cursor': urllib.parse.quote(cursor or '')}
+
+def cargar_ruta(url, ruta, concurrencia, duracion, calentamiento, timeout):
+    latencias = []
+    errores = []
+    bytes_total = [0]
+    lock = threading.Lock()
+    plazo = {}
+
+    def arrancar():
+        # lo ejecuta la barrera antes de soltar a todos: el plazo está fijado cuando empiezan a medir
+        plazo['inicio'] = time.perf_counter()
+        plazo['fin'] = plazo['inicio'] + duracion
+    inicio = threading.Barrier(concurrencia + 1, action=arrancar)
+
+    def trabajador():
+        cliente = Cliente(url, timeout)
+        propias = []
+        leidos = 0
+        fallos = []
+        try:
+            for _ in range(calentamiento):
+                cliente.get(ruta)
+        except Exception as e:
+            fallos.append(repr(e))
+        inicio.wait()
+        while time.perf_counter() < plazo['fin']:
+            t0 = time.perf_counter()
+            try:
+                estado, cuerpo = cliente.get(ruta)
+            except Exception as e:
+                fallos.append(repr(e))
+                cliente.cerrar()
+                continue
+            propias.append(time.perf_counter() - t0)
+            leidos += len(cuerpo)
+            if estado >= 400:
+                fallos.append(f"HTTP {estado}")
+        cliente.cerrar()
+        with lock:
+            latencias.extend(propias)
+            errores.extend(fallos)
+            bytes_total[0] += leidos
+
+    hilos = [threading.Thread(target=trabajador, daemon=True) for _ in range(concurrencia)]
+    for h in hilos:
+        h.start()
+    inicio.wait()
+    for h in hilos:
+        h.join()
+    transcurrido = time.perf_counter() - plazo['inicio']
+    n = len(latencias)
+    return {
+        'ruta': ruta, 'peticiones': n, 'rps': n / transcurrido if transcurrido else None,
+        'p50_ms': _ms(percentil(latencias, 50)), 'p95_ms': _ms(percentil(latencias, 95)),
+        'p99_ms': _ms(percentil(latencias, 99)), 'max_ms': _ms(max(latencias) if latencias else None),
+        'errores': len(errores), 'bytes_respuesta': bytes_total[0] // n if n else None,
+        'primer_error': errores[0] if errores else None,
+    }
+
+def _ms(segundos):
+    return None if segundos is None else segundos * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga de las rutas de la web")
+    parser.add_argument('rutas', nargs='*', help="rutas a medir (por defecto, RUTAS)")
+    parser.add_argument('--url', default='http://localhost:5001', help="URL base de la web")
+    parser.add_argument('--concurrencia', type=int, default=8, help="clientes simultáneos por ruta")
+    parser.add_argument('--duracion', type=float, default=10, help="segundos de medida por ruta")
+    parser.add_argument('--calentamiento', type=int, default=5, help="peticiones por cliente antes de medir")
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--provincia', default='MADRID')
+    parser.add_argument('--json', help="guardar los resultados en este fichero")
+    parser.add_argument('--comparar', help="JSON de una ejecución anterior con el que comparar")
+    args = parser.parse_args(argv)
+
+    valores = valores_rutas(args.url, args.provincia, args.timeout)
+    resultados = []
+    for plantilla in (args.rutas or RUTAS):
+        ruta = plantilla.format(**valores)
+        res = cargar_ruta(args.url, ruta, args.concurrencia, args.duracion, args.calentamiento, args.timeout)
+        res['ruta'] = plantilla  # se compara por plantilla: el cursor cambia si cambian los datos
+        print(f"{ruta}: {res['rps']:.1f} pet/s, p95 {res['p95_ms'] or 0:.1f} ms, {res['errores']} errores"
+              + (f" ({res['primer_error']})" if res['primer_error'] else ''))
+        resultados.append(res)
+
+    print()
+    imprimir_tabla(resultados, [('ruta', 'ruta', '{}'), ('peticiones', 'pet.', '{}'), ('rps', 'pet/s', '{:.1f}'),
+                                ('p50_ms', 'p50 ms', '{:.1f}'), ('p95_ms', 'p95 ms', '{:.1f}'),
+                                ('p99_ms', 'p99 ms', '{:.1f}'), ('max_ms', 'máx ms', '{:.1f}'),
+                                ('errores', 'errores', '{}'), ('bytes_respuesta', 'bytes/resp', '{:,}')])
+    parametros = {'url': args.url, 'concurrencia': args.concurrencia, 'duracion': args.duracion,
+                  'calentamiento': args.calentamiento, 'valores': valores}
+    if args.json:
+        guardar_json(args.json, 'web', parametros, resultados)
+    if args.comparar:
+        comparar(args.comparar, resultados, lambda f: (f['ruta'],),
+                 [('rps', True), ('p50_ms', False), ('p95_ms', False), ('p99_ms', False)])
+    return 1 if any(r['errores'] for r in resultados) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
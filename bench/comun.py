@@ -0,0 +1,86 @@
+# bench/comun.py
+# -*- coding: utf-8 -*-
+"""
+Utilidades compartidas por los benchmarks: percentiles, tablas de texto y resultados en JSON
+que se pueden comparar entre ejecuciones (--json / --comparar).
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+def percentil(valores, p):
+    """Percentil p (0-100) con interpolación lineal; None si no hay valores."""
+    if not valores:
+        return None
+    orden = sorted(valores)
+    pos = (len(orden) - 1) * p / 100.0
+    i = int(pos)
+    if i + 1 >= len(orden):
+        return orden[-1]
+    return orden[i] + (orden[i + 1] - orden[i]) * (pos - i)
+
+def mediana(valores):
+    return percentil(valores, 50)
+
+def imprimir_tabla(filas, columnas):
+    """`filas`: lista de dicts; `columnas`: [(clave, título, formato)] con formato tipo '{:.3f}'."""
+    celdas = [[titulo for _, titulo, _ in columnas]]
+    for fila in filas:
+        celdas.append(['-' if fila.get(clave) is None else fmt.format(fila[clave]) for clave, _, fmt in columnas])
+    anchos = [max(len(c[i]) for c in celdas) for i in range(len(columnas))]
+    for n, c in enumerate(celdas):
+        print("  ".join(v.rjust(a) if n and i else v.ljust(a) for i, (v, a) in enumerate(zip(c, anchos))))
+        if n == 0:
+            print("  ".join('-' * a for a in anchos))
+
+def revision_git():
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=raiz, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def guardar_json(ruta, tipo, parametros, resultados):
+    datos = {
+        'tipo': tipo,
+        'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': revision_git(),
+        'python': sys.version.split()[0],
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parametros': parametros,
+        'resultados': resultados,
+    }
+    directorio = os.path.dirname(ruta)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False, indent=2)
+    print(f"[OK] Resultados guardados en {ruta}")
+
+def comparar(ruta_anterior, resultados, clave, metricas):
+    """
+    Compara `resultados` con los de un JSON anterior del mismo tipo, emparejando filas por `clave`
+    (función fila -> tupla). `metricas`: [(nombre, mayor_es_mejor)]. Imprime la variación en %.
+    """
+    with open(ruta_anterior, encoding='utf-8') as f:
+        anterior = json.load(f)
+    previas = {clave(fila): fila for fila in anterior['resultados']}
+    print(f"\nComparación con {ruta_anterior} (revisión {anterior.get('revision')}, {anterior.get('fecha')}):")
+    filas = []
+    for fila in resultados:
+        previa = previas.get(clave(fila))
+        if previa is None:
+            continue
+        comparada = {'clave': ' '.join(str(v) for v in clave(fila))}
+        for nombre, mayor_es_mejor in metricas:
+            antes, ahora = previa.get(nombre), fila.get(nombre)
+            if antes and ahora is not None:
+                cambio = (ahora - antes) / antes * 100
+                comparada[nombre] = cambio if mayor_es_mejor else -cambio
+        filas.append(comparada)
+    imprimir_tabla(filas, [('clave', 'caso', '{}')] + [(n, f"{n} (% mejora)", '{:+.1f}') for n, _ in metricas])
@@ -0,0 +1,160 @@
+# bench/generar_csv.py
+# -*- coding: utf-8 -*-
+"""
+Generador de CSV sintéticos con el formato del Ministerio (preciosEESS_es.csv / embarcacionesPrecios_es.csv)
+para medir el importador y la web con más datos que la instantánea incluida en csv/.
+
+Reproduce el preámbulo de tres líneas (Fecha:, Descripción:, Siglas:), la cabecera real con sus
+espacios y tabuladores, el separador ';', la coma decimal y el BOM UTF-8. Cada instantánea es
+una hora posterior a la anterior; las estaciones son las mismas en todas (misma identidad para
+el modo incremental) y en cada una cambia la fracción --cambio de sus precios. Con la misma
+--semilla el resultado es idéntico byte a byte.
+
+    python bench/generar_csv.py --estaciones 50000 --instantaneas 24 --salida bench/datos
+    python bench/generar_csv.py --fuente maritima --estaciones 2000 --combustibles 4 --salida bench/datos
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+
+CABECERA_TERRESTRE = [
+    'Provincia', 'Municipio', 'Localidad', 'Código postal', 'Dirección', 'Margen', 'Longitud', 'Latitud',
+    'Toma de datos', 'Precio gasolina 95 E5', 'Precio gasolina 95 E10', 'Precio gasolina 95 E5 Premium',
+    'Precio gasolina 98 E5', 'Precio gasolina 98 E10', 'Precio gasóleo A', 'Precio gasóleo Premium',
+    'Precio gasóleo B', 'Precio gasóleo C', 'Precio bioetanol', '% bioalcohol', 'Precio biodiésel',
+    '% éster metílico', 'Precio gases licuados del petróleo', 'Precio gas natural comprimido',
+    'Precio gas natural licuado', 'Precio hidrógeno', 'Precio gasolina 95 E25', 'Precio gasolina 95 E85',
+    'Precio AdBlue', 'Precio diesel renovable', '"Precio gasolina renovable\t"', '"Precio metanol\t"',
+    '"Precio  amoniaco\t"', '"Precio BGNC\t"', 'Precio BGNL', 'Rótulo', 'Tipo venta', 'Rem.', 'Horario',
+    'Tipo servicio', '',
+]
+CABECERA_MARITIMA = [
+    'Provincia', 'Municipio', '', 'Localidad', 'Código postal', 'Dirección', 'Longitud', 'Latitud',
+    'Precio gasolina 95 E5', 'Precio gasolina 95 E10', 'Precio gasóleo A', 'Precio gasóleo B',
+    'Precio gasóleo de uso marítimo', 'Precio gasolina 95 E25', 'Precio gasolina 95 E85', 'Precio AdBlue',
+    'Precio diesel renovable', '"Precio gasolina renovable\t"', '"Precio metanol\t"', '"Precio  amoniaco\t"',
+    '"Precio BGNC\t"', 'Precio BGNL', 'Rótulo', 'Tipo venta', 'Rem.', 'Horario', '', '', '',
+]
+PREAMBULO = {
+    'terrestre': ('preciosEESS_es',
+                  "Archivo de todos los productos en todas las estaciones de servicio. Este archivo se genera una vez "
+                  "cada hora, con los precios en ese momento, y sobrescribe al de la hora anterior, que no se conserva.",
+                  "Margen - D: Derecho, I: Izquierdo, N: No aplica    Tipo venta - P: Venta al público en general, "
+                  "R: Venta restringida a socios o cooperativistas  Rem. - OM: Datos procedentes del operador "
+                  "mayorista, dm: Datos procedentes del distribuidor minorista"),
+    'maritima': ('embarcacionesPrecios_es',
+                 "Archivo de todos los productos en todos los postes marítimos. Este archivo se genera una vez cada "
+                 "hora, con los precios en ese momento, y sobrescribe al de la hora anterior, que no se conserva.",
+                 "Tipo venta - P: Suministro a pesqueros, R: Suministro a barcos deportivos y de recreo, M: Mixta  "
+                 "Rem. - OM: Datos procedentes del operador mayorista, dm: Datos procedentes del distribuidor minorista"),
+}
+# precio de referencia (€/l) de cada combustible; el resto de columnas de precio quedan vacías
+PRECIO_BASE = {
+    'Precio gasolina 95 E5': 1.55, 'Precio gasóleo A': 1.45, 'Precio gasolina 98 E5': 1.70,
+    'Precio gasóleo Premium': 1.55, 'Precio gasóleo B': 1.05, 'Precio gases licuados del petróleo': 0.95,
+    'Precio gasolina 95 E5 Premium': 1.62, 'Precio AdBlue': 0.85, 'Precio gasóleo C': 1.10,
+    'Precio gasolina 95 E10': 1.50, 'Precio biodiésel': 1.40, 'Precio gas natural comprimido': 1.30,
+    'Precio gasóleo de uso marítimo': 1.00, 'Precio diesel renovable': 1.80, 'Precio hidrógeno': 12.0,
+}
+PROVINCIAS = [
+    'A CORUÑA', 'ALBACETE', 'ALICANTE', 'ALMERÍA', 'ARABA/ÁLAVA', 'ASTURIAS', 'ÁVILA', 'BADAJOZ',
+    'BALEARS (ILLES)', 'BARCELONA', 'BIZKAIA', 'BURGOS', 'CÁCERES', 'CÁDIZ', 'CANTABRIA', 'CASTELLÓN / CASTELLÓ',
+    'CEUTA', 'CIUDAD REAL', 'CÓRDOBA', 'CUENCA', 'GIPUZKOA', 'GIRONA', 'GRANADA', 'GUADALAJARA', 'HUELVA',
+    'HUESCA', 'JAÉN', 'LEÓN', 'LLEIDA', 'LUGO', 'MADRID', 'MÁLAGA', 'MELILLA', 'MURCIA', 'NAVARRA', 'OURENSE',
+    'PALENCIA', 'PALMAS (LAS)', 'PONTEVEDRA', 'RIOJA (LA)', 'SALAMANCA', 'SANTA CRUZ DE TENERIFE', 'SEGOVIA',
+    'SEVILLA', 'SORIA', 'TARRAGONA', 'TERUEL', 'TOLEDO', 'VALENCIA / VALÈNCIA', 'VALLADOLID', 'ZAMORA', 'ZARAGOZA',
+]
+ROTULOS = ['REPSOL', 'CEPSA', 'BP', 'GALP', 'SHELL', 'PLENOIL', 'BALLENOIL', 'PETROPRIX', 'ALCAMPO',
+           'CARREFOUR', 'AVIA', 'PETRONOR', 'DISA', 'MEROIL', 'ESCLATOIL']
+VIAS = ['CALLE', 'AVENIDA', 'CARRETERA', 'PLAZA', 'CAMINO', 'PASEO', 'POLIGONO']
+
+def coma(valor, decimales):
+    return f"{valor:.{decimales}f}".replace('.', ',')
+
+def generar_estaciones(n, fuente, rng):
+    """Datos fijos de cada estación (los mismos en todas las instantáneas)."""
+    estaciones = []
+    for i in range(n):
+        provincia = rng.choice(PROVINCIAS)
+        municipio = f"{provincia.split(' ')[0]} {rng.randrange(1, 200):03d}"
+        # marcas grandes para la mayoría y una cola larga de independientes (como en el fichero real)
+        rotulo = rng.choice(ROTULOS) if rng.random() < 0.7 else f"E.S. {rng.randrange(1, 3000)}"
+        estaciones.append({
+            'provincia': provincia, 'municipio': municipio, 'localidad': municipio,
+            'codigo_postal': f"{rng.randrange(1000, 52999):05d}",
+            'direccion': f"{rng.choice(VIAS)} SINTETICA {i}, {rng.randrange(1, 300)}",
+            'margen': rng.choice('DIN'), 'latitud': rng.uniform(36.0, 43.7), 'longitud': rng.uniform(-9.2, 3.3),
+            'rotulo': rotulo if fuente == 'terrestre' else f"PUERTO {rotulo}",
+            'horario': rng.choice(['L-D: 24H', 'L-D: 07:00-22:00', 'L-S: 06:00-23:00']),
+        })
+    return estaciones
+
+def precios_iniciales(estaciones, combustibles, rng):
+    """{(estación, combustible): precio}: 95 E5 y gasóleo A casi siempre; el resto, en una de cada tres."""
+    precios = {}
+    for i in range(len(estaciones)):
+        for k, col in enumerate(combustibles):
+            if rng.random() < (0.95 if k < 2 else 0.3):
+                precios[(i, col)] = PRECIO_BASE.get(col, 1.5) + rng.uniform(-0.15, 0.15)
+    return precios
+
+def escribir_instantanea(ruta, fuente, fecha, estaciones, precios):
+    _, descripcion, siglas = PREAMBULO[fuente]
+    cabecera = CABECERA_TERRESTRE if fuente == 'terrestre' else CABECERA_MARITIMA
+    relleno = ';' * (len(cabecera) - 2)
+    toma = fecha.strftime('%d/%m/%Y %H:%M')
+    tipo_venta = 'P' if fuente == 'terrestre' else 'Suministro a barcos deportivos o de recreo'
+    with open(ruta, 'w', encoding='utf-8-sig', newline='') as f:
+        f.write(f"Fecha:;{toma};{relleno}\n")
+        f.write(f"Descripción:;{descripcion};{relleno}\n")
+        f.write(f"Siglas:;{siglas};{relleno}\n")
+        f.write(';'.join(cabecera) + '\n')
+        for i, e in enumerate(estaciones):
+            valores = {
+                'Provincia': e['provincia'], 'Municipio': e['municipio'], 'Localidad': e['localidad'],
+                'Código postal': e['codigo_postal'], 'Dirección': e['direccion'], 'Margen': e['margen'],
+                'Longitud': coma(e['longitud'], 6), 'Latitud': coma(e['latitud'], 6), 'Toma de datos': toma,
+                'Rótulo': e['rotulo'], 'Tipo venta': tipo_venta, 'Rem.': 'dm', 'Horario': e['horario'],
+                'Tipo servicio': e['horario'] + ' (A)',
+            }
+            f.write(';'.join(coma(precios[(i, c)], 3) if (i, c) in precios else valores.get(c, '')
+                             for c in cabecera) + '\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CSV sintéticos con el formato del Ministerio")
+    parser.add_argument('--estaciones', type=int, default=12000, help="estaciones por instantánea")
+    parser.add_argument('--instantaneas', type=int, default=1, help="ficheros, uno por hora")
+    parser.add_argument('--combustibles', type=int, default=6,
+                        help="columnas de precio con valores (las más habituales primero)")
+    parser.add_argument('--fuente', choices=('terrestre', 'maritima'), default='terrestre')
+    parser.add_argument('--cambio', type=float, default=0.1, help="fracción de precios que cambia entre instantáneas")
+    parser.add_argument('--inicio', default='2025-01-01 00:00', help="fecha de la primera instantánea (AAAA-MM-DD HH:MM)")
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--salida', default='bench/datos', help="directorio de salida")
+    args = parser.parse_args(argv)
+
+    cabecera = CABECERA_TERRESTRE if args.fuente == 'terrestre' else CABECERA_MARITIMA
+    disponibles = sorted((c for c in cabecera if c in PRECIO_BASE), key=list(PRECIO_BASE).index)
+    combustibles = disponibles[:args.combustibles]
+    rng = random.Random(args.semilla)
+    estaciones = generar_estaciones(args.estaciones, args.fuente, rng)
+    precios = precios_iniciales(estaciones, combustibles, rng)
+    claves = sorted(precios)
+
+    os.makedirs(args.salida, exist_ok=True)
+    base = PREAMBULO[args.fuente][0]
+    fecha = datetime.datetime.strptime(args.inicio, '%Y-%m-%d %H:%M')
+    for n in range(args.instantaneas):
+        if n:
+            for clave in rng.sample(claves, int(len(claves) * args.cambio)):
+                precios[clave] = max(0.5, precios[clave] + rng.choice((-1, 1)) * rng.uniform(0.005, 0.03))
+        ruta = os.path.join(args.salida, f"{base}_{fecha:%Y%m%d%H}.csv")
+        escribir_instantanea(ruta, args.fuente, fecha, estaciones, precios)
+        print(f"[OK] {ruta}: {len(estaciones)} estaciones, {len(precios)} precios")
+        fecha += datetime.timedelta(hours=1)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
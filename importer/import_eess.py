@@ -8,13 +8,24 @@ directamente contra la base MySQL.
 """
 
 import os
+import contextlib
 import csv
 import re
 import unicodedata
 import datetime
+import hashlib
+import math
 import time
 import sys
-from mysql.connector import connect, Error
+import tempfile
+import glob
+import queue
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from mysql.connector import connect as conectar_mysql, Error, errorcode
 
 # Configuración por entorno (heredada desde docker-compose env)
 MYSQL_HOST = os.getenv('MYSQL_HOST', 'db')
@@ -32,6 +43,33 @@ CSV_MAR = os.path.join(CSV_DIR, 'embarcacionesPrecios_es.csv')
 MAX_RETRIES = 30
 SLEEP_SEC = 2
 
+# Modo de inserción: 'lotes' (executemany multi-fila, un commit por lote), 'filas' (una fila cada vez)
+# 'incremental' (upsert de estaciones por clave estable y solo los precios que cambian)
+# 'loaddata' (recarga completa vía ficheros TSV + LOAD DATA LOCAL INFILE en tablas de staging)
+# o 'sombra' (como incremental, pero sobre copias de estacion/precio que se publican con un RENAME TABLE)
+IMPORT_MODE = os.getenv('IMPORT_MODE', 'lotes')
+BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+# Conversión de precios/coordenadas/fechas: 'pandas' (columnar, por lotes) o 'python' (celda a celda)
+IMPORT_PARSER = os.getenv('IMPORT_PARSER', 'pandas')
+# Importación de varios ficheros: procesos para parsear y conexiones simultáneas para escribir
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', str(os.cpu_count() or 2)))
+IMPORT_DB_WORKERS = int(os.getenv('IMPORT_DB_WORKERS', '2'))
+# Histórico de precios (solo en modo incremental, el único que conserva los ids de estación):
+# una instantánea por hora en precio_historico y mínimo/media/máximo por día en precio_diario
+IMPORT_HISTORICO = os.getenv('IMPORT_HISTORICO', 'si') == 'si'
+HISTORICO_HORARIO_DIAS = int(os.getenv('HISTORICO_HORARIO_DIAS', '90'))  # retención de las horas
+HISTORICO_DIARIO_DIAS = int(os.getenv('HISTORICO_DIARIO_DIAS', '0'))     # retención de los días (0 = sin límite)
+# Espera máxima (s) del RENAME TABLE por los bloqueos de metadatos de lecturas largas y reintentos
+IMPORT_RENAME_ESPERA = int(os.getenv('IMPORT_RENAME_ESPERA', '5'))
+IMPORT_RENAME_REINTENTOS = int(os.getenv('IMPORT_RENAME_REINTENTOS', '10'))
+# Modo vigilancia (--vigilar): segundos entre pasadas y espera máxima tras fallos seguidos
+IMPORT_VIGILAR_CADA = float(os.getenv('IMPORT_VIGILAR_CADA', '60'))
+IMPORT_BACKOFF_MAX = float(os.getenv('IMPORT_BACKOFF_MAX', '900'))
+# segundos que una importación espera a que termine otra en curso antes de abandonar
+IMPORT_CERROJO_ESPERA = int(os.getenv('IMPORT_CERROJO_ESPERA', '600'))
+# métricas de cada pasada en formato de texto de Prometheus (p.ej. para el textfile collector de node_exporter)
+IMPORT_METRICAS_FICHERO = os.getenv('IMPORT_METRICAS_FICHERO', '')
+
 # ---------------- utilidades ----------------
 def slugcol(s):
     if s is None:
@@ -50,9 +88,11 @@ def str_to_float(v):
     v = v.replace('\xa0','').replace(' ','')
     v = v.replace(',', '.')
     try:
-        return float(v)
+        f = float(v)
     except:
         return None
+    # 'nan' o 'inf' no son un precio ni una coordenada
+    return f if math.isfinite(f) else None
 
 def parse_date(value):
     if value is None:
@@ -71,11 +111,16 @@ def parse_date(value):
         pass
     return None
 
-def find_header_and_rows(csv_path, delimiter=';'):
-    rows = []
-    header = None
-    with open(csv_path, newline='', encoding='utf-8', errors='replace') as f:
+def iter_header_and_rows(csv_path, delimiter=';'):
+    """
+    Versión en streaming de find_header_and_rows: lee solo hasta la cabecera y
+    devuelve (header, filas), donde `filas` es un generador que va leyendo el
+    fichero bajo demanda (el fichero se cierra al agotarlo).
+    """
+    f = open(csv_path, newline='', encoding='utf-8', errors='replace')
+    try:
         reader = csv.reader(f, delimiter=delimiter)
+        header = None
         for r in reader:
             if not r:
                 continue
@@ -85,13 +130,23 @@ def find_header_and_rows(csv_path, delimiter=';'):
                 break
         if header is None:
             raise RuntimeError(f"No se ha encontrado la fila de cabecera en {csv_path}")
+    except Exception:
+        f.close()
+        raise
+    return header, _iter_filas(f, reader, len(header))
+
+def _iter_filas(f, reader, n_cols):
+    with f:
         for r in reader:
             if all([c.strip()=='' for c in r]):
                 continue
-            if len(r) < len(header):
-                r = r + [''] * (len(header) - len(r))
-            rows.append([c.strip() for c in r[:len(header)]])
-    return header, rows
+            if len(r) < n_cols:
+                r = r + [''] * (n_cols - len(r))
+            yield [c.strip() for c in r[:n_cols]]
+
+def find_header_and_rows(csv_path, delimiter=';'):
+    header, filas = iter_header_and_rows(csv_path, delimiter=delimiter)
+    return header, list(filas)
 
 PRECIO_KEYWORDS = ['gasolina','gasoleo','gasoil','adblue','diesel','bio','metanol','hidrogeno','gas natural','bgc','bgc']
 
@@ -135,6 +190,317 @@ def map_columns(header):
     mapping['price_cols'] = price_cols
     return mapping
 
+def valor_col(r, mapping, key):
+    i = mapping.get(key)
+    return r[i] if i is not None else ''
+
+def clave_nombre(s):
+    # aproximación de la collation utf8mb4_unicode_ci: sin acentos, sin mayúsculas y sin espacios finales
+    s2 = ''.join(c for c in unicodedata.normalize('NFKD', str(s)) if not unicodedata.combining(c))
+    return s2.rstrip(' ').casefold()
+
+# ---------------- combustibles ----------------
+# Código canónico de cada carburante (combustible.codigo), nombre a mostrar y grafías de
+# cabecera conocidas (ya pasadas por clave_combustible). Las que no estén aquí usan su
+# propia clave como código, así un combustible nuevo del Ministerio no se pierde.
+COMBUSTIBLES = [
+    ('gasolina_95_e5', 'Gasolina 95 E5', ['gasolina 95 e5', 'gasolina 95', 'gasolina 95 proteccion']),
+    ('gasolina_95_e10', 'Gasolina 95 E10', ['gasolina 95 e10']),
+    ('gasolina_95_e5_premium', 'Gasolina 95 E5 Premium', ['gasolina 95 e5 premium', 'gasolina 95 premium']),
+    ('gasolina_95_e25', 'Gasolina 95 E25', ['gasolina 95 e25']),
+    ('gasolina_95_e85', 'Gasolina 95 E85', ['gasolina 95 e85']),
+    ('gasolina_98_e5', 'Gasolina 98 E5', ['gasolina 98 e5', 'gasolina 98']),
+    ('gasolina_98_e10', 'Gasolina 98 E10', ['gasolina 98 e10']),
+    ('gasolina_renovable', 'Gasolina renovable', ['gasolina renovable']),
+    ('gasoleo_a', 'Gasóleo A', ['gasoleo a', 'gasoleo a habitual', 'gasoil a', 'diesel a']),
+    ('gasoleo_premium', 'Gasóleo Premium', ['gasoleo premium', 'nuevo gasoleo a']),
+    ('gasoleo_b', 'Gasóleo B', ['gasoleo b']),
+    ('gasoleo_c', 'Gasóleo C', ['gasoleo c']),
+    ('gasoleo_maritimo', 'Gasóleo de uso marítimo', ['gasoleo de uso maritimo']),
+    ('diesel_renovable', 'Diésel renovable', ['diesel renovable']),
+    ('biodiesel', 'Biodiésel', ['biodiesel']),
+    ('bioetanol', 'Bioetanol', ['bioetanol']),
+    ('bioalcohol_pct', '% Bioalcohol', ['% bioalcohol', 'bioalcohol']),
+    ('glp', 'Gases licuados del petróleo', ['gases licuados del petroleo', 'glp']),
+    ('gnc', 'Gas natural comprimido', ['gas natural comprimido', 'gnc']),
+    ('gnl', 'Gas natural licuado', ['gas natural licuado', 'gnl']),
+    ('bgnc', 'BGNC', ['bgnc']),
+    ('bgnl', 'BGNL', ['bgnl']),
+    ('hidrogeno', 'Hidrógeno', ['hidrogeno']),
+    ('adblue', 'AdBlue', ['adblue']),
+    ('metanol', 'Metanol', ['metanol']),
+    ('amoniaco', 'Amoníaco', ['amoniaco']),
+]
+CODIGO_POR_GRAFIA = {grafia: codigo for codigo, _, grafias in COMBUSTIBLES for grafia in grafias}
+NOMBRE_POR_CODIGO = {codigo: nombre for codigo, nombre, _ in COMBUSTIBLES}
+
+def clave_combustible(cabecera):
+    """'Precio  gasóleo A\t' -> 'gasoleo a' (sin 'precio', acentos, mayúsculas ni espacios de más)."""
+    clave = ' '.join(clave_nombre(cabecera).split())
+    return clave[len('precio '):] if clave.startswith('precio ') else clave
+
+def codigo_combustible(cabecera):
+    """(codigo, nombre) canónicos para una cabecera de columna de precio."""
+    clave = clave_combustible(cabecera)
+    codigo = CODIGO_POR_GRAFIA.get(clave)
+    if codigo is None:
+        codigo = re.sub(r'[^a-z0-9%]+', '_', clave).replace('%', 'pct').strip('_') or 'desconocido'
+        return codigo, NOMBRE_POR_CODIGO.get(codigo, re.sub(r'^precio\s+', '', ' '.join(cabecera.split()), flags=re.I))
+    return codigo, NOMBRE_POR_CODIGO[codigo]
+
+# columnas de texto de la estación que pasan tal cual del CSV a la BD
+COLS_TEXTO = ('provincia', 'municipio', 'localidad', 'codigo_postal', 'direccion', 'margen', 'rotulo')
+
+def normalizar_bloques(rows, mapping, chunk_size=None):
+    """
+    Etapa de conversión del pipeline: agrupa las filas de texto en bloques de
+    `chunk_size` y devuelve, por bloque, columnas tipadas listas para insertar:
+        {'n', <COLS_TEXTO>, 'latitud', 'longitud', 'fecha', 'precios'}
+    donde 'precios' es una lista plana [(k, columna, precio)] con k = fila dentro del bloque.
+    Es un generador: solo hay un bloque en memoria cada vez.
+    """
+    convertir = normalizar_bloque_columnar if IMPORT_PARSER == 'pandas' else normalizar_bloque_escalar
+    for lote in en_lotes(rows, chunk_size or BATCH_SIZE):
+        yield convertir(lote, mapping)
+
+def normalizar_bloque_escalar(lote, mapping):
+    bloque = {key: [valor_col(r, mapping, key) for r in lote] for key in COLS_TEXTO}
+    bloque['n'] = len(lote)
+    bloque['latitud'] = [str_to_float(valor_col(r, mapping, 'latitud')) for r in lote]
+    bloque['longitud'] = [str_to_float(valor_col(r, mapping, 'longitud')) for r in lote]
+    fechas = [parse_date(valor_col(r, mapping, 'toma_de_datos')) for r in lote]
+    bloque['fecha'] = [f.strftime("%Y-%m-%d %H:%M:%S") if f else None for f in fechas]
+    precios = []
+    for k, r in enumerate(lote):
+        for i_col, col_name in mapping['price_cols']:
+            p = str_to_float(r[i_col])
+            if p is not None:
+                precios.append((k, col_name, float(f"{p:.4f}")))
+    bloque['precios'] = precios
+    return bloque
+
+# ---------------- conversión columnar (pandas/NumPy) ----------------
+def floats_columnares(valores):
+    """
+    str_to_float vectorizado sobre una secuencia de textos: devuelve un array float64
+    con NaN donde la versión escalar devolvería None (vacías, ilegibles, 'nan', 'inf').
+    """
+    textos = np.asarray(valores, dtype=object)
+    salida = np.full(len(textos), np.nan)
+    llenos = np.flatnonzero(textos != '')
+    if len(llenos) == 0:
+        return salida
+    crudos = np.char.replace(textos[llenos].astype(str), ',', '.')
+    try:
+        salida[llenos] = crudos.astype('float64')
+    except ValueError:
+        # algún valor raro en el bloque (espacios de miles, etc.): pandas con coerce
+        # y la función escalar para lo que este no entienda
+        convertidos = pd.to_numeric(pd.Series(crudos, dtype=object), errors='coerce').to_numpy(dtype='float64')
+        for k in np.flatnonzero(np.isnan(convertidos)):
+            v = str_to_float(textos[llenos[k]])
+            convertidos[k] = np.nan if v is None else v
+        salida[llenos] = convertidos
+    salida[np.isinf(salida)] = np.nan
+    return salida
+
+def fechas_columnares(serie):
+    """
+    parse_date vectorizado: devuelve una lista de textos 'YYYY-mm-dd HH:MM:SS' (o None)
+    probando los mismos formatos que parse_date, en el mismo orden.
+    """
+    fechas = pd.to_datetime(serie, format="%d/%m/%Y %H:%M", errors='coerce')
+    for fmt in ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y"):
+        faltan = fechas.isna() & (serie != '')
+        if not faltan.any():
+            break
+        fechas[faltan] = pd.to_datetime(serie[faltan], format=fmt, errors='coerce')
+    texto = fechas.dt.strftime("%Y-%m-%d %H:%M:%S").astype(object).where(fechas.notna(), None).tolist()
+    for i in np.flatnonzero((fechas.isna() & (serie != '')).to_numpy()):
+        fecha_dt = parse_date(serie.iat[i])
+        texto[i] = fecha_dt.strftime("%Y-%m-%d %H:%M:%S") if fecha_dt else None
+    return texto
+
+def normalizar_bloque_columnar(lote, mapping):
+    """Equivalente a normalizar_bloque_escalar, pero convirtiendo columnas enteras con NumPy/pandas."""
+    matriz = np.array(lote, dtype=object).reshape(len(lote), -1)
+    n = len(lote)
+
+    def columna(key):
+        i = mapping.get(key)
+        return matriz[:, i].tolist() if i is not None else [''] * n
+
+    bloque = {key: columna(key) for key in COLS_TEXTO}
+    bloque['n'] = n
+    for key in ('latitud', 'longitud'):
+        bloque[key] = [None if math.isnan(v) else v for v in floats_columnares(columna(key)).tolist()]
+    bloque['fecha'] = fechas_columnares(pd.Series(columna('toma_de_datos'), dtype=object))
+
+    precios = []
+    if mapping['price_cols'] and n:
+        cols_precio = [i for i, _ in mapping['price_cols']]
+        nombres_precio = [name for _, name in mapping['price_cols']]
+        valores = floats_columnares(matriz[:, cols_precio].ravel()).reshape(n, len(cols_precio))
+        filas, cols = np.nonzero(~np.isnan(valores))
+        # el redondeo a 4 decimales es el de la versión escalar: np.round no siempre coincide
+        # con el decimal correcto (0.00005 -> 0.0 en vez de 0.0001)
+        precios = [(k, nombres_precio[j], float(f"{p:.4f}"))
+                   for k, j, p in zip(filas.tolist(), cols.tolist(), valores[filas, cols].tolist())]
+    bloque['precios'] = precios
+    return bloque
+
+def en_lotes(iterable, n):
+    lote = []
+    for x in iterable:
+        lote.append(x)
+        if len(lote) >= n:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+# ---------------- Métricas ----------------
+# Tiempo por fase de cada pasada: parseo (lectura del CSV) y mapeo (columnas y conversión de tipos)
+# en los procesos de parseo; insercion, commit, historico, sombra, resumenes y publicacion en este.
+# Los tiempos son exclusivos (el commit de un lote no cuenta dentro de 'insercion') y se suman
+# entre hilos y procesos, así que pueden superar la duración de la pasada.
+_metricas_lock = threading.Lock()
+_fases = threading.local()
+_pasada = {'inicio': None, 'tiempos': {}, 'filas': {}}
+_acumulado = {'pasadas': 0, 'tiempos': {}, 'filas': {}}
+
+def sumar_tiempo(fase, segundos):
+    with _metricas_lock:
+        _pasada['tiempos'][fase] = _pasada['tiempos'].get(fase, 0.0) + segundos
+
+def sumar_filas(fuente, n):
+    with _metricas_lock:
+        _pasada['filas'][fuente] = _pasada['filas'].get(fuente, 0) + n
+
+@contextlib.contextmanager
+def medir(fase):
+    """Suma a `fase` el tiempo del bloque, descontando el de las fases medidas dentro de él."""
+    pila = _fases.__dict__.setdefault('pila', [])
+    pila.append(0.0)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        total = time.perf_counter() - t0
+        anidado = pila.pop()
+        if pila:
+            pila[-1] += total
+        sumar_tiempo(fase, total - anidado)
+
+def iter_fase(elementos, fase, cuenta=None):
+    """
+    Devuelve los elementos de `elementos` midiendo como `fase` el tiempo de obtener cada uno
+    (para los generadores que se consumen dentro de otra fase). Con `cuenta`, suma en cuenta[0]
+    los elementos devueltos.
+    """
+    it = iter(elementos)
+    while True:
+        with medir(fase):
+            x = next(it, None)
+        if x is None:
+            return
+        if cuenta is not None:
+            cuenta[0] += 1
+        yield x
+
+def iter_medido(filas, acumulado):
+    """Devuelve las filas de `filas` sumando a acumulado[0] el tiempo empleado en leerlas."""
+    it = iter(filas)
+    while True:
+        t0 = time.perf_counter()
+        fila = next(it, None)
+        acumulado[0] += time.perf_counter() - t0
+        if fila is None:
+            return
+        yield fila
+
+class ConexionMedida:
+    """Conexión de mysql.connector cuyo commit() se mide como fase 'commit'."""
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def commit(self):
+        with medir('commit'):
+            return self._conn.commit()
+
+def connect(**kwargs):
+    return ConexionMedida(conectar_mysql(**kwargs))
+
+def iniciar_pasada():
+    with _metricas_lock:
+        _pasada.update(inicio=time.perf_counter(), tiempos={}, filas={})
+
+def cerrar_pasada(n_ficheros):
+    """Resumen de la pasada (filas/s y tiempo por fase) y, con IMPORT_METRICAS_FICHERO, métricas acumuladas."""
+    with _metricas_lock:
+        duracion = time.perf_counter() - _pasada['inicio']
+        tiempos = dict(_pasada['tiempos'])
+        filas = dict(_pasada['filas'])
+        _acumulado['pasadas'] += 1
+        for fase, segundos in tiempos.items():
+            _acumulado['tiempos'][fase] = _acumulado['tiempos'].get(fase, 0.0) + segundos
+        for fuente, n in filas.items():
+            _acumulado['filas'][fuente] = _acumulado['filas'].get(fuente, 0) + n
+    total = sum(filas.values())
+    por_segundo = total / duracion if duracion else 0.0
+    print(f"[OK] Pasada de {n_ficheros} ficheros: {total} filas en {duracion:.1f} s ({por_segundo:.0f} filas/s); "
+          + ", ".join(f"{fase} {segundos:.2f} s" for fase, segundos in sorted(tiempos.items(), key=lambda x: -x[1])))
+    if IMPORT_METRICAS_FICHERO:
+        try:
+            escribir_metricas(IMPORT_METRICAS_FICHERO, duracion, por_segundo, tiempos)
+        except OSError as e:
+            print(f"Aviso: no se pudieron escribir las métricas en {IMPORT_METRICAS_FICHERO}: {e}")
+
+def escribir_metricas(ruta, duracion, por_segundo, tiempos):
+    """Fichero en formato de texto de Prometheus, sustituido de una vez (nunca se lee a medias)."""
+    with _metricas_lock:
+        acumulado = {'pasadas': _acumulado['pasadas'], 'tiempos': dict(_acumulado['tiempos']),
+                     'filas': dict(_acumulado['filas'])}
+    lineas = [
+        "# HELP eess_importador_pasadas_total Pasadas de importación terminadas",
+        "# TYPE eess_importador_pasadas_total counter",
+        f"eess_importador_pasadas_total {acumulado['pasadas']}",
+        "# HELP eess_importador_filas_total Filas del CSV volcadas por fuente",
+        "# TYPE eess_importador_filas_total counter",
+    ]
+    lineas += [f'eess_importador_filas_total{{fuente="{f}"}} {n}' for f, n in sorted(acumulado['filas'].items())]
+    lineas += ["# HELP eess_importador_fase_segundos_total Tiempo acumulado por fase",
+               "# TYPE eess_importador_fase_segundos_total counter"]
+    lineas += [f'eess_importador_fase_segundos_total{{fase="{f}"}} {s:.6f}' for f, s in sorted(acumulado['tiempos'].items())]
+    lineas += ["# HELP eess_importador_ultima_fase_segundos Tiempo por fase en la última pasada",
+               "# TYPE eess_importador_ultima_fase_segundos gauge"]
+    lineas += [f'eess_importador_ultima_fase_segundos{{fase="{f}"}} {s:.6f}' for f, s in sorted(tiempos.items())]
+    lineas += [
+        "# HELP eess_importador_ultima_duracion_segundos Duración de la última pasada",
+        "# TYPE eess_importador_ultima_duracion_segundos gauge",
+        f"eess_importador_ultima_duracion_segundos {duracion:.6f}",
+        "# HELP eess_importador_ultima_filas_por_segundo Filas por segundo de la última pasada",
+        "# TYPE eess_importador_ultima_filas_por_segundo gauge",
+        f"eess_importador_ultima_filas_por_segundo {por_segundo:.3f}",
+        "# HELP eess_importador_ultima_pasada_timestamp_segundos Fin de la última pasada (epoch)",
+        "# TYPE eess_importador_ultima_pasada_timestamp_segundos gauge",
+        f"eess_importador_ultima_pasada_timestamp_segundos {time.time():.0f}",
+    ]
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    os.makedirs(directorio, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directorio, delete=False, suffix='.tmp') as f:
+        f.write('\n'.join(lineas) + '\n')
+    os.replace(f.name, ruta)
+
 # ---------------- DB ----------------
 def wait_for_db():
     for attempt in range(MAX_RETRIES):
@@ -146,10 +512,517 @@ def wait_for_db():
             time.sleep(SLEEP_SEC)
     return False
 
-def insert_rows_mysql(rows, header, mapping, fuente_label):
+# tablas de estaciones y precios en las que se escribe: las vivas o, en modo sombra, sus copias
+TABLAS = {'estacion': 'estacion', 'precio': 'precio'}
+TABLAS_SOMBRA = {t: f'{t}_nuevo' for t in TABLAS}
+
+SQL_INSERT_ESTACION = """
+    INSERT INTO {estacion} (codigo_externo, id_empresa, nombre, provincia, municipio, localidad, codigo_postal, direccion, margen, latitud, longitud, ultima_actualizacion, horario, fuente, archivo_origen)
+    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+"""
+SQL_INSERT_PRECIO = "INSERT INTO {precio} (id_estacion, id_combustible, precio, fecha_registro) VALUES (%s,%s,%s,%s)"
+# upserts por clave primaria (modo incremental): solo se usan con ids que ya existen
+SQL_UPSERT_ESTACION = """
+    INSERT INTO {estacion} (id, codigo_externo, id_empresa, nombre, provincia, municipio, localidad, codigo_postal, direccion, margen, latitud, longitud, ultima_actualizacion, horario, fuente, archivo_origen)
+    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+    ON DUPLICATE KEY UPDATE id_empresa=VALUES(id_empresa), provincia=VALUES(provincia), municipio=VALUES(municipio),
+        localidad=VALUES(localidad), codigo_postal=VALUES(codigo_postal), direccion=VALUES(direccion), margen=VALUES(margen),
+        latitud=VALUES(latitud), longitud=VALUES(longitud), ultima_actualizacion=VALUES(ultima_actualizacion),
+        archivo_origen=VALUES(archivo_origen)
+"""
+SQL_UPSERT_PRECIO = """
+    INSERT INTO {precio} (id, id_estacion, id_combustible, precio, fecha_registro) VALUES (%s,%s,%s,%s,%s)
+    ON DUPLICATE KEY UPDATE precio=VALUES(precio), fecha_registro=VALUES(fecha_registro)
+"""
+
+def tuplas_estacion(bloque, ids_emp, fuente_label, archivo_origen, claves=None):
+    """Parámetros de SQL_INSERT_ESTACION para cada fila del bloque (codigo_externo = claves[k] si se dan)."""
+    claves = claves or [None] * bloque['n']
+    return [(clave, ids_emp.get(rotulo), None, provincia, municipio, localidad, codigo_postal,
+             direccion, margen, lat, lon, fecha, None, fuente_label, archivo_origen)
+            for clave, provincia, municipio, localidad, codigo_postal, direccion, margen, rotulo, lat, lon, fecha
+            in zip(claves, *(bloque[c] for c in COLS_TEXTO), bloque['latitud'], bloque['longitud'], bloque['fecha'])]
+
+def insertar_estaciones(cur, estaciones, tablas=TABLAS):
+    """INSERT multi-fila de estaciones; devuelve el id de la primera."""
+    # InnoDB reserva de una vez los ids de un INSERT multi-fila con número de filas conocido
+    # ("simple insert"), así que son consecutivos aunque haya otros importadores en paralelo
+    cur.executemany(SQL_INSERT_ESTACION.format(**tablas), estaciones)
+    primer_id = cur.lastrowid
+    if cur.rowcount != len(estaciones) or not primer_id:
+        raise RuntimeError(f"Inserción de estaciones incompleta: {cur.rowcount}/{len(estaciones)}")
+    return primer_id
+
+def id_insertado(cur, tabla, valores):
+    """
+    Inserta una fila ({columna: valor}) en `tabla` y devuelve su id o, si choca con una clave
+    única, el de la fila existente (ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)): a
+    diferencia de INSERT IGNORE, nunca se queda sin id.
+    """
+    marcas = ','.join(['%s'] * len(valores))
+    cur.execute(f"INSERT INTO {tabla} ({', '.join(valores)}) VALUES ({marcas}) "
+                f"ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)", tuple(valores.values()))
+    return cur.lastrowid
+
+def resolver_ids(cur, tabla, nombres):
+    """
+    Inserta (INSERT IGNORE) los nombres que falten en `tabla` (empresa o combustible)
+    y devuelve {nombre: id} con una sola consulta por lote.
+    """
+    nombres = list(dict.fromkeys(nombres))
+    if not nombres:
+        return {}
+    cur.executemany(f"INSERT IGNORE INTO {tabla} (nombre) VALUES (%s)", [(n,) for n in nombres])
+    marcas = ','.join(['%s'] * len(nombres))
+    cur.execute(f"SELECT id, nombre FROM {tabla} WHERE nombre IN ({marcas})", tuple(nombres))
+    por_clave = {clave_nombre(nombre): id_ for id_, nombre in cur.fetchall()}
+    ids = {}
+    for n in nombres:
+        id_ = por_clave.get(clave_nombre(n))
+        if id_ is None:
+            # la collation de MySQL es más laxa que clave_nombre (o el INSERT IGNORE se descartó):
+            # se inserta de nuevo tomando el id de la fila con la que choca
+            id_ = id_insertado(cur, tabla, {'nombre': n})
+        ids[n] = id_
+    return ids
+
+class CacheDimension:
+    """
+    Caché en memoria nombre -> id de una tabla de dimensión (empresa o combustible).
+    Se precarga una vez al arrancar; después solo se va a MySQL para los nombres
+    que no se han visto nunca, y en un único lote.
+    La caché la comparten los hilos de escritura, así que solo guarda ids de filas confirmadas:
+    los nombres nuevos se insertan en una conexión propia en autocommit, no en la transacción
+    de quien pregunta (otro hilo podría usar el id antes del commit, o quedarse con él tras un rollback).
+    """
+    def __init__(self, tabla):
+        self.tabla = tabla
+        self.ids = {}  # clave_nombre(nombre) -> id
+        self._lock = threading.Lock()  # compartida entre los hilos de escritura
+        self._conn = None  # conexión en autocommit para los nombres nuevos
+
+    def _cursor_propio(self):
+        """Cursor de la conexión propia (se abre, o se reabre si se ha caído, al necesitarla)."""
+        if self._conn is None or not self._conn.is_connected():
+            self._conn = connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD,
+                                 database=MYSQL_DB, autocommit=True)
+        return self._conn.cursor()
+
+    def precargar(self, cur):
+        cur.execute(f"SELECT id, nombre FROM {self.tabla}")
+        for id_, nombre in cur.fetchall():
+            self.ids[clave_nombre(nombre)] = id_
+        return self
+
+    def resolver(self, cur, nombres):
+        """{nombre: id}; `cur` es el de quien pregunta, pero los nombres nuevos no se escriben con él."""
+        nombres = list(dict.fromkeys(nombres))
+        nuevos = [n for n in nombres if clave_nombre(n) not in self.ids]
+        if nuevos:
+            with self._lock:
+                for n, id_ in resolver_ids(self._cursor_propio(), self.tabla, nuevos).items():
+                    if id_ is not None:
+                        self.ids[clave_nombre(n)] = id_
+        return {n: self.ids.get(clave_nombre(n)) for n in nombres}
+
+    def id(self, cur, nombre):
+        return self.resolver(cur, [nombre])[nombre]
+
+class CacheCombustible(CacheDimension):
+    """
+    Como CacheDimension pero por código canónico: todas las grafías de una cabecera
+    ('Precio gasóleo A', 'Precio Gasoleo A ') van al mismo combustible.
+    """
+    def __init__(self):
+        super().__init__('combustible')  # ids: codigo -> id
+
+    def precargar(self, cur):
+        normalizar_combustibles(cur)
+        cur.execute("SELECT id, codigo FROM combustible")
+        for id_, codigo in cur.fetchall():
+            self.ids[codigo] = id_
+        return self
+
+    def resolver(self, cur, nombres):
+        nombres = list(dict.fromkeys(nombres))
+        codigos = {n: codigo_combustible(n) for n in nombres}
+        nuevos = dict(v for v in codigos.values() if v[0] not in self.ids)
+        if nuevos:
+            with self._lock:
+                cur = self._cursor_propio()
+                cur.executemany("INSERT IGNORE INTO combustible (codigo, nombre) VALUES (%s, %s)", list(nuevos.items()))
+                marcas = ','.join(['%s'] * len(nuevos))
+                cur.execute(f"SELECT id, codigo FROM combustible WHERE codigo IN ({marcas})", tuple(nuevos))
+                for id_, codigo in cur.fetchall():
+                    self.ids[codigo] = id_
+                for codigo, nombre in nuevos.items():
+                    if codigo not in self.ids:
+                        # descartado por uq_combustible_nombre: otro código ya usa ese nombre
+                        self.ids[codigo] = id_insertado(cur, 'combustible', {'codigo': codigo, 'nombre': nombre})
+                        print(f"Aviso: el combustible '{codigo}' comparte nombre ('{nombre}') con el id {self.ids[codigo]}; se usa ese")
+        return {n: self.ids.get(codigos[n][0]) for n in nombres}
+
+def normalizar_combustibles(cur):
+    """
+    Migra combustibles de cargas anteriores (nombre = cabecera tal cual, codigo NULL):
+    asigna el código canónico, funde en una sola fila las grafías del mismo combustible
+    (moviendo sus precios) y crea uq_combustible_codigo si la tabla no lo tiene.
+    """
+    cur.execute("SELECT id, codigo, nombre FROM combustible ORDER BY id")
+    grupos = {}
+    for id_, codigo_actual, nombre in cur.fetchall():
+        codigo, nombre_canonico = codigo_combustible(nombre) if codigo_actual is None else (codigo_actual, nombre)
+        grupos.setdefault(codigo, []).append((id_, codigo_actual, nombre, nombre_canonico))
+    cambios = 0
+    for codigo, filas in grupos.items():
+        # se conserva la fila que ya tenía el código o, si no, la más antigua
+        filas.sort(key=lambda f: (f[1] != codigo, f[0]))
+        id_keep, codigo_actual, nombre, nombre_canonico = filas[0]
+        sobran = [f[0] for f in filas[1:]]
+        if sobran:
+            marcas = ','.join(['%s'] * len(sobran))
+            cur.execute(f"UPDATE precio SET id_combustible=%s WHERE id_combustible IN ({marcas})", (id_keep, *sobran))
+            cur.execute(f"DELETE FROM combustible WHERE id IN ({marcas})", tuple(sobran))
+        if codigo_actual != codigo or nombre != nombre_canonico:
+            cur.execute("UPDATE combustible SET codigo=%s, nombre=%s WHERE id=%s", (codigo, nombre_canonico, id_keep))
+        cambios += len(sobran) + (codigo_actual != codigo)
+    cur.execute("SHOW INDEX FROM combustible WHERE Key_name = 'uq_combustible_codigo'")
+    if not cur.fetchall():
+        cur.execute("ALTER TABLE combustible ADD UNIQUE KEY uq_combustible_codigo (codigo)")
+        cambios += 1
+    if cambios:
+        print(f"[OK] Combustibles normalizados a código canónico ({cambios} cambios)")
+
+def asegurar_clave_estacion(cur):
+    """
+    Crea uq_estacion_clave (fuente, codigo_externo) en BD anteriores a la carga incremental.
+    Si hubiera claves repetidas, las copias más nuevas pasan a codigo_externo NULL: son filas
+    heredadas que la siguiente carga incremental de su fuente borra.
+    """
+    cur.execute("SHOW INDEX FROM estacion WHERE Key_name = 'uq_estacion_clave'")
+    if cur.fetchall():
+        return
+    cur.execute("""
+        UPDATE estacion s
+        JOIN (SELECT fuente, codigo_externo, MIN(id) AS id_keep FROM estacion
+              WHERE codigo_externo IS NOT NULL GROUP BY fuente, codigo_externo HAVING COUNT(*) > 1) d
+          ON s.fuente = d.fuente AND s.codigo_externo = d.codigo_externo AND s.id <> d.id_keep
+        SET s.codigo_externo = NULL
+    """)
+    repetidas = cur.rowcount
+    cur.execute("ALTER TABLE estacion ADD UNIQUE KEY uq_estacion_clave (fuente, codigo_externo)")
+    print(f"[OK] Creada uq_estacion_clave en estacion ({repetidas} claves repetidas anuladas)")
+
+# índices de mysql-init/ddl_estaciones.sql para las consultas de la web: los scripts de initdb solo
+# se ejecutan con el volumen nuevo, así que en una BD anterior se crean (o se rehacen con las
+# columnas actuales) al arrancar el importador
+INDICES_WEB = {
+    'estacion': [
+        ('idx_estacion_provincia', ('provincia',)),
+        ('idx_estacion_fuente_provincia', ('fuente', 'provincia')),
+        ('idx_estacion_fuente_empresa', ('fuente', 'id_empresa')),
+        ('idx_estacion_lat_lon', ('latitud', 'longitud')),  # caja de /cercanas (estaciones_en_caja)
+    ],
+    'precio': [
+        ('idx_precio_comb_precio', ('id_combustible', 'precio', 'id', 'id_estacion')),
+        ('idx_precio_estacion', ('id_estacion', 'id_combustible')),
+    ],
+}
+# sustituidos por los de INDICES_WEB (idx_precio_comb_precio empieza por id_combustible)
+INDICES_RETIRADOS = {'precio': ['idx_precio_combustible']}
+
+def asegurar_indices(cur):
+    """Crea los índices de INDICES_WEB que faltan, rehace los que tienen otras columnas y borra los retirados."""
+    for tabla, indices in INDICES_WEB.items():
+        cur.execute(f"SHOW INDEX FROM {tabla}")
+        actuales = {}
+        for fila in cur.fetchall():
+            # Table, Non_unique, Key_name, Seq_in_index, Column_name, ...
+            actuales.setdefault(fila[2], []).append((fila[3], fila[4]))
+        actuales = {nombre: tuple(c for _, c in sorted(cols)) for nombre, cols in actuales.items()}
+        cambios = []
+        for nombre, columnas in indices:
+            if nombre in actuales and actuales[nombre] != columnas:
+                cambios.append(f"DROP INDEX {nombre}")
+            if actuales.get(nombre) != columnas:
+                cambios.append(f"ADD INDEX {nombre} ({', '.join(columnas)})")
+        cambios += [f"DROP INDEX {nombre}" for nombre in INDICES_RETIRADOS.get(tabla, []) if nombre in actuales]
+        if cambios:
+            # una sola sentencia: las claves ajenas nunca se quedan sin índice que las cubra
+            t0 = time.time()
+            cur.execute(f"ALTER TABLE {tabla} " + ", ".join(cambios))
+            print(f"[OK] Índices de {tabla} actualizados en {time.time() - t0:.1f}s: {', '.join(cambios)}")
+
+def precargar_dimensiones(cur):
+    """
+    Precarga empresa y combustible en memoria: {'empresa': CacheDimension, 'combustible': CacheCombustible}.
+    Antes completa las claves únicas y los índices que faltan en BD creadas con versiones anteriores.
+    """
+    asegurar_clave_estacion(cur)
+    asegurar_indices(cur)
+    return {'empresa': CacheDimension('empresa').precargar(cur), 'combustible': CacheCombustible().precargar(cur)}
+
+def cargar_dimensiones():
+    with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB) as conn:
+        cur = conn.cursor()
+        dims = precargar_dimensiones(cur)
+        conn.commit()
+        cur.close()
+    print("Dimensiones precargadas:", {t: len(d.ids) for t, d in dims.items()})
+    return dims
+
+def insert_rows_mysql_lotes(rows, header, mapping, fuente_label, archivo_origen=None, batch_size=BATCH_SIZE, dims=None, bloques=None):
+    """
+    Variante por lotes de insert_rows_mysql: agrupa estaciones y precios en INSERT
+    multi-fila (executemany) de `batch_size` estaciones y hace un commit por lote.
+    `rows` puede ser cualquier iterable (p.ej. el generador de iter_header_and_rows):
+    solo se mantiene en memoria un lote cada vez. Si se pasan `bloques` ya normalizados
+    (importación en paralelo) se usan directamente y `rows` se ignora.
+    """
+    archivo_origen = archivo_origen or os.path.basename(CSV_TER)
+    total_est = 0
+    total_pre = 0
     try:
         with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB, autocommit=False) as conn:
             cur = conn.cursor()
+            if dims is None:
+                dims = precargar_dimensiones(cur)
+            ids_comb = dims['combustible'].resolver(cur, [col_name for _, col_name in mapping['price_cols']])
+            conn.commit()
+            for bloque in (bloques if bloques is not None else normalizar_bloques(rows, mapping, chunk_size=batch_size)):
+                ids_emp = dims['empresa'].resolver(cur, bloque['rotulo'])
+                estaciones = tuplas_estacion(bloque, ids_emp, fuente_label, archivo_origen)
+                primer_id = insertar_estaciones(cur, estaciones)
+
+                precios = [(primer_id + k, ids_comb[col_name], p, bloque['fecha'][k])
+                           for k, col_name, p in bloque['precios']]
+                if precios:
+                    cur.executemany(SQL_INSERT_PRECIO.format(**TABLAS), precios)
+                conn.commit()
+                total_est += len(estaciones)
+                total_pre += len(precios)
+            print(f"[OK] Inserción por lotes completada para fuente: {fuente_label} ({total_est} estaciones, {total_pre} precios)")
+    except Error as e:
+        print("Error MySQL:", e)
+        sys.exit(1)
+
+# ---------------- modo incremental ----------------
+def clave_estacion(fuente, codigo_postal, direccion, margen, lat, lon, rotulo):
+    """
+    Identidad estable de una estación entre instantáneas (se guarda en estacion.codigo_externo).
+    El rótulo forma parte de la clave porque en el fichero hay parejas de postes distintos
+    en la misma dirección, margen y coordenadas que solo se distinguen por él.
+    """
+    partes = [fuente, (codigo_postal or '').strip(), clave_nombre(direccion or ''), (margen or '').strip().upper(),
+              '' if lat is None else f"{lat:.6f}", '' if lon is None else f"{lon:.6f}", clave_nombre(rotulo or '')]
+    return hashlib.sha1('|'.join(partes).encode('utf-8')).hexdigest()
+
+def claves_bloque(bloque, fuente_label, repetidas):
+    """
+    clave_estacion de cada fila del bloque. `repetidas` (dict compartido entre bloques de
+    un mismo fichero) numera las filas idénticas para no fusionarlas en una sola estación.
+    """
+    claves = []
+    for k in range(bloque['n']):
+        clave = clave_estacion(fuente_label, bloque['codigo_postal'][k], bloque['direccion'][k], bloque['margen'][k],
+                               bloque['latitud'][k], bloque['longitud'][k], bloque['rotulo'][k])
+        n_rep = repetidas[clave] = repetidas.get(clave, 0) + 1
+        if n_rep > 1:
+            clave = hashlib.sha1(f"{clave}#{n_rep}".encode('utf-8')).hexdigest()
+        claves.append(clave)
+    return claves
+
+def insert_rows_mysql_incremental(rows, header, mapping, fuente_label, archivo_origen=None, batch_size=BATCH_SIZE, dims=None, bloques=None,
+                                  tablas=TABLAS):
+    """
+    Carga incremental de una instantánea completa de `fuente_label`:
+    - estaciones identificadas por clave_estacion: las nuevas se insertan y las conocidas
+      se actualizan en su sitio (no se duplican entre ejecuciones);
+    - precio guarda el valor vigente por (estación, combustible) y solo se escriben
+      los que son nuevos o han cambiado respecto a la instantánea anterior;
+    - los precios que ya no aparecen se borran, igual que las filas heredadas de cargas
+      append (codigo_externo NULL) de esa fuente.
+    `tablas` indica dónde se escribe (TABLAS_SOMBRA en modo sombra).
+    """
+    archivo_origen = archivo_origen or os.path.basename(CSV_TER)
+    stats = {'nuevas': 0, 'actualizadas': 0, 'precios_escritos': 0, 'precios_borrados': 0}
+    try:
+        with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB, autocommit=False) as conn:
+            cur = conn.cursor()
+            if dims is None:
+                dims = precargar_dimensiones(cur)
+            ids_comb = dims['combustible'].resolver(cur, [col_name for _, col_name in mapping['price_cols']])
+            conn.commit()
+
+            # estado de la instantánea anterior
+            cur.execute(f"SELECT id, codigo_externo FROM {tablas['estacion']} WHERE fuente=%s AND codigo_externo IS NOT NULL", (fuente_label,))
+            ids_est = {clave: id_ for id_, clave in cur.fetchall()}
+            cur.execute(f"""
+                SELECT p.id, p.id_estacion, p.id_combustible, p.precio
+                FROM {tablas['precio']} p JOIN {tablas['estacion']} s ON p.id_estacion = s.id
+                WHERE s.fuente=%s AND s.codigo_externo IS NOT NULL
+            """, (fuente_label,))
+            previos = {(id_est, id_comb): (id_, float(pr)) for id_, id_est, id_comb, pr in cur.fetchall()}
+
+            vistos = set()
+            repetidas = {}
+            for bloque in (bloques if bloques is not None else normalizar_bloques(rows, mapping, chunk_size=batch_size)):
+                ids_emp = dims['empresa'].resolver(cur, bloque['rotulo'])
+                claves = claves_bloque(bloque, fuente_label, repetidas)
+                estaciones = tuplas_estacion(bloque, ids_emp, fuente_label, archivo_origen, claves=claves)
+
+                id_fila = [ids_est.get(c) for c in claves]
+                conocidas = [(id_,) + est for id_, est in zip(id_fila, estaciones) if id_ is not None]
+                nuevas = [k for k, id_ in enumerate(id_fila) if id_ is None]
+                if conocidas:
+                    cur.executemany(SQL_UPSERT_ESTACION.format(**tablas), conocidas)
+                if nuevas:
+                    primer_id = insertar_estaciones(cur, [estaciones[k] for k in nuevas], tablas)
+                    for j, k in enumerate(nuevas):
+                        id_fila[k] = ids_est[claves[k]] = primer_id + j
+
+                cambios = []
+                for k, col_name, p in bloque['precios']:
+                    par = (id_fila[k], ids_comb[col_name])
+                    vistos.add(par)
+                    previo = previos.get(par)
+                    if previo is None or previo[1] != p:
+                        cambios.append((previo[0] if previo else None, par[0], par[1], p, bloque['fecha'][k]))
+                if cambios:
+                    cur.executemany(SQL_UPSERT_PRECIO.format(**tablas), cambios)
+                conn.commit()
+                stats['nuevas'] += len(nuevas)
+                stats['actualizadas'] += len(conocidas)
+                stats['precios_escritos'] += len(cambios)
+
+            obsoletos = [previos[par][0] for par in previos if par not in vistos]
+            for lote in en_lotes(obsoletos, batch_size):
+                cur.execute(f"DELETE FROM {tablas['precio']} WHERE id IN ({','.join(['%s'] * len(lote))})", tuple(lote))
+            stats['precios_borrados'] = len(obsoletos)
+            cur.execute(f"DELETE FROM {tablas['estacion']} WHERE fuente=%s AND codigo_externo IS NULL", (fuente_label,))
+            conn.commit()
+            print(f"[OK] Importación incremental completada para fuente: {fuente_label} {stats}")
+    except Error as e:
+        print("Error MySQL:", e)
+        sys.exit(1)
+    return stats
+
+# ---------------- modo LOAD DATA (recarga completa) ----------------
+# Las tablas de staging se declaran como las vivas (solo DEFAULT CHARSET=utf8mb4) para que tengan
+# su misma collation: los JOIN por rotulo, codigo y clave comparan columnas de unas y otras.
+SQL_STAGING = [
+    """
+    CREATE TEMPORARY TABLE stg_estacion (
+      fila INT PRIMARY KEY,
+      clave VARCHAR(100) NOT NULL,
+      provincia VARCHAR(100), municipio VARCHAR(100), localidad VARCHAR(100), codigo_postal VARCHAR(20),
+      direccion VARCHAR(255), margen VARCHAR(20), rotulo VARCHAR(200),
+      latitud DECIMAL(10,7), longitud DECIMAL(10,7), fecha DATETIME
+    ) DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TEMPORARY TABLE stg_precio (
+      fila INT NOT NULL,
+      codigo VARCHAR(80) NOT NULL,
+      precio DECIMAL(10,4) NOT NULL,
+      KEY (fila)
+    ) DEFAULT CHARSET=utf8mb4
+    """,
+]
+
+def valor_tsv(v):
+    """Formato de campo para LOAD DATA con los delimitadores por defecto (tab, \\n, escape \\)."""
+    if v is None:
+        return '\\N'
+    return (str(v).replace('\\', '\\\\').replace('\t', '\\t')
+                  .replace('\n', '\\n').replace('\r', '\\r'))
+
+def escribir_staging_tsv(rows, mapping, fuente_label, batch_size=BATCH_SIZE, bloques=None):
+    """
+    Vuelca las filas normalizadas a dos TSV temporales (estaciones y precios) en streaming.
+    El contenido es el mismo que insertan los otros modos; solo cambia el formato.
+    Devuelve (ruta_estaciones, ruta_precios, n_estaciones, n_precios).
+    """
+    f_est = tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', suffix='_estacion.tsv', delete=False)
+    f_pre = tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', suffix='_precio.tsv', delete=False)
+    n_est = 0
+    n_pre = 0
+    repetidas = {}
+    codigos = {col_name: codigo_combustible(col_name)[0] for _, col_name in mapping['price_cols']}
+    with f_est, f_pre:
+        for bloque in (bloques if bloques is not None else normalizar_bloques(rows, mapping, chunk_size=batch_size)):
+            claves = claves_bloque(bloque, fuente_label, repetidas)
+            for k in range(bloque['n']):
+                campos = [n_est + k, claves[k]] + [bloque[c][k] for c in COLS_TEXTO] + \
+                         [bloque['latitud'][k], bloque['longitud'][k], bloque['fecha'][k]]
+                f_est.write('\t'.join(valor_tsv(v) for v in campos) + '\n')
+            for k, col_name, p in bloque['precios']:
+                f_pre.write(f"{n_est + k}\t{valor_tsv(codigos[col_name])}\t{p}\n")
+            n_est += bloque['n']
+            n_pre += len(bloque['precios'])
+    return f_est.name, f_pre.name, n_est, n_pre
+
+def insert_rows_mysql_loaddata(rows, header, mapping, fuente_label, archivo_origen=None, batch_size=BATCH_SIZE, dims=None, bloques=None):
+    """
+    Recarga completa de `fuente_label` con LOAD DATA LOCAL INFILE:
+    filas normalizadas -> TSV temporales -> tablas de staging -> SQL por conjuntos
+    (empresa/combustible, estacion y precio), todo en una única transacción que
+    sustituye las estaciones de esa fuente. Las claves de estación son las mismas
+    que usa el modo incremental, así que ambos modos se pueden alternar.
+    Requiere local_infile=1 en el servidor (ver docker-compose.yml).
+    """
+    archivo_origen = archivo_origen or os.path.basename(CSV_TER)
+    ruta_est, ruta_pre, n_est, n_pre = escribir_staging_tsv(rows, mapping, fuente_label, batch_size=batch_size, bloques=bloques)
+    try:
+        with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB,
+                     autocommit=False, allow_local_infile=True) as conn:
+            cur = conn.cursor()
+            for sql in SQL_STAGING:
+                cur.execute(sql)
+            cur.execute(f"""
+                LOAD DATA LOCAL INFILE %s INTO TABLE stg_estacion CHARACTER SET utf8mb4
+                (fila, clave, {', '.join(COLS_TEXTO)}, latitud, longitud, fecha)
+            """, (ruta_est,))
+            cur.execute("LOAD DATA LOCAL INFILE %s INTO TABLE stg_precio CHARACTER SET utf8mb4 (fila, codigo, precio)", (ruta_pre,))
+
+            cur.execute("INSERT IGNORE INTO empresa (nombre) SELECT DISTINCT rotulo FROM stg_estacion WHERE rotulo IS NOT NULL")
+            if dims is None:
+                dims = precargar_dimensiones(cur)
+            dims['combustible'].resolver(cur, [col_name for _, col_name in mapping['price_cols']])
+            cur.execute("DELETE FROM estacion WHERE fuente=%s", (fuente_label,))
+            cur.execute("""
+                INSERT INTO estacion (codigo_externo, id_empresa, provincia, municipio, localidad, codigo_postal, direccion,
+                                      margen, latitud, longitud, ultima_actualizacion, fuente, archivo_origen)
+                SELECT se.clave, e.id, se.provincia, se.municipio, se.localidad, se.codigo_postal, se.direccion,
+                       se.margen, se.latitud, se.longitud, se.fecha, %s, %s
+                FROM stg_estacion se
+                LEFT JOIN empresa e ON e.nombre = se.rotulo
+                ORDER BY se.fila
+            """, (fuente_label, archivo_origen))
+            cur.execute("""
+                INSERT INTO precio (id_estacion, id_combustible, precio, fecha_registro)
+                SELECT s.id, c.id, sp.precio, se.fecha
+                FROM stg_precio sp
+                JOIN stg_estacion se ON se.fila = sp.fila
+                JOIN estacion s ON s.fuente = %s AND s.codigo_externo = se.clave
+                JOIN combustible c ON c.codigo = sp.codigo
+            """, (fuente_label,))
+            n_pre_bd = cur.rowcount
+            conn.commit()
+            print(f"[OK] Recarga LOAD DATA completada para fuente: {fuente_label} ({n_est} estaciones, {n_pre_bd}/{n_pre} precios)")
+    except Error as e:
+        print("Error MySQL:", e)
+        sys.exit(1)
+    finally:
+        os.remove(ruta_est)
+        os.remove(ruta_pre)
+
+def insert_rows_mysql(rows, header, mapping, fuente_label, dims=None):
+    try:
+        with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB, autocommit=False) as conn:
+            cur = conn.cursor()
+            if dims is None:
+                dims = precargar_dimensiones(cur)
             for r in rows:
                 provincia = r[mapping['provincia']] if mapping['provincia'] is not None else ''
                 municipio = r[mapping['municipio']] if mapping['municipio'] is not None else ''
@@ -166,17 +1039,11 @@ def insert_rows_mysql(rows, header, mapping, fuente_label):
                 lat_f = str_to_float(lat)
                 fecha_dt = parse_date(toma)
 
-                # empresa (upsert simple)
-                cur.execute("INSERT IGNORE INTO empresa (nombre) VALUES (%s)", (rotulo,))
-                cur.execute("SELECT id FROM empresa WHERE nombre=%s LIMIT 1", (rotulo,))
-                res = cur.fetchone()
-                id_empresa = res[0] if res else None
+                # empresa (desde la caché; solo va a MySQL si es nueva)
+                id_empresa = dims['empresa'].id(cur, rotulo)
 
                 # insertar estacion
-                cur.execute("""
-                    INSERT INTO estacion (codigo_externo, id_empresa, nombre, provincia, municipio, localidad, codigo_postal, direccion, margen, latitud, longitud, ultima_actualizacion, horario, fuente, archivo_origen)
-                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """, (None, id_empresa, None, provincia, municipio, localidad, codigo_postal, direccion, margen, lat_f, lon_f,
+                cur.execute(SQL_INSERT_ESTACION.format(**TABLAS), (None, id_empresa, None, provincia, municipio, localidad, codigo_postal, direccion, margen, lat_f, lon_f,
                       fecha_dt.strftime("%Y-%m-%d %H:%M:%S") if fecha_dt else None, None, fuente_label, os.path.basename(CSV_TER) ))
                 id_estacion = cur.lastrowid
 
@@ -186,10 +1053,8 @@ def insert_rows_mysql(rows, header, mapping, fuente_label):
                     p = str_to_float(raw)
                     if p is None:
                         continue
-                    cur.execute("INSERT IGNORE INTO combustible (nombre) VALUES (%s)", (col_name,))
-                    cur.execute("SELECT id FROM combustible WHERE nombre=%s LIMIT 1", (col_name,))
-                    id_comb = cur.fetchone()[0]
-                    cur.execute("INSERT INTO precio (id_estacion, id_combustible, precio, fecha_registro) VALUES (%s,%s,%s,%s)",
+                    id_comb = dims['combustible'].id(cur, col_name)
+                    cur.execute(SQL_INSERT_PRECIO.format(**TABLAS),
                                 (id_estacion, id_comb, float(f"{p:.4f}"), fecha_dt.strftime("%Y-%m-%d %H:%M:%S") if fecha_dt else None))
                 conn.commit()
             print("[OK] Inserción completada para fuente:", fuente_label)
@@ -198,32 +1063,714 @@ def insert_rows_mysql(rows, header, mapping, fuente_label):
         sys.exit(1)
 
 # ---------------- flujo principal ----------------
-def procesar_un_csv(path_csv, fuente_label):
-    print("Procesando:", path_csv)
-    header, rows = find_header_and_rows(path_csv, delimiter=';')
-    print("Columnas detectadas:", len(header), "Filas:", len(rows))
+# modos en los que el resultado depende del orden de las instantáneas de una misma fuente
+MODOS_ORDENADOS = ('incremental', 'loaddata', 'sombra')
+# modos que conservan los ids de estación entre cargas (requisito del histórico)
+MODOS_HISTORICO = ('incremental', 'sombra')
+
+def volcar_en_bd(rows, header, mapping, fuente_label, archivo_origen, dims=None, bloques=None):
+    if IMPORT_MODE == 'filas':
+        insert_rows_mysql(rows, header, mapping, fuente_label, dims=dims)
+    elif IMPORT_MODE == 'incremental':
+        insert_rows_mysql_incremental(rows, header, mapping, fuente_label, archivo_origen=archivo_origen, dims=dims, bloques=bloques)
+    elif IMPORT_MODE == 'sombra':
+        insert_rows_mysql_incremental(rows, header, mapping, fuente_label, archivo_origen=archivo_origen, dims=dims, bloques=bloques,
+                                      tablas=TABLAS_SOMBRA)
+    elif IMPORT_MODE == 'loaddata':
+        insert_rows_mysql_loaddata(rows, header, mapping, fuente_label, archivo_origen=archivo_origen, dims=dims, bloques=bloques)
+    else:
+        insert_rows_mysql_lotes(rows, header, mapping, fuente_label, archivo_origen=archivo_origen, dims=dims, bloques=bloques)
+
+def procesar_un_csv(path_csv, dims=None):
+    """
+    Importa un CSV en streaming: las filas se leen, se convierten y se insertan por bloques de
+    BATCH_SIZE a medida que llegan, así que la memoria no depende del tamaño del fichero.
+    """
+    print(f"Procesando: {path_csv}")
+    with medir('parseo'):
+        preambulo = leer_preambulo(path_csv)
+        header, rows = iter_header_and_rows(path_csv, delimiter=';')
+    with medir('mapeo'):
+        mapping = map_columns(header)
+    fuente = fuente_de_fichero(path_csv, preambulo)
+    print(f"Columnas detectadas en {os.path.basename(path_csv)} ({fuente}): {len(header)}; "
+          f"de precio: {[x[1] for x in mapping['price_cols']]}")
+    leidas = [0]
+    filas = iter_fase(rows, 'parseo', leidas)
+    archivo = os.path.basename(path_csv)
+    with medir('insercion'):
+        if IMPORT_MODE == 'filas':
+            volcar_en_bd(filas, header, mapping, fuente, archivo, dims=dims)
+        else:
+            bloques = iter_fase(normalizar_bloques(filas, mapping, chunk_size=BATCH_SIZE), 'mapeo')
+            volcar_en_bd(None, header, mapping, fuente, archivo, dims=dims, bloques=bloques)
+    sumar_filas(fuente, leidas[0])
+    historico_tras_volcado(fuente, archivo, parse_date(preambulo.get('fecha')))
+
+def historico_tras_volcado(fuente, archivo, fecha):
+    if IMPORT_HISTORICO and IMPORT_MODE in MODOS_HISTORICO:
+        with medir('historico'):
+            registrar_historico(fuente, archivo, fecha, tablas=TABLAS_SOMBRA if IMPORT_MODE == 'sombra' else TABLAS)
+
+def leer_preambulo(path_csv, max_lineas=10):
+    """Pares clave/valor de las líneas previas a la cabecera ('Fecha:', 'Descripción:', ...)."""
+    preambulo = {}
+    with open(path_csv, newline='', encoding='utf-8-sig', errors='replace') as f:
+        for _, r in zip(range(max_lineas), csv.reader(f, delimiter=';')):
+            if len(r) >= 2 and r[0].strip().endswith(':'):
+                preambulo[slugcol(r[0])] = r[1].strip()
+    return preambulo
+
+def fuente_de_fichero(path_csv, preambulo=None):
+    preambulo = leer_preambulo(path_csv) if preambulo is None else preambulo
+    descripcion = clave_nombre(preambulo.get('descripcion', ''))
+    if 'embarcaciones' in os.path.basename(path_csv).lower() or 'maritimo' in descripcion:
+        return 'maritima'
+    return 'terrestre'
+
+def expandir_fuentes(args):
+    """Lista de CSV a partir de rutas, directorios (todos sus *.csv) o patrones glob."""
+    rutas = []
+    for arg in args:
+        if os.path.isdir(arg):
+            rutas.extend(sorted(glob.glob(os.path.join(arg, '*.csv'))))
+        elif glob.has_magic(arg):
+            rutas.extend(sorted(glob.glob(arg, recursive=True)))
+        elif os.path.exists(arg):
+            rutas.append(arg)
+        else:
+            print("Aviso: no existe", arg)
+    return list(dict.fromkeys(rutas))
+
+def parsear_fichero(path_csv):
+    """
+    Tarea del pool de procesos: lee y normaliza un CSV completo.
+    Devuelve lo necesario para volcarlo después desde un hilo de escritura.
+    """
+    t0 = time.perf_counter()
+    preambulo = leer_preambulo(path_csv)
+    header, rows = iter_header_and_rows(path_csv, delimiter=';')
+    t1 = time.perf_counter()
     mapping = map_columns(header)
-    print("Columnas de precio detectadas:", [x[1] for x in mapping['price_cols']])
-    insert_rows_mysql(rows, header, mapping, fuente_label)
+    t2 = time.perf_counter()
+    lectura = [0.0]  # la lectura de filas va intercalada con la conversión: se mide fila a fila
+    if IMPORT_MODE == 'filas':
+        datos = list(iter_medido(rows, lectura))
+    else:
+        datos = list(normalizar_bloques(iter_medido(rows, lectura), mapping, chunk_size=BATCH_SIZE))
+    t3 = time.perf_counter()
+    tiempos = {'parseo': t1 - t0 + lectura[0], 'mapeo': t2 - t1 + (t3 - t2 - lectura[0])}
+    return {'ruta': path_csv, 'fuente': fuente_de_fichero(path_csv, preambulo), 'header': header,
+            'mapping': mapping, 'datos': datos, 'fecha': parse_date(preambulo.get('fecha')), 'tiempos': tiempos}
+
+def escribir_parseado(parseado, dims):
+    print(f"Volcando: {parseado['ruta']} ({parseado['fuente']})")
+    for fase, segundos in parseado.get('tiempos', {}).items():
+        sumar_tiempo(fase, segundos)
+    with medir('insercion'):
+        if IMPORT_MODE == 'filas':
+            volcar_en_bd(parseado['datos'], parseado['header'], parseado['mapping'], parseado['fuente'],
+                         os.path.basename(parseado['ruta']), dims=dims)
+        else:
+            volcar_en_bd(None, parseado['header'], parseado['mapping'], parseado['fuente'],
+                         os.path.basename(parseado['ruta']), dims=dims, bloques=parseado['datos'])
+    sumar_filas(parseado['fuente'], len(parseado['datos']) if IMPORT_MODE == 'filas'
+                else sum(b['n'] for b in parseado['datos']))
+    historico_tras_volcado(parseado['fuente'], os.path.basename(parseado['ruta']), parseado.get('fecha'))
+
+def importar_ficheros(rutas, dims, workers=None, db_workers=None):
+    """
+    Importa varios CSV.
+    Con una sola instantánea por fuente (la ejecución sin argumentos, el modo vigilancia
+    habitual) cada fichero se importa en streaming desde su hilo de escritura: memoria plana.
+    Con varias (backfill) se parsean en un pool de procesos y se vuelcan desde un pool
+    pequeño de hilos, cada uno con su conexión y sus transacciones; cada fichero parseado se
+    tiene entero en memoria hasta escribirlo, como mucho workers + db_workers a la vez.
+    Los ficheros se ordenan por la 'Fecha:' de su preámbulo; en MODOS_ORDENADOS las
+    instantáneas de una misma fuente se escriben una detrás de otra en ese orden
+    (terrestre y marítima siguen yendo en paralelo).
+    """
+    workers = workers or IMPORT_WORKERS
+    db_workers = db_workers or IMPORT_DB_WORKERS
+    info = {}
+    for ruta in rutas:
+        preambulo = leer_preambulo(ruta)
+        info[ruta] = (parse_date(preambulo.get('fecha')) or datetime.datetime.min, fuente_de_fichero(ruta, preambulo))
+    rutas = sorted(rutas, key=lambda r: (info[r][0], r))
+
+    if len({fuente for _, fuente in info.values()}) == len(rutas):
+        print(f"Importando {len(rutas)} ficheros en streaming ({min(db_workers, len(rutas))} conexiones de escritura)")
+        with ThreadPoolExecutor(max_workers=db_workers) as pool_bd:
+            for t in [pool_bd.submit(procesar_un_csv, ruta, dims) for ruta in rutas]:
+                t.result()
+        print(f"[OK] Importados {len(rutas)} ficheros")
+        return
+
+    print(f"Importando {len(rutas)} ficheros ({workers} procesos de parseo, {db_workers} conexiones de escritura)")
+
+    # limita los ficheros parseados pendientes de escribir (memoria acotada)
+    en_vuelo = threading.BoundedSemaphore(workers + db_workers)
+
+    def escribir_uno(fut):
+        try:
+            escribir_parseado(fut.result(), dims)
+        finally:
+            en_vuelo.release()
+
+    def escribir_cadena(cola):
+        # instantáneas de una fuente, en orden; tras un fallo se sigue vaciando la cola
+        # (sin escribir) para no bloquear al hilo principal en el semáforo
+        fallo = None
+        while True:
+            fut = cola.get()
+            if fut is None:
+                break
+            try:
+                if fallo is None:
+                    escribir_parseado(fut.result(), dims)
+            except BaseException as e:
+                fallo = e
+            finally:
+                en_vuelo.release()
+        if fallo is not None:
+            raise fallo
+
+    with ProcessPoolExecutor(max_workers=workers) as pool_parseo, ThreadPoolExecutor(max_workers=db_workers) as pool_bd:
+        tareas = []
+        colas = {}
+        for ruta in rutas:
+            en_vuelo.acquire()
+            fut = pool_parseo.submit(parsear_fichero, ruta)
+            if IMPORT_MODE in MODOS_ORDENADOS:
+                fuente = info[ruta][1]
+                if fuente not in colas:
+                    colas[fuente] = queue.Queue()
+                    tareas.append(pool_bd.submit(escribir_cadena, colas[fuente]))
+                colas[fuente].put(fut)
+            else:
+                tareas.append(pool_bd.submit(escribir_uno, fut))
+        for cola in colas.values():
+            cola.put(None)
+        for t in tareas:
+            t.result()
+    print(f"[OK] Importados {len(rutas)} ficheros")
+
+# ---------------- Histórico de precios ----------------
+# precio solo guarda el precio vigente. Tras escribir cada instantánea se copian sus precios a
+# precio_historico (una fila por hora, estación y combustible) y se acumulan en precio_diario
+# (mínimo, suma, máximo y nº de muestras por día). Ambas tablas están particionadas por rango
+# de fecha (meses y años): las consultas de tendencia solo leen las particiones del intervalo
+# y la retención borra particiones enteras. Las horas se conservan HISTORICO_HORARIO_DIAS
+# días (redondeado a meses completos); los días, HISTORICO_DIARIO_DIAS (0 = siempre).
+SQL_HISTORICO = [
+    """
+    CREATE TABLE IF NOT EXISTS historico_instantanea (
+      fuente ENUM('terrestre','maritima') NOT NULL,
+      fecha DATETIME NOT NULL,
+      archivo_origen VARCHAR(255),
+      filas INT,
+      registrado DATETIME DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (fuente, fecha)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS precio_historico (
+      fecha DATETIME NOT NULL,
+      id_estacion INT NOT NULL,
+      id_combustible INT NOT NULL,
+      precio DECIMAL(10,4) NOT NULL,
+      PRIMARY KEY (id_estacion, id_combustible, fecha)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    PARTITION BY RANGE COLUMNS (fecha) (
+      PARTITION p_inicial VALUES LESS THAN ('2000-01-01'),
+      PARTITION p_futuro VALUES LESS THAN (MAXVALUE)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS precio_diario (
+      dia DATE NOT NULL,
+      id_estacion INT NOT NULL,
+      id_combustible INT NOT NULL,
+      precio_min DECIMAL(10,4) NOT NULL,
+      precio_max DECIMAL(10,4) NOT NULL,
+      precio_suma DECIMAL(14,4) NOT NULL,
+      muestras INT NOT NULL,
+      PRIMARY KEY (id_estacion, id_combustible, dia)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    PARTITION BY RANGE COLUMNS (dia) (
+      PARTITION p_inicial VALUES LESS THAN ('2000-01-01'),
+      PARTITION p_futuro VALUES LESS THAN (MAXVALUE)
+    )
+    """,
+]
+# periodo de las particiones de cada tabla
+PARTICIONES_HISTORICO = {'precio_historico': 'mes', 'precio_diario': 'anio'}
+# terrestre y marítima se escriben en hilos distintos: el ALTER TABLE de particiones, de uno en uno
+_particiones_lock = threading.Lock()
+
+def inicio_periodo(dia, periodo):
+    return dia.replace(day=1) if periodo == 'mes' else dia.replace(month=1, day=1)
+
+def fin_periodo(inicio, periodo):
+    if periodo == 'mes':
+        return (inicio.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return inicio.replace(year=inicio.year + 1)
+
+def particiones(cur, tabla):
+    """[(nombre, límite superior como date o None si es MAXVALUE)] en orden; [] si no está particionada."""
+    cur.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY PARTITION_ORDINAL_POSITION
+    """, (tabla,))
+    res = []
+    for nombre, descripcion in cur.fetchall():
+        if nombre is None:
+            return []
+        limite = None if descripcion == 'MAXVALUE' else datetime.date.fromisoformat(descripcion.strip("'")[:10])
+        res.append((nombre, limite))
+    return res
+
+def asegurar_particiones(cur, tabla, dias, periodo):
+    """
+    Crea la partición (mensual o anual) de cada día de `dias` que aún no tenga la suya,
+    partiendo la que hoy lo contiene (normalmente p_futuro, la de MAXVALUE).
+    """
+    existentes = particiones(cur, tabla)
+    limites = {limite for _, limite in existentes}
+    nuevas = {}
+    for dia in dias:
+        inicio = inicio_periodo(dia, periodo)
+        fin = fin_periodo(inicio, periodo)
+        if not existentes or fin in limites:
+            continue
+        nombre, limite = next((n, l) for n, l in existentes if l is None or inicio < l)
+        if limite is not None and fin > limite:
+            continue  # particiones creadas a mano con otros rangos: se dejan como están
+        nuevas.setdefault((nombre, limite), set()).add((inicio, fin))
+    formato = '%Y%m' if periodo == 'mes' else '%Y'
+    for (nombre, limite), rangos in nuevas.items():
+        partes = [f"PARTITION p{inicio.strftime(formato)} VALUES LESS THAN ('{fin.isoformat()}')"
+                  for inicio, fin in sorted(rangos)]
+        partes.append(f"PARTITION {nombre} VALUES LESS THAN ({'MAXVALUE' if limite is None else repr(limite.isoformat())})")
+        cur.execute(f"ALTER TABLE {tabla} REORGANIZE PARTITION {nombre} INTO ({', '.join(partes)})")
+
+def purgar_particiones(cur, tabla, antes_de):
+    """Borra las particiones cuyos datos son todos anteriores a `antes_de` (date). Devuelve sus nombres."""
+    viejas = [n for n, limite in particiones(cur, tabla) if limite is not None and limite <= antes_de and n != 'p_inicial']
+    if viejas:
+        cur.execute(f"ALTER TABLE {tabla} DROP PARTITION {', '.join(viejas)}")
+    return viejas
+
+def registrar_historico(fuente_label, archivo_origen, fecha, tablas=TABLAS):
+    """
+    Guarda los precios vigentes de las estaciones de `archivo_origen` como la instantánea de la hora
+    de `fecha` (la 'Fecha:' del fichero; la actual si no tiene) y los acumula en precio_diario.
+    Cada (fuente, hora) se registra una vez: reimportar el mismo fichero no duplica muestras.
+    """
+    hora = (fecha or datetime.datetime.now()).replace(minute=0, second=0, microsecond=0)
+    try:
+        with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB, autocommit=False) as conn:
+            cur = conn.cursor()
+            for ddl in SQL_HISTORICO:
+                cur.execute(ddl)
+            with _particiones_lock:
+                for tabla, periodo in PARTICIONES_HISTORICO.items():
+                    asegurar_particiones(cur, tabla, [hora.date()], periodo)
+            cur.execute("INSERT IGNORE INTO historico_instantanea (fuente, fecha, archivo_origen) VALUES (%s, %s, %s)",
+                        (fuente_label, hora, archivo_origen))
+            if cur.rowcount == 0:
+                conn.rollback()
+                print(f"Aviso: la instantánea {fuente_label} de {hora} ya está en el histórico")
+                return 0
+            cur.execute(f"""
+                INSERT INTO precio_historico (fecha, id_estacion, id_combustible, precio)
+                SELECT %s, p.id_estacion, p.id_combustible, p.precio
+                FROM {tablas['precio']} p
+                JOIN {tablas['estacion']} s ON s.id = p.id_estacion
+                WHERE s.fuente = %s AND s.archivo_origen = %s
+            """, (hora, fuente_label, archivo_origen))
+            n = cur.rowcount
+            cur.execute(f"""
+                INSERT INTO precio_diario (dia, id_estacion, id_combustible, precio_min, precio_max, precio_suma, muestras)
+                SELECT %s, p.id_estacion, p.id_combustible, p.precio, p.precio, p.precio, 1
+                FROM {tablas['precio']} p
+                JOIN {tablas['estacion']} s ON s.id = p.id_estacion
+                WHERE s.fuente = %s AND s.archivo_origen = %s
+                ON DUPLICATE KEY UPDATE precio_min = LEAST(precio_min, VALUES(precio_min)),
+                    precio_max = GREATEST(precio_max, VALUES(precio_max)),
+                    precio_suma = precio_suma + VALUES(precio_suma), muestras = muestras + 1
+            """, (hora.date(), fuente_label, archivo_origen))
+            cur.execute("UPDATE historico_instantanea SET filas = %s WHERE fuente = %s AND fecha = %s",
+                        (n, fuente_label, hora))
+            conn.commit()
+            print(f"[OK] Histórico {fuente_label} {hora:%Y-%m-%d %H:%M}: {n} precios")
+            return n
+    except Error as e:
+        print("Error MySQL:", e)
+        sys.exit(1)
+
+def purgar_historico():
+    """Retención del histórico, contada desde la instantánea más reciente (no desde hoy, por los backfills)."""
+    try:
+        with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT MAX(fecha) FROM historico_instantanea")
+            except Error as e:
+                if e.errno == errorcode.ER_NO_SUCH_TABLE:
+                    return
+                raise
+            ultima = cur.fetchone()[0]
+            if ultima is None:
+                return
+            with _particiones_lock:
+                borradas = purgar_particiones(cur, 'precio_historico', ultima.date() - datetime.timedelta(days=HISTORICO_HORARIO_DIAS))
+                if HISTORICO_DIARIO_DIAS > 0:
+                    borradas += purgar_particiones(cur, 'precio_diario', ultima.date() - datetime.timedelta(days=HISTORICO_DIARIO_DIAS))
+            if borradas:
+                print("[OK] Histórico: particiones borradas por retención:", ', '.join(borradas))
+            cur.close()
+    except Error as e:
+        print("Error MySQL:", e)
+        sys.exit(1)
+
+# ---------------- Tablas resumen ----------------
+# Se reconstruyen al final de cada carga en <tabla>_nuevo y se intercambian todas con un
+# único RENAME TABLE (atómico): la web nunca ve un resumen a medio construir. En modo sombra
+# se calculan desde estacion_nuevo/precio_nuevo y el mismo RENAME publica también esas dos.
+SQL_RESUMENES = {
+    'resumen_empresa': ("""
+        CREATE TABLE IF NOT EXISTS resumen_empresa (
+          fuente ENUM('terrestre','maritima') NOT NULL,
+          id_empresa INT NOT NULL,
+          empresa VARCHAR(200) NOT NULL,
+          total INT NOT NULL,
+          PRIMARY KEY (fuente, id_empresa),
+          KEY idx_resumen_empresa_total (fuente, total)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """, """
+        INSERT INTO resumen_empresa_nuevo (fuente, id_empresa, empresa, total)
+        SELECT s.fuente, e.id, e.nombre, COUNT(*)
+        FROM {estacion} s
+        JOIN empresa e ON e.id = s.id_empresa
+        GROUP BY s.fuente, e.id, e.nombre
+    """),
+    # min/media/max por combustible y provincia y la estación más barata (empate: menor p.id)
+    'resumen_precio': ("""
+        CREATE TABLE IF NOT EXISTS resumen_precio (
+          id_combustible INT NOT NULL,
+          provincia VARCHAR(100) NOT NULL,
+          n_estaciones INT NOT NULL,
+          precio_min DECIMAL(10,4) NOT NULL,
+          precio_medio DECIMAL(10,4) NOT NULL,
+          precio_max DECIMAL(10,4) NOT NULL,
+          id_estacion_min INT NOT NULL,
+          PRIMARY KEY (id_combustible, provincia)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """, """
+        INSERT INTO resumen_precio_nuevo (id_combustible, provincia, n_estaciones, precio_min,
+                                          precio_medio, precio_max, id_estacion_min)
+        SELECT id_combustible, provincia, COUNT(*), MIN(precio), AVG(precio), MAX(precio),
+               MAX(CASE WHEN orden = 1 THEN id_estacion END)
+        FROM (
+            SELECT p.id_combustible, s.provincia, p.precio, p.id_estacion,
+                   ROW_NUMBER() OVER (PARTITION BY p.id_combustible, s.provincia ORDER BY p.precio, p.id) AS orden
+            FROM {precio} p
+            JOIN {estacion} s ON s.id = p.id_estacion
+            WHERE s.provincia IS NOT NULL
+        ) t
+        GROUP BY id_combustible, provincia
+    """),
+}
+
+def construir_resumenes(sombra=False):
+    """
+    Reconstruye las tablas resumen que usa la web (rankings y estadísticas de precios).
+    Con sombra=True las calcula desde las copias del modo sombra y las publica junto a ellas.
+    """
+    t0 = time.time()
+    tablas = list(SQL_RESUMENES) + (list(TABLAS) if sombra else [])
+    try:
+        with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB, autocommit=False) as conn:
+            cur = conn.cursor()
+            filas = {}
+            for tabla, (ddl, insert) in SQL_RESUMENES.items():
+                cur.execute(ddl)
+                cur.execute(f"DROP TABLE IF EXISTS {tabla}_nuevo, {tabla}_viejo")
+                cur.execute(f"CREATE TABLE {tabla}_nuevo LIKE {tabla}")
+                cur.execute(insert.format(**(TABLAS_SOMBRA if sombra else TABLAS)))
+                filas[tabla] = cur.rowcount
+                conn.commit()
+            intercambiar_tablas(cur, tablas)
+            # precio_viejo referencia a estacion_viejo: se borra antes
+            cur.execute("DROP TABLE " + ", ".join(f"{t}_viejo" for t in reversed(tablas)))
+            cur.close()
+    except Error as e:
+        print("Error MySQL:", e)
+        sys.exit(1)
+    print(f"[OK] Resúmenes reconstruidos en {time.time() - t0:.1f}s:", filas)
+
+def intercambiar_tablas(cur, tablas):
+    """
+    RENAME TABLE t TO t_viejo, t_nuevo TO t para todas las `tablas` a la vez. El RENAME espera a que
+    terminen las lecturas en curso y, mientras espera, bloquea las nuevas: con una espera corta
+    (IMPORT_RENAME_ESPERA) y reintentos la web solo se detiene unos segundos como mucho.
+    """
+    cur.execute("SET SESSION lock_wait_timeout = %s", (IMPORT_RENAME_ESPERA,))
+    for intento in range(1, IMPORT_RENAME_REINTENTOS + 1):
+        try:
+            cur.execute("RENAME TABLE " + ", ".join(f"{t} TO {t}_viejo, {t}_nuevo TO {t}" for t in tablas))
+            return
+        except Error as e:
+            if e.errno != errorcode.ER_LOCK_WAIT_TIMEOUT or intento == IMPORT_RENAME_REINTENTOS:
+                raise
+            print(f"Aviso: RENAME TABLE esperando a lecturas en curso (intento {intento}/{IMPORT_RENAME_REINTENTOS})")
+            time.sleep(1)
+
+# ---------------- Modo sombra ----------------
+# IMPORT_MODE=sombra: la carga incremental se hace sobre estacion_nuevo y precio_nuevo, copias de
+# las tablas vivas con los mismos ids (el histórico sigue siendo válido), mientras la web lee las
+# originales sin competir por sus bloqueos. Al final construir_resumenes(sombra=True) publica
+# estaciones, precios y resúmenes con un único RENAME TABLE: los lectores ven la instantánea
+# anterior completa o la nueva completa. Necesita espacio para una segunda copia de las tablas.
+# CREATE TABLE ... LIKE no copia las claves ajenas; se añaden con el mismo nombre automático
+# (<tabla>_nuevo_ibfk_N), que MySQL renombra a <tabla>_ibfk_N al publicar.
+CLAVES_AJENAS_SOMBRA = {
+    'estacion': ["FOREIGN KEY (id_empresa) REFERENCES empresa(id) ON DELETE SET NULL"],
+    'precio': ["FOREIGN KEY (id_estacion) REFERENCES estacion_nuevo(id) ON DELETE CASCADE",
+               "FOREIGN KEY (id_combustible) REFERENCES combustible(id) ON DELETE CASCADE"],
+}
+
+def preparar_sombra():
+    """Crea estacion_nuevo y precio_nuevo como copia de las tablas vivas (descarta restos de una carga fallida)."""
+    t0 = time.time()
+    try:
+        with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB, autocommit=False) as conn:
+            cur = conn.cursor()
+            cur.execute("DROP TABLE IF EXISTS precio_nuevo, precio_viejo, estacion_nuevo, estacion_viejo")
+            filas = {}
+            for tabla, sombra in TABLAS_SOMBRA.items():
+                cur.execute(f"CREATE TABLE {sombra} LIKE {tabla}")
+                cur.execute(f"ALTER TABLE {sombra} " + ", ".join(f"ADD {fk}" for fk in CLAVES_AJENAS_SOMBRA[tabla]))
+                cur.execute(f"INSERT INTO {sombra} SELECT * FROM {tabla}")
+                filas[sombra] = cur.rowcount
+                conn.commit()
+            cur.close()
+    except Error as e:
+        print("Error MySQL:", e)
+        sys.exit(1)
+    print(f"[OK] Tablas sombra preparadas en {time.time() - t0:.1f}s:", filas)
+
+# ---------------- Generación de importación ----------------
+# La web cachea los catálogos (y resultados) hasta que cambia importacion.generacion.
+SQL_IMPORTACION = """
+CREATE TABLE IF NOT EXISTS importacion (
+  id TINYINT PRIMARY KEY,
+  generacion INT UNSIGNED NOT NULL DEFAULT 0,
+  ficheros INT,
+  actualizado DATETIME
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
 
-def main():
+def marcar_importacion(n_ficheros):
+    """Incrementa la generación de importación (crea la tabla en BD anteriores a ella)."""
+    try:
+        with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB) as conn:
+            cur = conn.cursor()
+            cur.execute(SQL_IMPORTACION)
+            cur.execute("""
+                INSERT INTO importacion (id, generacion, ficheros, actualizado) VALUES (1, 1, %s, NOW())
+                ON DUPLICATE KEY UPDATE generacion = generacion + 1, ficheros = VALUES(ficheros), actualizado = NOW()
+            """, (n_ficheros,))
+            conn.commit()
+            cur.execute("SELECT generacion FROM importacion WHERE id = 1")
+            print("[OK] Generación de importación:", cur.fetchone()[0])
+            cur.close()
+    except Error as e:
+        print("Error MySQL:", e)
+        sys.exit(1)
+
+# ---------------- Modo vigilancia ----------------
+# Proceso permanente: cada IMPORT_VIGILAR_CADA segundos revisa los CSV y solo importa los que
+# han cambiado. Un fichero se considera listo cuando su tamaño y fecha de modificación no han
+# cambiado desde la pasada anterior (no se lee a medio descargar); entonces se calcula su huella
+# (línea 'Fecha:' + SHA-256 del contenido) y se compara con la de su última importación, guardada
+# en fichero_importado para que un reinicio no vuelva a cargar lo mismo. Se hace por sondeo y no
+# con inotify porque los eventos no atraviesan los volúmenes montados desde Docker Desktop.
+SQL_FICHERO_IMPORTADO = """
+CREATE TABLE IF NOT EXISTS fichero_importado (
+  ruta VARCHAR(255) PRIMARY KEY,
+  fecha_preambulo VARCHAR(40),
+  huella CHAR(64) NOT NULL,
+  importado DATETIME NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+_parar = threading.Event()
+
+def huella_fichero(ruta):
+    """(valor de 'Fecha:' del preámbulo, SHA-256 del contenido)."""
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for trozo in iter(lambda: f.read(1 << 20), b''):
+            h.update(trozo)
+    return leer_preambulo(ruta).get('fecha'), h.hexdigest()
+
+def huellas_importadas():
+    with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_FICHERO_IMPORTADO)
+        cur.execute("SELECT ruta, fecha_preambulo, huella FROM fichero_importado")
+        return {ruta: (fecha, huella) for ruta, fecha, huella in cur.fetchall()}
+
+def guardar_huellas(huellas):
+    with connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_FICHERO_IMPORTADO)
+        cur.executemany("""
+            INSERT INTO fichero_importado (ruta, fecha_preambulo, huella, importado) VALUES (%s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE fecha_preambulo = VALUES(fecha_preambulo), huella = VALUES(huella), importado = NOW()
+        """, [(ruta, fecha, huella) for ruta, (fecha, huella) in huellas.items()])
+        conn.commit()
+
+def rutas_vigiladas(args):
+    """Los CSV indicados (rutas, directorios o globs, reevaluados en cada pasada) o los dos del Ministerio."""
+    if args:
+        return expandir_fuentes(args)
+    return [ruta for ruta in (CSV_TER, CSV_MAR) if os.path.exists(ruta)]
+
+# ---------------- Exclusión entre importadores ----------------
+# Dos importaciones a la vez (p.ej. `docker compose run importer` con el vigilante en marcha) se
+# pisarían las tablas sombra y resumen_*_nuevo. Cada pasada toma el cerrojo con nombre de MySQL
+# 'eess_importacion' en una conexión propia; si el proceso muere, MySQL lo suelta al cerrarse la conexión.
+CERROJO_IMPORTACION = 'eess_importacion'
+
+@contextlib.contextmanager
+def cerrojo_importacion(espera=None):
+    """Retiene el cerrojo de importación durante el bloque; espera `espera` segundos si otra lo tiene."""
+    espera = IMPORT_CERROJO_ESPERA if espera is None else espera
+    try:
+        conn = conectar_mysql(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD, database=MYSQL_DB)
+        cur = conn.cursor()
+        cur.execute("SELECT GET_LOCK(%s, %s)", (CERROJO_IMPORTACION, espera))
+        obtenido = cur.fetchone()[0]
+    except Error as e:
+        print("Error MySQL:", e)
+        sys.exit(1)
+    if obtenido != 1:
+        conn.close()
+        print(f"Hay otra importación en curso (cerrojo '{CERROJO_IMPORTACION}' ocupado tras {espera} s). Abortando.")
+        sys.exit(1)
+    try:
+        yield
+    finally:
+        try:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (CERROJO_IMPORTACION,))
+            cur.fetchone()
+            conn.close()
+        except Error as e:
+            print("Aviso: no se pudo liberar el cerrojo de importación (se suelta al cerrar la conexión):", e)
+
+def importar_y_publicar(rutas, dims, huellas=None):
+    """
+    Importa `rutas` y publica el resultado: resúmenes, retención del histórico y nueva generación.
+    Al terminar guarda la huella de cada fichero (`huellas`, o la calculada al empezar) para que el
+    modo vigilancia no vuelva a importar lo que ya ha cargado otra ejecución.
+    """
+    with cerrojo_importacion():
+        if huellas is None:
+            huellas = {ruta: huella_fichero(ruta) for ruta in rutas}
+        iniciar_pasada()
+        sombra = IMPORT_MODE == 'sombra'
+        if sombra:
+            with medir('sombra'):
+                preparar_sombra()
+        importar_ficheros(rutas, dims)
+        with medir('resumenes'):
+            construir_resumenes(sombra=sombra)
+        with medir('publicacion'):
+            purgar_historico()
+            marcar_importacion(len(rutas))
+        guardar_huellas(huellas)
+        cerrar_pasada(len(rutas))
+
+def vigilar(args, cada=None):
+    """Bucle del modo vigilancia; termina con SIGTERM/SIGINT al acabar la pasada en curso."""
+    cada = cada or IMPORT_VIGILAR_CADA
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: _parar.set())
+    importadas = huellas_importadas()
+    observadas = {}   # ruta -> (tamaño, mtime) en la pasada anterior
+    comprobadas = {}  # ruta -> (tamaño, mtime) cuya huella ya se ha comparado
+    dims = None
+    espera = cada
+    print(f"[OK] Vigilando {len(rutas_vigiladas(args))} ficheros cada {cada:.0f} s ({len(importadas)} huellas guardadas)")
+    while not _parar.is_set():
+        try:
+            pendientes = {}
+            for ruta in rutas_vigiladas(args):
+                st = os.stat(ruta)
+                firma = (st.st_size, st.st_mtime_ns)
+                estable = observadas.get(ruta) == firma
+                observadas[ruta] = firma
+                if not estable or comprobadas.get(ruta) == firma:
+                    continue  # aún cambiando (se mira en la siguiente pasada) o ya comprobado
+                huella = huella_fichero(ruta)
+                if importadas.get(ruta) == huella:
+                    comprobadas[ruta] = firma
+                    continue
+                pendientes[ruta] = (firma, huella)
+            if pendientes:
+                # otra ejecución (p.ej. `docker compose run importer`) puede haberlos importado ya
+                importadas = huellas_importadas()
+                for ruta in [r for r, (_, huella) in pendientes.items() if importadas.get(r) == huella]:
+                    comprobadas[ruta] = pendientes.pop(ruta)[0]
+            if pendientes:
+                print(f"Cambios en {len(pendientes)} ficheros: {', '.join(sorted(pendientes))}")
+                if dims is None:
+                    dims = cargar_dimensiones()
+                importar_y_publicar(sorted(pendientes), dims,
+                                    huellas={ruta: huella for ruta, (_, huella) in pendientes.items()})
+                for ruta, (firma, huella) in pendientes.items():
+                    importadas[ruta] = huella
+                    comprobadas[ruta] = firma
+            espera = cada
+        except (Error, OSError, SystemExit) as e:
+            # las funciones de carga acaban con sys.exit(1) ante un error de MySQL: aquí se reintenta
+            # con espera creciente y se vuelven a leer las dimensiones por si la BD ha cambiado
+            dims = None
+            espera = min(espera * 2, IMPORT_BACKOFF_MAX)
+            print(f"Aviso: fallo en la pasada ({e!r}); siguiente intento en {espera:.0f} s")
+        _parar.wait(espera)
+    print("[OK] Vigilancia detenida")
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
     ok = wait_for_db()
     if not ok:
         print("La base de datos no está disponible. Abortando.")
         sys.exit(1)
-    # procesar terrestres
-    if os.path.exists(CSV_TER):
-        procesar_un_csv(CSV_TER, 'terrestre')
-    else:
-        print("Aviso: no existe", CSV_TER)
-    # procesar maritimos
-    if os.path.exists(CSV_MAR):
-        # en el script de inserción usamos CSV_TER basename en archivo_origen para ambas; no es crítico.
-        # si quieres diferenciar ajuste en insert_rows_mysql para cada llamada.
-        # llamamos al mismo método, pero la variable CSV_TER aparece en archivo_origen -> se puede mejorar.
-        procesar_un_csv(CSV_MAR, 'maritima')
-    else:
-        print("Aviso: no existe", CSV_MAR)
+    if '--vigilar' in args:
+        vigilar([a for a in args if a != '--vigilar'])
+        return
+    dims = cargar_dimensiones()
+    if args:
+        # ficheros, directorios o patrones glob (p.ej. instantáneas horarias para backfill)
+        rutas = expandir_fuentes(args)
+        if not rutas:
+            print("No hay ficheros que importar.")
+            return
+        importar_y_publicar(rutas, dims)
+        return
+    # sin argumentos: los dos ficheros del Ministerio
+    rutas = []
+    for ruta in (CSV_TER, CSV_MAR):
+        if os.path.exists(ruta):
+            rutas.append(ruta)
+        else:
+            print("Aviso: no existe", ruta)
+    if rutas:
+        importar_y_publicar(rutas, dims)
 
 if __name__ == "__main__":
     main()
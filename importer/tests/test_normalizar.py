@@ -0,0 +1,95 @@
+# importer/tests/test_normalizar.py
+# -*- coding: utf-8 -*-
+"""
+IMPORT_PARSER=pandas y IMPORT_PARSER=python tienen que dar los mismos bloques: se compara
+normalizar_bloque_columnar con normalizar_bloque_escalar sobre los dos CSV del repositorio y
+sobre celdas límite (separadores de miles, vacías, nan/inf, fechas imposibles, d/m/h de un dígito).
+
+    cd importer && python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+DIR_IMPORTER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIR_IMPORTER)
+
+import import_eess as imp
+
+DIR_CSV = os.path.join(DIR_IMPORTER, '..', 'csv')
+
+def bloques_iguales(lote, mapping):
+    escalar = imp.normalizar_bloque_escalar(lote, mapping)
+    columnar = imp.normalizar_bloque_columnar(lote, mapping)
+    assert columnar.keys() == escalar.keys()
+    for clave in escalar:
+        assert columnar[clave] == escalar[clave], clave
+    return escalar
+
+@pytest.mark.parametrize('fichero', ['preciosEESS_es.csv', 'embarcacionesPrecios_es.csv'])
+def test_csv_del_ministerio(fichero):
+    header, rows = imp.iter_header_and_rows(os.path.join(DIR_CSV, fichero), delimiter=';')
+    mapping = imp.map_columns(header)
+    n = 0
+    for lote in imp.en_lotes(rows, imp.BATCH_SIZE):
+        n += bloques_iguales(lote, mapping)['n']
+    assert n > 0
+
+@pytest.fixture
+def cabecera():
+    header, _ = imp.iter_header_and_rows(os.path.join(DIR_CSV, 'preciosEESS_es.csv'), delimiter=';')
+    return header, imp.map_columns(header)
+
+def fila(header, mapping, precio='', latitud='40,4', longitud='-3,7', fecha='01/02/2025 10:00'):
+    r = [''] * len(header)
+    r[mapping['latitud']] = latitud
+    r[mapping['longitud']] = longitud
+    r[mapping['toma_de_datos']] = fecha
+    r[mapping['price_cols'][0][0]] = precio
+    return r
+
+@pytest.mark.parametrize('precio, esperado', [
+    ('1,459', 1.459),
+    ('1 459,5', 1459.5),     # espacio de miles
+    ('1\xa0459,5', 1459.5),  # espacio duro de miles
+    ('1.459,5', None),       # punto de miles: ilegible
+    ('', None),
+    ('nan', None),
+    ('NaN', None),
+    ('inf', None),
+    ('-inf', None),
+    ('abc', None),
+    ('1,00005', 1.0001),
+    ('0,00005', 0.0001),
+])
+def test_precios_limite(cabecera, precio, esperado):
+    header, mapping = cabecera
+    # junto a una fila normal, para que el bloque no sea homogéneo
+    bloque = bloques_iguales([fila(header, mapping, precio), fila(header, mapping, '1,5')], mapping)
+    precios = {k: p for k, _, p in bloque['precios']}
+    assert precios.get(0) == esperado
+    assert precios[1] == 1.5
+
+@pytest.mark.parametrize('latitud, esperado', [('40,4', 40.4), ('', None), ('nan', None), ('inf', None), ('x', None)])
+def test_coordenadas_limite(cabecera, latitud, esperado):
+    header, mapping = cabecera
+    bloque = bloques_iguales([fila(header, mapping, latitud=latitud), fila(header, mapping)], mapping)
+    assert bloque['latitud'][0] == esperado
+
+@pytest.mark.parametrize('fecha, esperado', [
+    ('01/02/2025 10:00', '2025-02-01 10:00:00'),
+    ('1/2/2025 3:04', '2025-02-01 03:04:00'),
+    ('1/2/2025 3:4', '2025-02-01 03:04:00'),
+    ('01/02/2025 10:00:30', '2025-02-01 10:00:30'),
+    ('1/2/2025', '2025-02-01 00:00:00'),
+    ('2025-02-01T10:00', '2025-02-01 10:00:00'),
+    ('31/02/2025 10:00', None),
+    ('01/02/2025 24:00', None),
+    ('', None),
+    ('ayer', None),
+])
+def test_fechas_limite(cabecera, fecha, esperado):
+    header, mapping = cabecera
+    bloque = bloques_iguales([fila(header, mapping, fecha=fecha), fila(header, mapping)], mapping)
+    assert bloque['fecha'][0] == esperado
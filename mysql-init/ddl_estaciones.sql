@@ -28,6 +28,7 @@ CREATE TABLE IF NOT EXISTS estacion (
   fuente ENUM('terrestre','maritima') NOT NULL,
   archivo_origen VARCHAR(255),
   created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE KEY uq_estacion_clave (fuente, codigo_externo),
   FOREIGN KEY (id_empresa) REFERENCES empresa(id) ON DELETE SET NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
@@ -36,6 +37,7 @@ CREATE TABLE IF NOT EXISTS combustible (
   codigo VARCHAR(80),
   nombre VARCHAR(200) NOT NULL,
   created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE KEY uq_combustible_codigo (codigo),  -- código canónico (gasolina_95_e5, gasoleo_a, ...) que asigna el importador
   UNIQUE KEY uq_combustible_nombre (nombre)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
@@ -50,6 +52,92 @@ CREATE TABLE IF NOT EXISTS precio (
   FOREIGN KEY (id_combustible) REFERENCES combustible(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- una sola fila (id = 1): el importador incrementa la generación al terminar cada carga
+-- y la web la usa para invalidar sus cachés
+CREATE TABLE IF NOT EXISTS importacion (
+  id TINYINT PRIMARY KEY,
+  generacion INT UNSIGNED NOT NULL DEFAULT 0,
+  ficheros INT,
+  actualizado DATETIME
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT IGNORE INTO importacion (id, generacion) VALUES (1, 0);
+
+-- huella (línea 'Fecha:' + SHA-256) de cada CSV importado en modo vigilancia (--vigilar)
+CREATE TABLE IF NOT EXISTS fichero_importado (
+  ruta VARCHAR(255) PRIMARY KEY,
+  fecha_preambulo VARCHAR(40),
+  huella CHAR(64) NOT NULL,
+  importado DATETIME NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- tablas resumen: las reconstruye el importador tras cada carga (construir_resumenes)
+CREATE TABLE IF NOT EXISTS resumen_empresa (
+  fuente ENUM('terrestre','maritima') NOT NULL,
+  id_empresa INT NOT NULL,
+  empresa VARCHAR(200) NOT NULL,
+  total INT NOT NULL,
+  PRIMARY KEY (fuente, id_empresa),
+  KEY idx_resumen_empresa_total (fuente, total)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS resumen_precio (
+  id_combustible INT NOT NULL,
+  provincia VARCHAR(100) NOT NULL,
+  n_estaciones INT NOT NULL,
+  precio_min DECIMAL(10,4) NOT NULL,
+  precio_medio DECIMAL(10,4) NOT NULL,
+  precio_max DECIMAL(10,4) NOT NULL,
+  id_estacion_min INT NOT NULL,
+  PRIMARY KEY (id_combustible, provincia)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- histórico de precios (lo rellena el importador en modo incremental tras cada instantánea):
+-- una fila por hora, estación y combustible, y mínimo/suma/máximo por día. Particionadas por
+-- rango de fecha; el importador crea las particiones mensuales/anuales según llegan datos y
+-- borra las antiguas (HISTORICO_HORARIO_DIAS / HISTORICO_DIARIO_DIAS)
+CREATE TABLE IF NOT EXISTS historico_instantanea (
+  fuente ENUM('terrestre','maritima') NOT NULL,
+  fecha DATETIME NOT NULL,
+  archivo_origen VARCHAR(255),
+  filas INT,
+  registrado DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (fuente, fecha)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS precio_historico (
+  fecha DATETIME NOT NULL,
+  id_estacion INT NOT NULL,
+  id_combustible INT NOT NULL,
+  precio DECIMAL(10,4) NOT NULL,
+  PRIMARY KEY (id_estacion, id_combustible, fecha)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+PARTITION BY RANGE COLUMNS (fecha) (
+  PARTITION p_inicial VALUES LESS THAN ('2000-01-01'),
+  PARTITION p_futuro VALUES LESS THAN (MAXVALUE)
+);
+
+CREATE TABLE IF NOT EXISTS precio_diario (
+  dia DATE NOT NULL,
+  id_estacion INT NOT NULL,
+  id_combustible INT NOT NULL,
+  precio_min DECIMAL(10,4) NOT NULL,
+  precio_max DECIMAL(10,4) NOT NULL,
+  precio_suma DECIMAL(14,4) NOT NULL,
+  muestras INT NOT NULL,
+  PRIMARY KEY (id_estacion, id_combustible, dia)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+PARTITION BY RANGE COLUMNS (dia) (
+  PARTITION p_inicial VALUES LESS THAN ('2000-01-01'),
+  PARTITION p_futuro VALUES LESS THAN (MAXVALUE)
+);
+
+-- Índices de las consultas de la web (comprobar los planes con web/explain_consultas.py)
 CREATE INDEX idx_estacion_provincia ON estacion(provincia);
-CREATE INDEX idx_precio_combustible ON precio(id_combustible);
-CREATE INDEX idx_precio_estacion ON precio(id_estacion);
+CREATE INDEX idx_estacion_fuente_provincia ON estacion(fuente, provincia);
+CREATE INDEX idx_estacion_fuente_empresa ON estacion(fuente, id_empresa);
+CREATE INDEX idx_estacion_lat_lon ON estacion(latitud, longitud);
+-- por combustible ordenado por (precio, id) como en /buscar y los rankings, e id_estacion
+-- para resolver el JOIN sin leer la fila: sustituye al antiguo índice simple de id_combustible
+CREATE INDEX idx_precio_comb_precio ON precio(id_combustible, precio, id, id_estacion);
+CREATE INDEX idx_precio_estacion ON precio(id_estacion, id_combustible);
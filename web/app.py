@@ -1,9 +1,27 @@
 # web/app.py
 # -*- coding: utf-8 -*-
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, jsonify, stream_with_context, has_request_context, template_rendered
 import mysql.connector
+from mysql.connector import pooling, errorcode
 import os
 import math
+import threading
+import time
+import datetime
+import base64
+import json
+import csv
+import io
+import zlib
+import functools
+import glob
+import unicodedata
+from collections import OrderedDict
+from decimal import Decimal
+from urllib.parse import urlencode
+from werkzeug.http import is_resource_modified
+
+import metricas
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
 
@@ -16,75 +34,786 @@ DB_NAME = os.getenv('MYSQL_DB', 'estaciones_servicio')
 
 PAGE_SIZE = 20
 
+# /buscar en modo cursor: el total se cuenta una vez por combinación de filtros y se
+# reutiliza durante BUSCAR_CONTEO_TTL segundos (0 = contar siempre)
+BUSCAR_CONTEO_TTL = float(os.getenv('BUSCAR_CONTEO_TTL', 300))
+BUSCAR_CONTEO_MAX = 1024  # combinaciones de filtros recordadas por proceso
+
+# Cachés ligadas a la generación de importación (tabla importacion, la incrementa el importador)
+GENERACION_CADA = float(os.getenv('GENERACION_CADA', 10))  # segundos entre lecturas de la generación
+CATALOGO_TTL = float(os.getenv('CATALOGO_TTL', 3600))      # caducidad de los desplegables del índice
+
+# Caché de resultados de las consultas: 'lru' (memoria del proceso) o 'no'.
+# Con RESULT_CACHE_URL (p.ej. redis://redis:6379/0) se añade detrás una caché compartida.
+RESULT_CACHE = os.getenv('RESULT_CACHE', 'lru').lower()
+RESULT_CACHE_ENTRADAS = int(os.getenv('RESULT_CACHE_ENTRADAS', 512))
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 3600))
+RESULT_CACHE_URL = os.getenv('RESULT_CACHE_URL', '')
+
+# Motor de consultas: 'mysql' (por defecto) o 'memoria' (instantánea NumPy por worker, ver memoria.py)
+WEB_MOTOR = os.getenv('WEB_MOTOR', 'mysql')
+
+# API JSON (/api/v1)
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', 100))          # filas por página si no se pasa `limite`
+API_PAGE_SIZE_MAX = int(os.getenv('API_PAGE_SIZE_MAX', 1000))  # máximo admitido en `limite`
+API_STREAM_CHUNK = int(os.getenv('API_STREAM_CHUNK', 1000))    # filas leídas de MySQL por bloque en formato=ndjson y /exportar
+EXPORT_GZIP_NIVEL = int(os.getenv('EXPORT_GZIP_NIVEL', 6))      # nivel de compresión de /exportar (1-9)
+
+# Pool de conexiones (uno por proceso de gunicorn; compartido por sus hilos)
+DB_POOL_SIZE = min(int(os.getenv('DB_POOL_SIZE', 5)), pooling.CNX_POOL_MAXSIZE)
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))  # segundos esperando una conexión libre
+
+_pool = None
+_pool_pid = None
+_pool_huecos = None
+_pool_lock = threading.Lock()
+_pool_stats = {}
+
+def get_pool():
+    """
+    Devuelve el pool del proceso actual. Se crea la primera vez que se usa y se vuelve
+    a crear si el pid cambia, para que cada worker de gunicorn tenga el suyo tras el fork.
+    """
+    global _pool, _pool_pid, _pool_huecos, _pool_stats
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                pool = pooling.MySQLConnectionPool(
+                    pool_name=f"eess_{pid}",
+                    pool_size=DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    user=DB_USER,
+                    password=DB_PASS,
+                    database=DB_NAME,
+                    autocommit=True
+                )
+                _pool_huecos = threading.BoundedSemaphore(DB_POOL_SIZE)
+                _pool_stats = {'tamano': DB_POOL_SIZE, 'en_uso': 0, 'max_en_uso': 0, 'prestamos': 0,
+                               'agotado': 0, 'espera_total_s': 0.0, 'espera_max_s': 0.0}
+                _pool, _pool_pid = pool, pid
+    return _pool
+
+class ConexionPool:
+    """Conexión prestada por el pool: close() la devuelve (una sola vez) y libera su hueco."""
+    def __init__(self, conn, huecos):
+        self._conn = conn
+        self._huecos = huecos
+        self._cerrada = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return CursorMedido(self._conn.cursor(*args, **kwargs))
+
+    def close(self):
+        if self._cerrada:
+            return
+        self._cerrada = True
+        try:
+            self._conn.close()
+        finally:
+            self._huecos.release()
+            with _pool_lock:
+                _pool_stats['en_uso'] -= 1
+
 def get_conn():
-    return mysql.connector.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        user=DB_USER,
-        password=DB_PASS,
-        database=DB_NAME,
-        autocommit=True
-    )
+    """
+    Conexión del pool. Si están todas ocupadas espera hasta DB_POOL_TIMEOUT segundos.
+    Al prestarla, el pool comprueba que sigue viva (ping) y reconecta si hace falta.
+    """
+    pool = get_pool()
+    huecos = _pool_huecos
+    t0 = time.monotonic()
+    if not huecos.acquire(timeout=DB_POOL_TIMEOUT):
+        with _pool_lock:
+            _pool_stats['agotado'] += 1
+        registro_metricas.sumar('eess_pool_agotado_total')
+        raise pooling.PoolError(f"Pool de conexiones agotado tras {DB_POOL_TIMEOUT}s")
+    try:
+        conn = pool.get_connection()
+    except Exception:
+        huecos.release()
+        raise
+    espera = time.monotonic() - t0
+    with _pool_lock:
+        _pool_stats['prestamos'] += 1
+        _pool_stats['en_uso'] += 1
+        _pool_stats['max_en_uso'] = max(_pool_stats['max_en_uso'], _pool_stats['en_uso'])
+        _pool_stats['espera_total_s'] += espera
+        _pool_stats['espera_max_s'] = max(_pool_stats['espera_max_s'], espera)
+    registro_metricas.observar('eess_pool_espera_segundos', espera)
+    return ConexionPool(conn, huecos)
+
+def pool_stats():
+    with _pool_lock:
+        return dict(_pool_stats, pid=os.getpid())
+
+# ---------------- Métricas (/metrics) ----------------
+# Tiempos por ruta, por consulta (ejecución y lectura por separado) y de espera al pool, y filas
+# leídas de MySQL frente a filas devueltas al cliente, en formato Prometheus (ver metricas.py).
+METRICAS = os.getenv('METRICAS', 'si') == 'si'  # 'no' quita la medición por petición y por consulta
+METRICAS_DIR = os.getenv('METRICAS_DIR', '')     # directorio común de los workers ('' = solo el que responde)
+METRICAS_VOLCADO_CADA = float(os.getenv('METRICAS_VOLCADO_CADA', 5))  # segundos entre volcados de cada worker
+METRICAS_CONSULTA_LENTA_MS = float(os.getenv('METRICAS_CONSULTA_LENTA_MS', 500))  # se registran en el log (0 = no)
+
+registro_metricas = metricas.Registro()
+registro_metricas.contador('eess_http_peticiones_total', "Peticiones atendidas por ruta, método y código de estado")
+registro_metricas.histograma('eess_http_duracion_segundos', "Duración de las peticiones por ruta, hasta enviar el último byte")
+registro_metricas.contador('eess_filas_leidas_total', "Filas leídas de MySQL por ruta")
+registro_metricas.contador('eess_filas_mostradas_total', "Filas devueltas al cliente (HTML, JSON, NDJSON o CSV) por ruta")
+registro_metricas.histograma('eess_sql_ejecucion_segundos', "Tiempo de execute() por consulta y ruta")
+registro_metricas.histograma('eess_sql_lectura_segundos', "Tiempo leyendo filas (fetch*) por consulta y ruta")
+registro_metricas.contador('eess_sql_filas_total', "Filas leídas por consulta y ruta")
+registro_metricas.contador('eess_sql_lentas_total', "Consultas por encima de METRICAS_CONSULTA_LENTA_MS")
+registro_metricas.histograma('eess_pool_espera_segundos', "Espera hasta obtener una conexión del pool")
+registro_metricas.contador('eess_pool_agotado_total', "Conexiones no obtenidas en DB_POOL_TIMEOUT segundos")
+registro_metricas.contador('eess_cache_consultas_total', "Consultas a la caché de resultados por ruta y resultado")
+
+def ruta_metricas():
+    """Regla de la ruta en curso ('/buscar', '/api/v1/tendencia/estacion/<int:id_estacion>'...); '' fuera de una petición."""
+    if not has_request_context():
+        return ''
+    return request.url_rule.rule if request.url_rule is not None else 'desconocida'
+
+def _metricas_peticion():
+    # en el environ y no en `g`: stream_with_context lo conserva mientras se envía la respuesta
+    return request.environ.get('eess.metricas') if has_request_context() else None
+
+def contar_filas_mostradas(n):
+    m = _metricas_peticion()
+    if m is not None:
+        m['filas_mostradas'] += n
+
+class CursorMedido:
+    """
+    Cursor que mide cada consulta: el tiempo de execute() y el tiempo y las filas de los fetch*
+    que la siguen. Cada execute() nombra su consulta (nombre='gas95_madrid'); el nombre es la
+    etiqueta de las métricas y se anota al lanzar la siguiente consulta o al cerrar el cursor.
+    Con METRICAS=no solo descarta el nombre.
+    """
+    def __init__(self, cur):
+        self._cur = cur
+        self._consulta = None  # [nombre, sql, params, ejecucion_s, lectura_s, filas]
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def execute(self, sql, params=None, nombre='sin_nombre', **kwargs):
+        self._anotar()
+        t0 = time.perf_counter()
+        try:
+            return self._cur.execute(sql, params, **kwargs) if params is not None else self._cur.execute(sql, **kwargs)
+        finally:
+            if METRICAS:
+                self._consulta = [nombre, sql, params, time.perf_counter() - t0, 0.0, 0]
+
+    def _leer(self, metodo, *args, **kwargs):
+        t0 = time.perf_counter()
+        filas = getattr(self._cur, metodo)(*args, **kwargs)
+        if self._consulta is not None:
+            self._consulta[4] += time.perf_counter() - t0
+            self._consulta[5] += (filas is not None) if metodo == 'fetchone' else len(filas)
+        return filas
+
+    def fetchone(self):
+        return self._leer('fetchone')
+
+    def fetchall(self):
+        return self._leer('fetchall')
+
+    def fetchmany(self, *args, **kwargs):
+        return self._leer('fetchmany', *args, **kwargs)
+
+    def close(self):
+        self._anotar()
+        return self._cur.close()
+
+    def _anotar(self):
+        if self._consulta is None:
+            return
+        nombre, sql, params, ejecucion, lectura, filas = self._consulta
+        self._consulta = None
+        ruta = ruta_metricas()
+        registro_metricas.observar('eess_sql_ejecucion_segundos', ejecucion, consulta=nombre, ruta=ruta)
+        registro_metricas.observar('eess_sql_lectura_segundos', lectura, consulta=nombre, ruta=ruta)
+        registro_metricas.sumar('eess_sql_filas_total', filas, consulta=nombre, ruta=ruta)
+        m = _metricas_peticion()
+        if m is not None:
+            m['filas_leidas'] += filas
+        if METRICAS_CONSULTA_LENTA_MS and (ejecucion + lectura) * 1000 >= METRICAS_CONSULTA_LENTA_MS:
+            registro_metricas.sumar('eess_sql_lentas_total', consulta=nombre, ruta=ruta)
+            app.logger.warning("Consulta lenta %s en %s: %.0f ms ejecución + %.0f ms lectura, %d filas: %s %s",
+                               nombre, ruta or '-', ejecucion * 1000, lectura * 1000, filas,
+                               ' '.join(sql.split())[:500], tuple(params) if params else ())
+
+@app.before_request
+def iniciar_metricas():
+    if METRICAS:
+        request.environ['eess.metricas'] = {'t0': time.perf_counter(), 'filas_leidas': 0, 'filas_mostradas': 0}
+
+@app.after_request
+def registrar_metricas(respuesta):
+    m = _metricas_peticion()
+    if m is None:
+        return respuesta
+    ruta = ruta_metricas()
+    etiquetas = {'ruta': ruta, 'metodo': request.method, 'estado': str(respuesta.status_code)}
+
+    def anotar():
+        # al cerrar la respuesta: en las de streaming, después de enviar el último bloque
+        registro_metricas.sumar('eess_http_peticiones_total', **etiquetas)
+        registro_metricas.observar('eess_http_duracion_segundos', time.perf_counter() - m['t0'], ruta=ruta)
+        registro_metricas.sumar('eess_filas_leidas_total', m['filas_leidas'], ruta=ruta)
+        registro_metricas.sumar('eess_filas_mostradas_total', m['filas_mostradas'], ruta=ruta)
+        try:
+            registro_metricas.volcar(METRICAS_DIR, METRICAS_VOLCADO_CADA)
+        except OSError as e:
+            app.logger.warning("No se pudieron volcar las métricas en %s: %s", METRICAS_DIR, e)
+    respuesta.call_on_close(anotar)
+    return respuesta
+
+@template_rendered.connect_via(app)
+def contar_filas_plantilla(sender, template, context, **extra):
+    if context.get('rows') is not None:
+        contar_filas_mostradas(len(context['rows']))
+
+def valor_unico(row):
+    """Primer valor de una fila de cursor normal (tupla) o dictionary=True."""
+    if not row:
+        return None
+    return list(row.values())[0] if isinstance(row, dict) else row[0]
+
+def consulta_paginada(cur, nombre, sql, count_sql, params, page, limite=PAGE_SIZE):
+    """
+    Paginación en SQL: ejecuta el conteo y solo la página pedida (LIMIT/OFFSET).
+    Devuelve (filas, total). Si la página está fuera de rango no lanza la segunda consulta.
+    `nombre` identifica la consulta en las métricas (el conteo va como '<nombre>:conteo').
+    """
+    params = tuple(params)
+    cur.execute(count_sql, params, nombre=f"{nombre}:conteo")
+    total = int(valor_unico(cur.fetchone()) or 0)
+    offset = (page - 1) * limite
+    if offset >= total:
+        return [], total
+    cur.execute(f"{sql} LIMIT %s OFFSET %s", params + (limite, offset), nombre=nombre)
+    return cur.fetchall(), total
+
+# ---------------- Generación de importación y catálogos ----------------
+_generacion = {'valor': 0, 'leida': None, 'actualizado': None}
+_generacion_lock = threading.Lock()
+
+def generacion_importacion(cur=None):
+    """
+    Generación de la última importación. Se lee de la BD como mucho cada GENERACION_CADA
+    segundos; entre medias se devuelve la última conocida. Sin tabla importacion vale 0.
+    Acepta un cursor abierto para no pedir una segunda conexión al pool.
+    La fecha de esa importación (importacion.actualizado) queda en _generacion['actualizado'].
+    """
+    ahora = time.monotonic()
+    with _generacion_lock:
+        if _generacion['leida'] is not None and ahora - _generacion['leida'] < GENERACION_CADA:
+            return _generacion['valor']
+    conn = None
+    try:
+        if cur is None:
+            conn = get_conn()
+            cur_gen = conn.cursor()
+        else:
+            cur_gen = cur
+        cur_gen.execute("SELECT generacion, actualizado FROM importacion WHERE id = 1", nombre='generacion')
+        fila = cur_gen.fetchone()
+        if isinstance(fila, dict):
+            fila = tuple(fila.values())
+        valor, actualizado = (int(fila[0] or 0), fila[1]) if fila else (0, None)
+        if conn is not None:
+            cur_gen.close()
+    except mysql.connector.Error as e:
+        app.logger.warning("No se pudo leer la generación de importación: %s", e)
+        valor, actualizado = _generacion['valor'], _generacion['actualizado']
+    finally:
+        if conn is not None:
+            conn.close()
+    with _generacion_lock:
+        _generacion['valor'], _generacion['leida'], _generacion['actualizado'] = valor, ahora, actualizado
+    return valor
+
+# limpieza: quitar espacios laterales y comillas raras, y filtrar None
+def clean_list(raw):
+    cleaned = []
+    for v in raw:
+        if v is None:
+            continue
+        s = str(v).strip()
+        # eliminar comillas iniciales/finales extra (", ', « »)
+        if (s.startswith('"') and s.endswith('"')) or (s.startswith("'") and s.endswith("'")):
+            s = s[1:-1].strip()
+        if s.startswith('«') and s.endswith('»'):
+            s = s[1:-1].strip()
+        if s:
+            cleaned.append(s)
+    # deduplicate preserving alphabetic order (case-insensitive)
+    unique = sorted(set(cleaned), key=lambda x: x.lower())
+    return unique
+
+def clave_combustible(valor):
+    """Igual que en el importador: sin 'precio', acentos, mayúsculas ni espacios de más ('_' = espacio)."""
+    s = ''.join(ch for ch in unicodedata.normalize('NFKD', str(valor)) if not unicodedata.combining(ch))
+    s = ' '.join(s.replace('_', ' ').split()).casefold()
+    return s[len('precio '):] if s.startswith('precio ') else s
+
+_catalogos = None  # (generacion, instante, {'provincias': [...], 'empresas': [...], 'combustibles': [...], ...})
+_catalogos_lock = threading.Lock()
+
+def catalogos():
+    """
+    Valores de los desplegables del índice. Se recalculan si caducan (CATALOGO_TTL)
+    o si el importador ha terminado una carga nueva desde la última vez.
+    """
+    global _catalogos
+    generacion = generacion_importacion()
+    guardado = _catalogos
+    if guardado and guardado[0] == generacion and time.monotonic() - guardado[1] < CATALOGO_TTL:
+        return guardado[2]
+    with _catalogos_lock:
+        guardado = _catalogos
+        if guardado and guardado[0] == generacion and time.monotonic() - guardado[1] < CATALOGO_TTL:
+            return guardado[2]
+        conn = get_conn()
+        cur = conn.cursor()
+        try:
+            # obtenemos sin LIMIT para no truncar la lista
+            cur.execute("SELECT DISTINCT provincia FROM estacion WHERE provincia IS NOT NULL", nombre='catalogo_provincias')
+            provincias_raw = [r[0] for r in cur.fetchall()]
+
+            cur.execute("SELECT DISTINCT nombre FROM empresa WHERE nombre IS NOT NULL", nombre='catalogo_empresas')
+            empresas_raw = [r[0] for r in cur.fetchall()]
+
+            cur.execute("SELECT id, codigo, nombre FROM combustible WHERE nombre IS NOT NULL", nombre='catalogo_combustibles')
+            combustibles_raw = cur.fetchall()
+        finally:
+            cur.close()
+            conn.close()
+        combustibles = sorted(({'id': id_, 'codigo': codigo, 'nombre': ' '.join(str(nombre).split())}
+                               for id_, codigo, nombre in combustibles_raw),
+                              key=lambda c: c['nombre'].lower())
+        # id, código canónico o nombre (también los antiguos 'Precio gasóleo A') -> combustible
+        por_clave = {}
+        for c in combustibles:
+            for clave in (str(c['id']), clave_combustible(c['codigo'] or ''), clave_combustible(c['nombre'])):
+                if clave:
+                    por_clave.setdefault(clave, c)
+        valores = {'provincias': clean_list(provincias_raw),
+                   'empresas': clean_list(empresas_raw),
+                   'combustibles': combustibles,
+                   'combustible_por_clave': por_clave}
+        _catalogos = (generacion, time.monotonic(), valores)
+        return valores
+
+def buscar_combustible(valor):
+    """Combustible {'id', 'codigo', 'nombre'} por id, código o nombre, sin consultar MySQL; None si no existe."""
+    if valor is None or str(valor).strip() == '':
+        return None
+    valor = str(valor).strip()
+    return catalogos()['combustible_por_clave'].get(valor if valor.isdigit() else clave_combustible(valor))
+
+def filtro_combustible(valor, columna='p.id_combustible'):
+    """(sql, params) que filtra `columna` por el id del combustible pedido (índice por id_combustible)."""
+    c = buscar_combustible(valor)
+    return (f"{columna} = %s", (c['id'],)) if c else ("1 = 0", ())
 
 @app.route('/')
 def index():
-    conn = get_conn()
-    cur = conn.cursor()
+    cat = catalogos()
+    return render_template('index.html', provincias=cat['provincias'], empresas=cat['empresas'],
+                           combustibles=cat['combustibles'])
+
+# ---------------- Motor en memoria (WEB_MOTOR=memoria) ----------------
+# Cada worker guarda una instantánea columnar de estaciones y precios (memoria.Instantanea) y
+# responde /buscar, los rankings y la proximidad sin ir a MySQL. Se recarga cuando cambia la
+# generación de importación; mientras un hilo la recarga, el resto sigue con la anterior.
+if WEB_MOTOR == 'memoria':
+    try:
+        import memoria
+    except ImportError as e:
+        app.logger.warning("WEB_MOTOR=memoria requiere NumPy (%s); se usa MySQL", e)
+        WEB_MOTOR = 'mysql'
+
+_instantanea = None
+_instantanea_lock = threading.Lock()
+
+def instantanea():
+    """Instantánea de la generación actual, o None si el motor es MySQL."""
+    global _instantanea
+    if WEB_MOTOR != 'memoria':
+        return None
+    generacion = generacion_importacion()
+    actual = _instantanea
+    if actual is not None and actual.generacion == generacion:
+        return actual
+    # sin instantánea hay que esperar a la carga; con una anterior, se usa mientras otro hilo recarga
+    if not _instantanea_lock.acquire(blocking=actual is None):
+        return actual
     try:
-        # obtenemos sin LIMIT para no truncar la lista
-        cur.execute("SELECT DISTINCT provincia FROM estacion WHERE provincia IS NOT NULL")
-        provincias_raw = [r[0] for r in cur.fetchall()]
+        if _instantanea is not None and _instantanea.generacion == generacion:
+            return _instantanea
+        conn = get_conn()
+        cur = conn.cursor()
+        try:
+            _instantanea = memoria.Instantanea.cargar(cur, generacion)
+        except mysql.connector.Error as e:
+            if actual is None:
+                raise
+            app.logger.warning("No se pudo recargar la instantánea (se sigue con la generación %s): %s",
+                               actual.generacion, e)
+            return actual
+        finally:
+            cur.close()
+            conn.close()
+        app.logger.info("Instantánea de la generación %s cargada: %s", generacion, _instantanea.stats())
+        return _instantanea
+    finally:
+        _instantanea_lock.release()
+
+def id_combustible(valor):
+    """Id del combustible pedido (por id, código o nombre); -1 si no existe."""
+    c = buscar_combustible(valor)
+    return c['id'] if c else -1
 
-        cur.execute("SELECT DISTINCT nombre FROM empresa WHERE nombre IS NOT NULL")
-        empresas_raw = [r[0] for r in cur.fetchall()]
+def paginar(filas, page, limite=PAGE_SIZE):
+    """(página `page` de una lista o array ya ordenado, total)."""
+    return filas[(page - 1) * limite:page * limite], len(filas)
 
-        cur.execute("SELECT DISTINCT nombre FROM combustible WHERE nombre IS NOT NULL")
-        combustibles_raw = [r[0] for r in cur.fetchall()]
+def consulta_sql_paginada(nombre, sql, count_sql, params, page, limite=PAGE_SIZE):
+    """consulta_paginada con una conexión del pool."""
+    conn = get_conn()
+    cur = conn.cursor(dictionary=True)
+    try:
+        return consulta_paginada(cur, nombre, sql, count_sql, params, page, limite)
     finally:
         cur.close()
         conn.close()
 
-    # limpieza: quitar espacios laterales y comillas raras, y filtrar None
-    def clean_list(raw):
-        cleaned = []
-        for v in raw:
-            if v is None:
-                continue
-            s = str(v).strip()
-            # eliminar comillas iniciales/finales extra (", ', « »)
-            if (s.startswith('"') and s.endswith('"')) or (s.startswith("'") and s.endswith("'")):
-                s = s[1:-1].strip()
-            if s.startswith('«') and s.endswith('»'):
-                s = s[1:-1].strip()
-            if s:
-                cleaned.append(s)
-        # deduplicate preserving alphabetic order (case-insensitive)
-        unique = sorted(set(cleaned), key=lambda x: x.lower())
-        return unique
-
-    provincias = clean_list(provincias_raw)
-    empresas = clean_list(empresas_raw)
-    combustibles = clean_list(combustibles_raw)
-
-    return render_template('index.html', provincias=provincias, empresas=empresas, combustibles=combustibles)
+# ---------------- Caché de resultados ----------------
+# Las páginas de las consultas solo cambian con cada importación: se guarda el HTML
+# generado con clave (generación, ruta, parámetros normalizados).
+class CacheCompartida:
+    """Caché en Redis compartida por todos los workers (requiere el paquete redis)."""
+    def __init__(self, url, ttl, prefijo='eess:resultado:'):
+        import redis  # dependencia opcional: solo si se configura RESULT_CACHE_URL
+        self._errores = redis.RedisError
+        self._r = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.ttl = ttl
+        self.prefijo = prefijo
 
-# Ruta genérica para listado con filtros y paginación
-@app.route('/buscar', methods=['GET'])
-def buscar():
-    page = max(1, int(request.args.get('page', 1)))
-    provincia = request.args.get('provincia', None)
-    empresa = request.args.get('empresa', None)
-    combustible = request.args.get('combustible', None)
-    fuente = request.args.get('fuente', None)  # 'terrestre' o 'maritima'
-    sort = request.args.get('sort', 'precio_asc')  # precio_asc, precio_desc
+    def get(self, clave):
+        try:
+            valor = self._r.get(self.prefijo + clave)
+        except self._errores as e:
+            app.logger.warning("Caché compartida no disponible: %s", e)
+            return None
+        return valor.decode('utf-8') if valor is not None else None
 
+    def set(self, clave, valor):
+        try:
+            self._r.set(self.prefijo + clave, valor.encode('utf-8'), ex=max(1, int(self.ttl)))
+        except self._errores as e:
+            app.logger.warning("Caché compartida no disponible: %s", e)
+
+    def stats(self):
+        return {'tipo': 'redis'}
+
+class CacheLRU:
+    """
+    Caché en memoria del proceso con como mucho max_entradas (expulsa la menos usada).
+    Si tiene `siguiente` (caché compartida), los fallos se buscan allí y las escrituras van a ambas.
+    """
+    def __init__(self, max_entradas, ttl, siguiente=None):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.siguiente = siguiente
+        self._datos = OrderedDict()  # clave -> (caduca, valor)
+        self._lock = threading.Lock()
+        self.expulsiones = 0
+        self.aciertos_siguiente = 0
+
+    def get(self, clave):
+        ahora = time.monotonic()
+        with self._lock:
+            guardado = self._datos.get(clave)
+            if guardado is not None:
+                if guardado[0] > ahora:
+                    self._datos.move_to_end(clave)
+                    return guardado[1]
+                del self._datos[clave]
+        if self.siguiente is None:
+            return None
+        valor = self.siguiente.get(clave)
+        if valor is not None:
+            with self._lock:
+                self.aciertos_siguiente += 1
+            self._guardar(clave, valor)
+        return valor
+
+    def set(self, clave, valor):
+        self._guardar(clave, valor)
+        if self.siguiente is not None:
+            self.siguiente.set(clave, valor)
+
+    def _guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+                self.expulsiones += 1
+
+    def stats(self):
+        with self._lock:
+            datos = {'tipo': 'lru', 'entradas': len(self._datos), 'max_entradas': self.max_entradas,
+                     'expulsiones': self.expulsiones}
+            if self.siguiente is not None:
+                datos['compartida'] = dict(self.siguiente.stats(), aciertos=self.aciertos_siguiente)
+        return datos
+
+def crear_cache_resultados():
+    if RESULT_CACHE in ('no', 'off', '0'):
+        return None
+    siguiente = CacheCompartida(RESULT_CACHE_URL, RESULT_CACHE_TTL) if RESULT_CACHE_URL else None
+    return CacheLRU(RESULT_CACHE_ENTRADAS, RESULT_CACHE_TTL, siguiente=siguiente)
+
+cache_resultados = crear_cache_resultados()
+_cache_stats = {}  # ruta -> {'aciertos': n, 'fallos': n}
+_cache_stats_lock = threading.Lock()
+
+def clave_resultado(ruta, args):
+    """Clave normalizada: parámetros ordenados y sin los vacíos (las vistas los tratan como ausentes)."""
+    pares = sorted((k, v.strip()) for k, v in args.items(multi=True) if v is not None and v.strip() != '')
+    return f"{generacion_importacion()}:{ruta}?{urlencode(pares)}"
+
+def cacheado(vista):
+    """Sirve la vista desde cache_resultados si la misma consulta ya se resolvió en esta generación."""
+    @functools.wraps(vista)
+    def envoltorio(*args, **kwargs):
+        if cache_resultados is None:
+            return vista(*args, **kwargs)
+        clave = clave_resultado(request.endpoint, request.args)
+        valor = cache_resultados.get(clave)
+        with _cache_stats_lock:
+            contador = _cache_stats.setdefault(request.endpoint, {'aciertos': 0, 'fallos': 0})
+            contador['aciertos' if valor is not None else 'fallos'] += 1
+        registro_metricas.sumar('eess_cache_consultas_total', ruta=ruta_metricas(),
+                                resultado='acierto' if valor is not None else 'fallo')
+        if valor is not None:
+            return valor
+        respuesta = vista(*args, **kwargs)
+        if isinstance(respuesta, str):
+            cache_resultados.set(clave, respuesta)
+        return respuesta
+    return envoltorio
+
+def cache_stats():
+    if cache_resultados is None:
+        return {'tipo': 'no'}
+    with _cache_stats_lock:
+        por_ruta = {ruta: dict(c) for ruta, c in _cache_stats.items()}
+    aciertos = sum(c['aciertos'] for c in por_ruta.values())
+    consultas = aciertos + sum(c['fallos'] for c in por_ruta.values())
+    return dict(cache_resultados.stats(), aciertos=aciertos, fallos=consultas - aciertos,
+                tasa_acierto=round(aciertos / consultas, 4) if consultas else None,
+                por_ruta=por_ruta, generacion=_generacion['valor'])
+
+# ---------------- Caché HTTP y compresión ----------------
+# Los datos solo cambian con cada importación. Las respuestas llevan un ETag (versión del código y
+# generación de importación) y Last-Modified (importacion.actualizado), y una petición condicional que
+# coincide se responde con 304 antes de ejecutar la vista. Cache-Control deja que un proxy o CDN las
+# guarde HTTP_CACHE_MAX_AGE segundos. Las grandes se comprimen con brotli (si está instalado) o gzip.
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', 60))      # 0 = revalidar en cada uso
+HTTP_COMPRESION = [c.strip() for c in os.getenv('HTTP_COMPRESION', 'br,gzip').lower().split(',')
+                   if c.strip() in ('br', 'gzip')]                 # por orden de preferencia; 'no' = sin comprimir
+HTTP_COMPRESION_MIN = int(os.getenv('HTTP_COMPRESION_MIN', 1024))  # bytes; las respuestas menores van sin comprimir
+HTTP_GZIP_NIVEL = int(os.getenv('HTTP_GZIP_NIVEL', 6))
+HTTP_BROTLI_NIVEL = int(os.getenv('HTTP_BROTLI_NIVEL', 5))
+
+if 'br' in HTTP_COMPRESION:
+    try:
+        import brotli
+    except ImportError:
+        app.logger.info("brotli no está instalado: se comprime solo con gzip")
+        HTTP_COMPRESION.remove('br')
+
+# estado del worker y métricas cambian en cada petición; los estáticos los sirve Flask con su propio ETag
+SIN_CACHE_HTTP = {'estado', 'metrics'}
+# sin `hasta` el intervalo acaba ahora: la respuesta depende del reloj, no solo de la importación
+DEPENDEN_DEL_RELOJ = {'api_tendencia_estacion', 'api_tendencia_provincia'}
+TIPOS_COMPRIMIBLES = {'text/html', 'text/plain', 'text/css', 'text/javascript', 'application/javascript',
+                      'application/json', 'application/x-ndjson'}
+
+def version_respuestas():
+    """
+    Huella de los módulos de la app (app.py, memoria.py, metricas.py, ...) y las plantillas: el ETag
+    cambia al desplegar otra versión aunque no haya importación.
+    """
+    crc = 0
+    carpeta = os.path.join(app.root_path, app.template_folder)
+    modulos = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py')))
+    for ruta in modulos + sorted(glob.glob(os.path.join(carpeta, '**', '*'), recursive=True)):
+        if os.path.isfile(ruta):
+            with open(ruta, 'rb') as f:
+                crc = zlib.crc32(f.read(), crc)
+    return f"{crc:08x}"
+
+VERSION_RESPUESTAS = version_respuestas()
+
+def validadores_http():
+    """(ETag, Last-Modified) de la respuesta a la petición en curso, o None si no se cachea."""
+    if (request.method not in ('GET', 'HEAD') or request.endpoint in (None, 'static')
+            or request.endpoint in SIN_CACHE_HTTP):
+        return None
+    if request.endpoint in DEPENDEN_DEL_RELOJ and not request.args.get('hasta'):
+        return None
+    generacion = generacion_importacion()
+    actualizado = _generacion['actualizado']
+    if actualizado is not None:
+        actualizado = actualizado.replace(tzinfo=datetime.timezone.utc)  # NOW() de MySQL (UTC en el contenedor)
+    return f'W/"{VERSION_RESPUESTAS}-{generacion}"', actualizado
+
+@app.before_request
+def responder_no_modificado():
+    validadores = validadores_http()
+    request.environ['eess.validadores'] = validadores
+    if validadores is not None and not is_resource_modified(request.environ, etag=validadores[0],
+                                                            last_modified=validadores[1]):
+        return app.response_class(status=304)
+
+@app.after_request
+def cabeceras_http(respuesta):
+    validadores = request.environ.get('eess.validadores')
+    if request.endpoint in SIN_CACHE_HTTP:
+        respuesta.headers['Cache-Control'] = 'no-store'
+    elif validadores is not None and respuesta.status_code in (200, 304):
+        etag, actualizado = validadores
+        respuesta.headers['ETag'] = etag
+        if actualizado is not None:
+            respuesta.last_modified = actualizado
+        respuesta.headers['Cache-Control'] = f"public, max-age={HTTP_CACHE_MAX_AGE}"
+        if HTTP_COMPRESION:
+            respuesta.vary.add('Accept-Encoding')
+    comprimir_respuesta(respuesta)
+    return respuesta
+
+def comprimir_respuesta(respuesta):
+    """brotli o gzip según Accept-Encoding; las respuestas por bloques (NDJSON) con gzip según se envían."""
+    if (not HTTP_COMPRESION or respuesta.status_code != 200 or respuesta.direct_passthrough
+            or 'Content-Encoding' in respuesta.headers or respuesta.mimetype not in TIPOS_COMPRIMIBLES):
+        return
+    respuesta.vary.add('Accept-Encoding')
+    if respuesta.is_streamed:
+        if 'gzip' in HTTP_COMPRESION and request.accept_encodings.best_match(['gzip']):
+            respuesta.response = gzip_stream(respuesta.response, HTTP_GZIP_NIVEL)
+            respuesta.headers['Content-Encoding'] = 'gzip'
+            respuesta.headers.pop('Content-Length', None)
+        return
+    codificacion = request.accept_encodings.best_match(HTTP_COMPRESION)
+    datos = respuesta.get_data()
+    if codificacion is None or len(datos) < HTTP_COMPRESION_MIN:
+        return
+    if codificacion == 'br':
+        datos = brotli.compress(datos, quality=HTTP_BROTLI_NIVEL)
+    else:
+        datos = zlib.compress(datos, HTTP_GZIP_NIVEL, wbits=16 + zlib.MAX_WBITS)
+    respuesta.set_data(datos)
+    respuesta.headers['Content-Encoding'] = codificacion
+
+# Paginación por clave (keyset) para /buscar: en vez de saltar OFFSET filas se continúa
+# desde la última fila mostrada comparando (p.precio, p.id), así que pedir la página 500
+# cuesta lo mismo que la primera. El cursor es opaco para el cliente.
+def codificar_cursor(precio, id_precio, direccion):
+    datos = json.dumps([str(precio), int(id_precio), direccion], separators=(',', ':'))
+    return base64.urlsafe_b64encode(datos.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decodificar_cursor(token):
+    """(precio, id_precio, 'sig'|'ant') o None si falta o no es válido."""
+    if not token:
+        return None
+    try:
+        datos = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        precio, id_precio, direccion = json.loads(datos.decode('utf-8'))
+        if direccion not in ('sig', 'ant'):
+            return None
+        return Decimal(precio), int(id_precio), direccion
+    except (ValueError, TypeError, ArithmeticError):
+        return None
+
+def consulta_keyset(cur, nombre, sql_base, where_clauses, params, descendente, cursor, limite=PAGE_SIZE):
+    """
+    Una página de /buscar ordenada por (p.precio, p.id) a partir de `cursor`.
+    Pide limite + 1 filas para saber si hay más sin contar.
+    Devuelve (filas, hay_anterior, hay_siguiente).
+    """
+    atras = cursor is not None and cursor[2] == 'ant'
+    # hacia atrás se recorre el orden inverso y después se da la vuelta a la página
+    orden_desc = descendente != atras
+    where = list(where_clauses)
+    params = list(params)
+    if cursor is not None:
+        op = '<' if orden_desc else '>'
+        where.append(f"(p.precio {op} %s OR (p.precio = %s AND p.id {op} %s))")
+        params += [cursor[0], cursor[0], cursor[1]]
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    direccion = "DESC" if orden_desc else "ASC"
+    cur.execute(f"{sql_base} {where_sql} ORDER BY p.precio {direccion}, p.id {direccion} LIMIT %s",
+                tuple(params) + (limite + 1,), nombre=nombre)
+    filas = cur.fetchall()
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    if atras:
+        filas.reverse()
+        return filas, hay_mas, True
+    return filas, cursor is not None, hay_mas
+
+_conteos = {}  # (generacion, sql, params) -> (instante, total)
+_conteos_lock = threading.Lock()
+
+def conteo_cacheado(cur, nombre, count_sql, params):
+    """COUNT(*) reutilizado durante BUSCAR_CONTEO_TTL segundos (y en la misma generación de importación)."""
+    clave = (generacion_importacion(cur), count_sql, tuple(params))
+    ahora = time.monotonic()
+    with _conteos_lock:
+        guardado = _conteos.get(clave)
+    if guardado and ahora - guardado[0] < BUSCAR_CONTEO_TTL:
+        return guardado[1]
+    cur.execute(count_sql, tuple(params), nombre=f"{nombre}:conteo")
+    total = int(valor_unico(cur.fetchone()) or 0)
+    with _conteos_lock:
+        _conteos.pop(clave, None)
+        while len(_conteos) >= BUSCAR_CONTEO_MAX:
+            _conteos.pop(next(iter(_conteos)))  # el más antiguo
+        _conteos[clave] = (ahora, total)
+    return total
+
+def filtros_buscar(args):
+    """
+    Consulta de /buscar (y /api/v1/precios) según los filtros de `args`.
+    Devuelve (select_sql, where_clauses, params, descendente, count_sql); select_sql acaba en el FROM.
+    """
     select_cols = ("s.id, s.provincia, s.municipio, s.localidad, s.direccion, s.latitud, s.longitud, "
-                   "e.nombre as empresa, s.margen, p.precio, c.nombre as combustible, s.fuente")
+                   "e.nombre as empresa, s.margen, p.precio, c.nombre as combustible, s.fuente, "
+                   "p.id as id_precio")
     sql_from = (f"FROM precio p "
            f"JOIN combustible c ON p.id_combustible = c.id "
            f"JOIN estacion s ON p.id_estacion = s.id "
            f"LEFT JOIN empresa e ON s.id_empresa = e.id ")
 
+    provincia = args.get('provincia', None)
+    empresa = args.get('empresa', None)
+    combustible = args.get('combustible', None)
+    fuente = args.get('fuente', None)  # 'terrestre' o 'maritima'
+    sort = args.get('sort', 'precio_asc')  # precio_asc, precio_desc
+
     where_clauses = []
     params = []
 
@@ -95,42 +824,104 @@ def buscar():
         where_clauses.append("e.nombre = %s")
         params.append(empresa)
     if combustible:
-        where_clauses.append("c.nombre = %s")
-        params.append(combustible)
+        filtro_sql, filtro_params = filtro_combustible(combustible)
+        where_clauses.append(filtro_sql)
+        params.extend(filtro_params)
     if fuente:
         where_clauses.append("s.fuente = %s")
         params.append(fuente)
 
     where_sql = ("WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
-    order_sql = "ORDER BY p.precio ASC" if sort == 'precio_asc' else "ORDER BY p.precio DESC"
-
-    # conteo total (ejecutar con o sin parámetros según sea necesario)
     count_sql = "SELECT COUNT(*) " + sql_from + where_sql
-    conn = get_conn()
-    cur = conn.cursor()
-    try:
-        if params:
-            cur.execute(count_sql, tuple(params))
-        else:
-            cur.execute(count_sql)
-        row = cur.fetchone()
-        total = row[0] if row and len(row) > 0 and row[0] is not None else 0
-
-        # paginado
-        offset = (page - 1) * PAGE_SIZE
-        query = f"SELECT {select_cols} {sql_from} {where_sql} {order_sql} LIMIT %s OFFSET %s"
-        if params:
-            final_params = tuple(params + [PAGE_SIZE, offset])
-            cur.execute(query, final_params)
+    return f"SELECT {select_cols} {sql_from}", where_clauses, params, sort == 'precio_desc', count_sql
+
+COLUMNAS_BUSCAR = ['id', 'provincia', 'municipio', 'localidad', 'direccion', 'latitud', 'longitud',
+                   'empresa', 'margen', 'precio', 'combustible', 'fuente', 'id_precio']
+
+def seleccion_buscar(snap, args):
+    """Filtros de /buscar sobre la instantánea: posiciones en orden (precio, id) ascendente."""
+    combustible = args.get('combustible')
+    return snap.seleccion(provincia=args.get('provincia'), empresa=args.get('empresa'),
+                          id_combustible=id_combustible(combustible) if combustible else None,
+                          fuente=args.get('fuente'))
+
+# Ruta genérica para listado con filtros y paginación
+@app.route('/buscar', methods=['GET'])
+@cacheado
+def buscar():
+    """
+    Dos modos de paginación:
+    - page=N (por defecto): LIMIT/OFFSET con conteo exacto, permite saltar a cualquier página.
+    - cursor=<token> o paginacion=cursor: keyset sobre (precio, id) con enlaces
+      anterior/siguiente; el total sale de conteo_cacheado (conteo=no lo omite).
+    """
+    page = max(1, int(request.args.get('page', 1)))
+    token = request.args.get('cursor')
+    modo_cursor = bool(token) or request.args.get('paginacion') == 'cursor'
+    cursor = decodificar_cursor(token)
+
+    select_sql, where_clauses, params, descendente, count_sql = filtros_buscar(request.args)
+    where_sql = ("WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
+    order_sql = "ORDER BY p.precio DESC, p.id DESC" if descendente else "ORDER BY p.precio ASC, p.id ASC"
+
+    snap = instantanea()
+    if snap is not None:
+        sel = seleccion_buscar(snap, request.args)
+        if modo_cursor:
+            posiciones, hay_anterior, hay_siguiente = snap.pagina_keyset(sel, descendente, cursor, PAGE_SIZE)
+            total = None if request.args.get('conteo') == 'no' else len(sel)
         else:
-            cur.execute(query, (PAGE_SIZE, offset))
+            posiciones, total = paginar(sel[::-1] if descendente else sel, page)
+        rows = snap.filas(posiciones, COLUMNAS_BUSCAR)
+    else:
+        conn = get_conn()
+        cur = conn.cursor()
+        try:
+            if modo_cursor:
+                fetched, hay_anterior, hay_siguiente = consulta_keyset(
+                    cur, 'buscar', select_sql, where_clauses, params, descendente, cursor)
+                cols = [d[0] for d in cur.description] if cur.description else []
+                rows = [dict(zip(cols, r)) for r in fetched]
+                total = None if request.args.get('conteo') == 'no' else conteo_cacheado(cur, 'buscar', count_sql, params)
+            else:
+                if params:
+                    cur.execute(count_sql, tuple(params), nombre='buscar:conteo')
+                else:
+                    cur.execute(count_sql, nombre='buscar:conteo')
+                row = cur.fetchone()
+                total = row[0] if row and len(row) > 0 and row[0] is not None else 0
 
-        fetched = cur.fetchall()
-        cols = [d[0] for d in cur.description] if cur.description else []
-        rows = [dict(zip(cols, r)) for r in fetched]
-    finally:
-        cur.close()
-        conn.close()
+                # paginado
+                offset = (page - 1) * PAGE_SIZE
+                query = f"{select_sql} {where_sql} {order_sql} LIMIT %s OFFSET %s"
+                if params:
+                    final_params = tuple(params + [PAGE_SIZE, offset])
+                    cur.execute(query, final_params, nombre='buscar')
+                else:
+                    cur.execute(query, (PAGE_SIZE, offset), nombre='buscar')
+
+                fetched = cur.fetchall()
+                cols = [d[0] for d in cur.description] if cur.description else []
+                rows = [dict(zip(cols, r)) for r in fetched]
+        finally:
+            cur.close()
+            conn.close()
+
+    columns = ['provincia','municipio','localidad','direccion','empresa','combustible','margen','precio','latitud','longitud','fuente']
+    if modo_cursor:
+        base_args = {k: v for k, v in request.args.items() if k not in ('page', 'cursor')}
+        base_args['paginacion'] = 'cursor'
+        cursor_nav = {
+            'anterior': codificar_cursor(rows[0]['precio'], rows[0]['id_precio'], 'ant') if rows and hay_anterior else None,
+            'siguiente': codificar_cursor(rows[-1]['precio'], rows[-1]['id_precio'], 'sig') if rows and hay_siguiente else None,
+        }
+        return render_template('resultados.html',
+                               title="Resultados de búsqueda",
+                               rows=rows,
+                               columns=columns,
+                               cursor_nav=cursor_nav,
+                               base_args=base_args,
+                               total=total)
 
     base_args = {k: v for k, v in request.args.items() if k != 'page'}
     total_pages = max(1, math.ceil(total / PAGE_SIZE))
@@ -138,7 +929,7 @@ def buscar():
     return render_template('resultados.html',
                            title="Resultados de búsqueda",
                            rows=rows,
-                           columns=['provincia','municipio','localidad','direccion','empresa','combustible','margen','precio','latitud','longitud','fuente'],
+                           columns=columns,
                            page=page,
                            total_pages=total_pages,
                            base_args=base_args,
@@ -147,8 +938,48 @@ def buscar():
 # Consulta A: empresa con más estaciones (terrestres o marítimas)
 # Reemplaza únicamente la función empresa_mayor en web/app.py por este bloque
 
+def consulta_empresas(cur, fuente, page, limite=PAGE_SIZE):
+    """Página del ranking de empresas por nº de estaciones: (filas {'empresa', 'total'}, total)."""
+    # ranking precalculado por el importador (tabla resumen_empresa)
+    q = """
+    SELECT empresa, total
+    FROM resumen_empresa
+    WHERE fuente = %s
+    ORDER BY total DESC, id_empresa
+    """
+    count_q = "SELECT COUNT(*) FROM resumen_empresa WHERE fuente = %s"
+    try:
+        return consulta_paginada(cur, 'empresa_mayor', q, count_q, (fuente,), page, limite)
+    except mysql.connector.Error as e:
+        if e.errno != errorcode.ER_NO_SUCH_TABLE:
+            raise
+    # BD creada antes de las tablas resumen y aún sin importar: se agrega en vivo
+    q = """
+    SELECT e.nombre AS empresa, COUNT(*) AS total
+    FROM empresa e
+    JOIN estacion s ON e.id = s.id_empresa
+    WHERE s.fuente = %s
+    GROUP BY e.id
+    ORDER BY total DESC, e.id
+    """
+    count_q = "SELECT COUNT(DISTINCT s.id_empresa) FROM estacion s WHERE s.fuente = %s AND s.id_empresa IS NOT NULL"
+    return consulta_paginada(cur, 'empresa_mayor_en_vivo', q, count_q, (fuente,), page, limite)
+
+def pagina_empresas(fuente, page, limite=PAGE_SIZE):
+    snap = instantanea()
+    if snap is not None:
+        return paginar(snap.ranking_empresas(fuente), page, limite)
+    conn = get_conn()
+    cur = conn.cursor(dictionary=True)
+    try:
+        return consulta_empresas(cur, fuente, page, limite)
+    finally:
+        cur.close()
+        conn.close()
+
 # Sustituye la función empresa_mayor actual por esta
 @app.route('/empresa_mayor', methods=['GET'])
+@cacheado
 def empresa_mayor():
     """
     Devuelve lista de empresas con el número de estaciones (total).
@@ -157,40 +988,12 @@ def empresa_mayor():
     fuente = request.args.get('fuente', 'terrestre')
     page = max(1, int(request.args.get('page', 1)))
 
-    conn = get_conn()
-    cur = conn.cursor(dictionary=True)
-    try:
-        q = """
-        SELECT e.nombre AS empresa, COUNT(*) AS total
-        FROM empresa e
-        JOIN estacion s ON e.id = s.id_empresa
-        WHERE s.fuente = %s
-        GROUP BY e.id
-        ORDER BY total DESC
-        """
-        cur.execute(q, (fuente,))
-        rows_raw = cur.fetchall()
-
-        # normalizar clave 'total' y construir filas seguras para la plantilla
-        rows = []
-        for r in rows_raw:
-            rows.append({
-                'empresa': r.get('empresa'),
-                'total': int(r.get('total') or 0),
-                # rellenamos campos opcionales para evitar huecos en la plantilla
-                'provincia': None, 'municipio': None, 'localidad': None,
-                'direccion': None, 'combustible': None, 'margen': None,
-                'precio': None, 'latitud': None, 'longitud': None,
-                'fuente': fuente
-            })
-
-        total = len(rows)
-        total_pages = max(1, math.ceil(total / PAGE_SIZE))
-        start = (page - 1) * PAGE_SIZE
-        page_rows = rows[start:start + PAGE_SIZE]
-    finally:
-        cur.close()
-        conn.close()
+    rows_raw, total = pagina_empresas(fuente, page)
+
+    # normalizar clave 'total' (la plantilla detecta este listado porque no hay 'provincia')
+    page_rows = [{'empresa': r.get('empresa'), 'total': int(r.get('total') or 0), 'fuente': fuente}
+                 for r in rows_raw]
+    total_pages = max(1, math.ceil(total / PAGE_SIZE))
 
     base_args = {k: v for k, v in request.args.items() if k != 'page'}
     return render_template('resultados.html',
@@ -204,34 +1007,90 @@ def empresa_mayor():
 
 
 
+# Estadísticas por provincia de un combustible (tabla resumen_precio): mínimo, media y
+# máximo, y la estación más barata de cada provincia
+def sql_precios_provincia(combustible):
+    """(consulta, conteo, params) de /precios_provincia."""
+    filtro_sql, filtro_params = filtro_combustible(combustible, columna='r.id_combustible')
+    q = f"""
+        SELECT r.provincia, c.nombre AS combustible, r.n_estaciones, r.precio_min AS precio,
+               r.precio_medio, r.precio_max, s.municipio, s.localidad, s.direccion,
+               e.nombre AS empresa, s.margen, s.latitud, s.longitud, s.fuente
+        FROM resumen_precio r
+        JOIN combustible c ON r.id_combustible = c.id
+        JOIN estacion s ON r.id_estacion_min = s.id
+        LEFT JOIN empresa e ON s.id_empresa = e.id
+        WHERE {filtro_sql}
+        ORDER BY r.precio_min ASC, r.provincia
+    """
+    count_q = f"SELECT COUNT(*) FROM resumen_precio r WHERE {filtro_sql}"
+    return q, count_q, filtro_params
+
+COLUMNAS_PRECIOS_PROVINCIA = ['provincia', 'combustible', 'precio', 'municipio', 'localidad', 'direccion',
+                              'empresa', 'margen', 'latitud', 'longitud', 'fuente']
+
+def pagina_precios_provincia(combustible, page, limite=PAGE_SIZE):
+    snap = instantanea()
+    if snap is not None:
+        return paginar(snap.precios_provincia(id_combustible(combustible), COLUMNAS_PRECIOS_PROVINCIA), page, limite)
+    return consulta_sql_paginada('precios_provincia', *sql_precios_provincia(combustible), page, limite)
+
+@app.route('/precios_provincia')
+@cacheado
+def precios_provincia():
+    combustible = request.args.get('combustible') or 'gasolina_95_e5'
+    page = max(1, int(request.args.get('page', 1)))
+    nombre = (buscar_combustible(combustible) or {}).get('nombre', combustible)
+    rows, total = pagina_precios_provincia(combustible, page)
+    total_pages = max(1, math.ceil(total / PAGE_SIZE))
+
+    base_args = {k: v for k, v in request.args.items() if k != 'page'}
+    return render_template('resultados.html',
+                           title=f"{nombre}: estación más barata y precios por provincia",
+                           rows=rows,
+                           columns=['provincia','municipio','localidad','direccion','empresa','combustible','margen','precio',
+                                    'latitud','longitud','fuente','precio_medio','precio_max','n_estaciones'],
+                           page=page,
+                           total_pages=total_pages,
+                           base_args=base_args,
+                           total=total)
+
 # Consulta C: Gasolina 95 E5 en Comunidad de Madrid
+def sql_gas95_madrid(provincia):
+    """(consulta, conteo, params) de /gas95_madrid."""
+    filtro_sql, filtro_params = filtro_combustible('gasolina_95_e5')
+    q = ("""
+        SELECT s.provincia, s.municipio, s.localidad, s.direccion, e.nombre AS empresa, s.margen, p.precio, s.latitud, s.longitud
+        FROM precio p
+        JOIN estacion s ON p.id_estacion = s.id
+        LEFT JOIN empresa e ON s.id_empresa = e.id
+        WHERE {filtro_sql} AND s.provincia=%s
+        ORDER BY p.precio ASC, p.id
+    """).format(filtro_sql=filtro_sql)
+    count_q = ("""
+        SELECT COUNT(*)
+        FROM precio p
+        JOIN estacion s ON p.id_estacion = s.id
+        WHERE {filtro_sql} AND s.provincia=%s
+    """).format(filtro_sql=filtro_sql)
+    return q, count_q, filtro_params + (provincia,)
+
+def pagina_gas95_madrid(provincia, page, limite=PAGE_SIZE):
+    snap = instantanea()
+    if snap is not None:
+        sel = snap.seleccion(provincia=provincia, id_combustible=id_combustible('gasolina_95_e5'))
+        posiciones, total = paginar(sel, page, limite)
+        return snap.filas(posiciones, ['provincia', 'municipio', 'localidad', 'direccion', 'empresa', 'margen',
+                                       'precio', 'latitud', 'longitud']), total
+    return consulta_sql_paginada('gas95_madrid', *sql_gas95_madrid(provincia), page, limite)
+
 @app.route('/gas95_madrid')
+@cacheado
 def gas95_madrid():
     provincia = request.args.get('provincia', 'Madrid')
     page = max(1, int(request.args.get('page', 1)))
-    offset = (page-1)*PAGE_SIZE
-    conn = get_conn()
-    cur = conn.cursor(dictionary=True)
-    try:
-        q = ("""
-            SELECT s.provincia, s.municipio, s.localidad, s.direccion, e.nombre AS empresa, s.margen, p.precio, s.latitud, s.longitud
-            FROM precio p
-            JOIN combustible c ON p.id_combustible = c.id
-            JOIN estacion s ON p.id_estacion = s.id
-            LEFT JOIN empresa e ON s.id_empresa = e.id
-            WHERE c.nombre LIKE %s AND s.provincia=%s
-            ORDER BY p.precio ASC
-        """)
-        cur.execute(q, ('%Gasolina 95 E5%', provincia))
-        rows_all = cur.fetchall()
-        total = len(rows_all)
-        total_pages = max(1, math.ceil(total / PAGE_SIZE))
-        start = offset
-        end = start + PAGE_SIZE
-        rows = rows_all[start:end]
-    finally:
-        cur.close()
-        conn.close()
+    rows, total = pagina_gas95_madrid(provincia, page)
+    total_pages = max(1, math.ceil(total / PAGE_SIZE))
 
     base_args = {k: v for k, v in request.args.items() if k != 'page'}
     return render_template('resultados.html',
@@ -255,13 +1114,83 @@ def haversine_km(lat1, lon1, lat2, lon2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
     return R * c
 
-@app.route('/gasoleo_cercano', methods=['GET'])
-def gasoleo_cercano():
+# Búsqueda por proximidad: en vez de recorrer todos los precios del combustible, se
+# prefiltra en SQL con una caja (bounding box) alrededor del punto que usa el índice
+# idx_estacion_lat_lon, y solo se calcula la distancia exacta de lo que cae dentro.
+KM_POR_GRADO_LAT = 111.32
+KNN_RADIO_INICIAL_KM = 5.0
+KNN_RADIO_MAX_KM = 2000.0  # cubre península, Baleares y Canarias
+
+def caja_km(lat0, lon0, km):
+    """(lat_min, lat_max, lon_min, lon_max) de una caja que contiene el círculo de radio km."""
+    dlat = km / KM_POR_GRADO_LAT
+    coslat = math.cos(math.radians(min(abs(lat0) + dlat, 90.0)))
+    dlon = 180.0 if coslat < 1e-6 else min(180.0, km / (KM_POR_GRADO_LAT * coslat))
+    return lat0 - dlat, lat0 + dlat, lon0 - dlon, lon0 + dlon
+
+SELECT_CERCANAS = """
+    SELECT s.id as id_estacion, s.provincia, s.municipio, s.localidad, s.direccion,
+           e.nombre as empresa, s.margen, p.precio, s.latitud, s.longitud, s.fuente
+    FROM estacion s
+    JOIN precio p ON p.id_estacion = s.id
+    LEFT JOIN empresa e ON s.id_empresa = e.id
+"""
+
+def estaciones_en_caja(cur, filtro_sql, filtro_params, lat0, lon0, km, con_sin_coords=False):
+    lat_min, lat_max, lon_min, lon_max = caja_km(lat0, lon0, km)
+    q = f"""{SELECT_CERCANAS}
+    WHERE {filtro_sql}
+      AND s.latitud BETWEEN %s AND %s AND s.longitud BETWEEN %s AND %s
     """
-    Buscar estaciones con 'Gasóleo A' dentro de max_km de (lat, lon).
-    - Acepta lat/lon con coma o punto como separador decimal.
-    - Acepta varios nombres de parámetros: lat/lon, latitude/longitude, lat0/lon0, lng.
-    - Si no se proporcionan coordenadas, usa por defecto Albacete (38.9943, -1.8572) para no romper la UI.
+    params = tuple(filtro_params) + (lat_min, lat_max, lon_min, lon_max)
+    if con_sin_coords:
+        # las que no tienen coordenadas van en otra rama: un OR ... IS NULL junto a la caja
+        # impediría que esta se resolviera como un rango sobre idx_estacion_lat_lon
+        q += f"""UNION ALL{SELECT_CERCANAS}
+    WHERE {filtro_sql}
+      AND (s.latitud IS NULL OR s.longitud IS NULL)
+    """
+        params += tuple(filtro_params)
+    cur.execute(q, params, nombre='cercanas')
+    return cur.fetchall()
+
+def buscar_cercanas(cur, filtro_sql, filtro_params, lat0, lon0, km=None, k=None):
+    """
+    Estaciones (filas de estaciones_en_caja + 'distancia') ordenadas por distancia a (lat0, lon0).
+    - Solo km: todas las que están a <= km (más las que no tienen coordenadas, al final).
+    - Con k: las k más cercanas; el radio empieza pequeño y se duplica hasta reunir k
+      (o hasta km / KNN_RADIO_MAX_KM), así que el coste depende de lo que se devuelve.
+    """
+    def con_distancia(filas, radio):
+        dentro = []
+        for r in filas:
+            try:
+                lat_v = float(r['latitud']) if r.get('latitud') is not None else None
+                lon_v = float(r['longitud']) if r.get('longitud') is not None else None
+            except (TypeError, ValueError):
+                lat_v = lon_v = None
+            r['distancia'] = haversine_km(lat0, lon0, lat_v, lon_v) if lat_v is not None and lon_v is not None else None
+            if r['distancia'] is None or r['distancia'] <= radio:
+                dentro.append(r)
+        dentro.sort(key=lambda x: float('inf') if x['distancia'] is None else x['distancia'])
+        return dentro
+
+    if not k:
+        return con_distancia(estaciones_en_caja(cur, filtro_sql, filtro_params, lat0, lon0, km, con_sin_coords=True), km)
+
+    limite = km if km else KNN_RADIO_MAX_KM
+    radio = min(KNN_RADIO_INICIAL_KM, limite)
+    while True:
+        dentro = con_distancia(estaciones_en_caja(cur, filtro_sql, filtro_params, lat0, lon0, radio), radio)
+        # dentro del círculo de radio r no se escapa nada: la caja lo contiene entero
+        if len(dentro) >= k or radio >= limite:
+            return dentro[:k]
+        radio = min(radio * 2, limite)
+
+def estaciones_cercanas(args):
+    """
+    Parámetros de /cercanas (ver gasoleo_cercano) -> (filas ordenadas por distancia, nombre del
+    combustible, km, k). Compartido por la vista HTML y /api/v1/cercanas.
     """
     # helper: parsear float tolerante
     def parse_coord_val(s):
@@ -272,21 +1201,22 @@ def gasoleo_cercano():
             return None
         s2 = s2.replace(',', '.')
         try:
-            return float(s2)
+            v = float(s2)
         except ValueError:
             return None
+        return v if math.isfinite(v) else None
 
     # admitir varios nombres de parámetro
     raw_lat_candidates = [
-        request.args.get('lat'),
-        request.args.get('latitude'),
-        request.args.get('lat0'),
+        args.get('lat'),
+        args.get('latitude'),
+        args.get('lat0'),
     ]
     raw_lon_candidates = [
-        request.args.get('lon'),
-        request.args.get('longitude'),
-        request.args.get('lon0'),
-        request.args.get('lng'),
+        args.get('lon'),
+        args.get('longitude'),
+        args.get('lon0'),
+        args.get('lng'),
     ]
 
     lat0 = None
@@ -299,19 +1229,77 @@ def gasoleo_cercano():
             lon0 = parse_coord_val(v)
 
     # logging para depuración
-    app.logger.debug("gasoleo_cercano: parámetros recibidos: %s", dict(request.args))
+    app.logger.debug("gasoleo_cercano: parámetros recibidos: %s", dict(args))
 
     # si no vienen, usar valores por defecto (Albacete) para evitar error 400 en UI
     if lat0 is None or lon0 is None:
         app.logger.debug("gasoleo_cercano: lat/lon no válidos o ausentes, usando valor por defecto (Albacete)")
         lat0, lon0 = 38.9943, -1.8572
 
-    # km tolerante
-    km_raw = request.args.get('km', '10')
+    # k vecinos más cercanos (opcional)
+    try:
+        k_val = int(args.get('k', '')) or None
+    except ValueError:
+        k_val = None
+
+    # km tolerante (en modo k, sin km explícito no hay radio máximo)
+    km_raw = args.get('km', '' if k_val else '10')
     try:
         km_val = float(str(km_raw).replace(',', '.').strip())
     except Exception:
-        km_val = 10.0
+        km_val = None
+    # nan, inf o <= 0 acabarían en los BETWEEN de la caja: se tratan como un km no válido
+    if km_val is None or not (math.isfinite(km_val) and km_val > 0):
+        km_val = None if k_val else 10.0
+
+    combustible = args.get('combustible') or None
+    nombre_comb = (buscar_combustible(combustible or 'gasoleo_a') or {}).get('nombre', combustible or 'Gasóleo A')
+
+    snap = instantanea()
+    if snap is not None:
+        fetched = snap.cercanas(id_combustible(combustible or 'gasoleo_a'), lat0, lon0,
+                                ['id_estacion', 'provincia', 'municipio', 'localidad', 'direccion', 'empresa',
+                                 'margen', 'precio', 'latitud', 'longitud', 'fuente'],
+                                km=km_val, k=k_val, radio_max=KNN_RADIO_MAX_KM)
+    else:
+        conn = get_conn()
+        cur = conn.cursor(dictionary=True)
+        try:
+            filtro_sql, filtro_params = filtro_combustible(combustible or 'gasoleo_a')
+            fetched = buscar_cercanas(cur, filtro_sql, filtro_params, lat0, lon0, km=km_val, k=k_val)
+        finally:
+            cur.close()
+            conn.close()
+
+    rows_all = [{
+        'provincia': r.get('provincia'),
+        'municipio': r.get('municipio'),
+        'localidad': r.get('localidad'),
+        'direccion': r.get('direccion'),
+        'empresa': r.get('empresa'),
+        'combustible': nombre_comb,
+        'margen': r.get('margen'),
+        'precio': r.get('precio'),
+        'latitud': r.get('latitud'),
+        'longitud': r.get('longitud'),
+        'fuente': r.get('fuente'),
+        'distancia_km': round(r['distancia'], 3) if r['distancia'] is not None else None
+    } for r in fetched]
+
+    return rows_all, nombre_comb, km_val, k_val
+
+@app.route('/gasoleo_cercano', methods=['GET'])
+@app.route('/cercanas', methods=['GET'])
+@cacheado
+def gasoleo_cercano():
+    """
+    Buscar estaciones con 'Gasóleo A' (u otro `combustible`) dentro de `km` de (lat, lon),
+    o las `k` más cercanas si se pasa k (combinable con km como radio máximo).
+    - Acepta lat/lon con coma o punto como separador decimal.
+    - Acepta varios nombres de parámetros: lat/lon, latitude/longitude, lat0/lon0, lng.
+    - Si no se proporcionan coordenadas, usa por defecto Albacete (38.9943, -1.8572) para no romper la UI.
+    """
+    rows_all, nombre_comb, km_val, k_val = estaciones_cercanas(request.args)
 
     # página
     try:
@@ -319,70 +1307,18 @@ def gasoleo_cercano():
     except Exception:
         page = 1
 
-    # consulta: obtener todas las filas relevantes (filtrado por combustible en SQL)
-    conn = get_conn()
-    cur = conn.cursor(dictionary=True)
-    try:
-        q = """
-        SELECT s.id as id_estacion, s.provincia, s.municipio, s.localidad, s.direccion,
-               e.nombre as empresa, s.margen, p.precio, s.latitud, s.longitud, s.fuente
-        FROM precio p
-        JOIN combustible c ON p.id_combustible = c.id
-        JOIN estacion s ON p.id_estacion = s.id
-        LEFT JOIN empresa e ON s.id_empresa = e.id
-        WHERE (c.nombre LIKE '%%Gasóleo A%%' OR c.nombre LIKE '%%Gasoil A%%' OR c.nombre LIKE '%%Diesel A%%')
-        """
-        cur.execute(q)
-        fetched = cur.fetchall()
-
-        rows_all = []
-        for r in fetched:
-            # parsear coordenadas almacenadas (pueden venir como strings con comas)
-            lat_v = None
-            lon_v = None
-            try:
-                lat_v = None if r.get('latitud') in (None, '') else float(str(r.get('latitud')).replace(',', '.'))
-            except Exception:
-                lat_v = None
-            try:
-                lon_v = None if r.get('longitud') in (None, '') else float(str(r.get('longitud')).replace(',', '.'))
-            except Exception:
-                lon_v = None
-
-            distancia = None
-            if lat_v is not None and lon_v is not None:
-                distancia = haversine_km(lat0, lon0, lat_v, lon_v)
-
-            # si la distancia es None (sin coords) lo mantenemos, o si está dentro de km_val
-            if distancia is None or distancia <= km_val:
-                rows_all.append({
-                    'provincia': r.get('provincia'),
-                    'municipio': r.get('municipio'),
-                    'localidad': r.get('localidad'),
-                    'direccion': r.get('direccion'),
-                    'empresa': r.get('empresa'),
-                    'combustible': 'Gasóleo A',
-                    'margen': r.get('margen'),
-                    'precio': r.get('precio'),
-                    'latitud': r.get('latitud'),
-                    'longitud': r.get('longitud'),
-                    'fuente': r.get('fuente'),
-                    'distancia_km': round(distancia, 3) if distancia is not None else None
-                })
-
-        # ordenar por distancia ascendente (None al final)
-        rows_all.sort(key=lambda x: (float('inf') if x['distancia_km'] is None else x['distancia_km']))
-        total = len(rows_all)
-        total_pages = max(1, math.ceil(total / PAGE_SIZE))
-        start = (page - 1) * PAGE_SIZE
-        page_rows = rows_all[start:start + PAGE_SIZE]
-    finally:
-        cur.close()
-        conn.close()
+    total = len(rows_all)
+    total_pages = max(1, math.ceil(total / PAGE_SIZE))
+    start = (page - 1) * PAGE_SIZE
+    page_rows = rows_all[start:start + PAGE_SIZE]
 
+    if k_val:
+        title = f"{nombre_comb}: {k_val} más cercanas" + (f" (máx. {km_val} km)" if km_val else "")
+    else:
+        title = f"{nombre_comb} dentro de {km_val} km"
     base_args = {k: v for k, v in request.args.items() if k != 'page'}
     return render_template('resultados.html',
-                           title=f"Gasóleo A dentro de {km_val} km",
+                           title=title,
                            rows=page_rows,
                            columns=['provincia','municipio','localidad','direccion','empresa','combustible','margen','precio','latitud','longitud','fuente','distancia_km'],
                            page=page,
@@ -391,32 +1327,42 @@ def gasoleo_cercano():
                            total=total)
 
 # Consulta E: estación marítima con Gasolina 95 E5 más cara
+def sql_gas95_maritima_top():
+    """(consulta, conteo, params) de /gas95_maritima_top."""
+    filtro_sql, filtro_params = filtro_combustible('gasolina_95_e5')
+    q = f"""
+    SELECT s.provincia, s.municipio, s.localidad, s.direccion, e.nombre AS empresa, p.precio, s.latitud, s.longitud
+    FROM precio p
+    JOIN estacion s ON p.id_estacion = s.id
+    LEFT JOIN empresa e ON s.id_empresa = e.id
+    WHERE {filtro_sql}
+      AND s.fuente = 'maritima'
+    ORDER BY p.precio DESC, p.id
+    """
+    count_q = f"""
+    SELECT COUNT(*)
+    FROM precio p
+    JOIN estacion s ON p.id_estacion = s.id
+    WHERE {filtro_sql}
+      AND s.fuente = 'maritima'
+    """
+    return q, count_q, filtro_params
+
+def pagina_gas95_maritima_top(page, limite=PAGE_SIZE):
+    snap = instantanea()
+    if snap is not None:
+        sel = snap.orden_precio_desc(snap.seleccion(id_combustible=id_combustible('gasolina_95_e5'), fuente='maritima'))
+        posiciones, total = paginar(sel, page, limite)
+        return snap.filas(posiciones, ['provincia', 'municipio', 'localidad', 'direccion', 'empresa', 'precio',
+                                       'latitud', 'longitud']), total
+    return consulta_sql_paginada('gas95_maritima_top', *sql_gas95_maritima_top(), page, limite)
+
 @app.route('/gas95_maritima_top', methods=['GET'])
+@cacheado
 def gas95_maritima_top():
     page = max(1, int(request.args.get('page', 1)))
-    conn = get_conn()
-    cur = conn.cursor(dictionary=True)
-    try:
-        q = """
-        SELECT s.provincia, s.municipio, s.localidad, s.direccion, e.nombre AS empresa, p.precio, s.latitud, s.longitud
-        FROM precio p
-        JOIN combustible c ON p.id_combustible = c.id
-        JOIN estacion s ON p.id_estacion = s.id
-        LEFT JOIN empresa e ON s.id_empresa = e.id
-        WHERE c.nombre LIKE %s
-          AND s.fuente = 'maritima'
-        ORDER BY p.precio DESC
-        """
-        cur.execute(q, ('%Gasolina 95 E5%',))
-        rows_all = cur.fetchall()
-        total = len(rows_all)
-        total_pages = max(1, math.ceil(total / PAGE_SIZE))
-        start = (page-1)*PAGE_SIZE
-        end = start + PAGE_SIZE
-        rows = rows_all[start:end]
-    finally:
-        cur.close()
-        conn.close()
+    rows, total = pagina_gas95_maritima_top(page)
+    total_pages = max(1, math.ceil(total / PAGE_SIZE))
 
     base_args = {k: v for k, v in request.args.items() if k != 'page'}
     return render_template('resultados.html',
@@ -428,6 +1374,396 @@ def gas95_maritima_top():
                            base_args=base_args,
                            total=total)
 
+# ---------------- API JSON (/api/v1) ----------------
+# Las mismas consultas que las vistas HTML, en JSON y con tamaño de página `limite`.
+# Con formato=ndjson se devuelven todas las filas en una sola respuesta (una línea JSON por
+# fila), leídas de MySQL por bloques con un cursor sin buffer: la memoria del servidor no
+# depende del número de filas.
+class ErrorAPI(ValueError):
+    """Parámetro no válido en la API: se responde 400 con {'error': ...}."""
+
+@app.errorhandler(ErrorAPI)
+def error_api(e):
+    return jsonify({'error': str(e)}), 400
+
+def valor_json(v):
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, (datetime.date, datetime.datetime)):
+        return v.isoformat()
+    return v
+
+def fila_json(fila):
+    return {k: valor_json(v) for k, v in fila.items()}
+
+def entero_api(nombre, defecto, minimo=1, maximo=None):
+    valor = request.args.get(nombre)
+    if valor is None or valor.strip() == '':
+        return defecto
+    try:
+        n = int(valor)
+    except ValueError:
+        raise ErrorAPI(f"'{nombre}' debe ser un número entero")
+    if n < minimo:
+        raise ErrorAPI(f"'{nombre}' debe ser al menos {minimo}")
+    return min(n, maximo) if maximo else n
+
+def modo_ndjson():
+    return request.args.get('formato') == 'ndjson'
+
+def filas_en_bloques(nombre, sql, params, dictionary=True):
+    """
+    Generador de listas de hasta API_STREAM_CHUNK filas de `sql`. La conexión se toma al empezar
+    a iterar y se devuelve al pool al terminar (o al cerrarse el generador si el cliente se va).
+    """
+    conn = get_conn()
+    cur = conn.cursor(dictionary=dictionary)  # sin buffer: las filas se leen del socket según se piden
+    completo = False
+    try:
+        cur.execute(sql, tuple(params), nombre=nombre)
+        while True:
+            filas = cur.fetchmany(API_STREAM_CHUNK)
+            if not filas:
+                break
+            yield filas
+        completo = True
+    finally:
+        if not completo:
+            # cliente desconectado a mitad: se descarta el resto antes de devolver la conexión
+            try:
+                conn.consume_results()
+            except mysql.connector.Error:
+                pass
+        cur.close()
+        conn.close()
+
+def bloques_ndjson(bloques):
+    for filas in bloques:
+        contar_filas_mostradas(len(filas))
+        yield ''.join(json.dumps(fila_json(f), ensure_ascii=False) + '\n' for f in filas)
+
+def respuesta_ndjson(nombre, sql, params):
+    """Todas las filas de `sql` como NDJSON, leídas y enviadas en bloques de API_STREAM_CHUNK filas."""
+    return app.response_class(stream_with_context(bloques_ndjson(filas_en_bloques(nombre, sql, params))),
+                              mimetype='application/x-ndjson')
+
+def respuesta_lista_ndjson(filas):
+    contar_filas_mostradas(len(filas))
+    return app.response_class((json.dumps(fila_json(f), ensure_ascii=False) + '\n' for f in filas),
+                              mimetype='application/x-ndjson')
+
+def respuesta_paginada_api(nombre, consulta_sql, pagina):
+    """
+    JSON paginado con page/limite (pagina(page, limite) -> (filas, total)), o con formato=ndjson
+    todas las filas de consulta_sql = (sql, count_sql, params), medidas como `nombre`.
+    """
+    if modo_ndjson():
+        sql, _, params = consulta_sql
+        return respuesta_ndjson(nombre, sql, params)
+    page = entero_api('page', 1)
+    limite = entero_api('limite', API_PAGE_SIZE, maximo=API_PAGE_SIZE_MAX)
+    filas, total = pagina(page, limite)
+    contar_filas_mostradas(len(filas))
+    return jsonify({'datos': [fila_json(f) for f in filas], 'total': total, 'page': page,
+                    'paginas': max(1, math.ceil(total / limite)), 'limite': limite})
+
+@app.route('/api/v1/precios')
+def api_precios():
+    """
+    /buscar en JSON (mismos filtros). Paginación por cursor: se devuelven `limite` filas y
+    cursor_siguiente / cursor_anterior para pedir las contiguas. conteo=no omite el total.
+    """
+    select_sql, where_clauses, params, descendente, count_sql = filtros_buscar(request.args)
+    if modo_ndjson():
+        where_sql = ("WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
+        orden = "DESC" if descendente else "ASC"
+        return respuesta_ndjson('buscar', f"{select_sql} {where_sql} ORDER BY p.precio {orden}, p.id {orden}", params)
+    limite = entero_api('limite', API_PAGE_SIZE, maximo=API_PAGE_SIZE_MAX)
+    token = request.args.get('cursor')
+    cursor = decodificar_cursor(token)
+    if token and cursor is None:
+        raise ErrorAPI("'cursor' no válido")
+    snap = instantanea()
+    if snap is not None:
+        sel = seleccion_buscar(snap, request.args)
+        posiciones, hay_anterior, hay_siguiente = snap.pagina_keyset(sel, descendente, cursor, limite)
+        filas = snap.filas(posiciones, COLUMNAS_BUSCAR)
+        total = None if request.args.get('conteo') == 'no' else len(sel)
+    else:
+        conn = get_conn()
+        cur = conn.cursor(dictionary=True)
+        try:
+            filas, hay_anterior, hay_siguiente = consulta_keyset(cur, 'buscar', select_sql, where_clauses, params,
+                                                                 descendente, cursor, limite)
+            total = None if request.args.get('conteo') == 'no' else conteo_cacheado(cur, 'buscar', count_sql, params)
+        finally:
+            cur.close()
+            conn.close()
+    contar_filas_mostradas(len(filas))
+    return jsonify({
+        'datos': [fila_json(f) for f in filas],
+        'total': total,
+        'limite': limite,
+        'cursor_anterior': codificar_cursor(filas[0]['precio'], filas[0]['id_precio'], 'ant') if filas and hay_anterior else None,
+        'cursor_siguiente': codificar_cursor(filas[-1]['precio'], filas[-1]['id_precio'], 'sig') if filas and hay_siguiente else None,
+    })
+
+@app.route('/api/v1/empresas')
+def api_empresas():
+    fuente = request.args.get('fuente', 'terrestre')
+    page = entero_api('page', 1)
+    limite = entero_api('limite', API_PAGE_SIZE, maximo=API_PAGE_SIZE_MAX)
+    filas, total = pagina_empresas(fuente, page, limite)
+    contar_filas_mostradas(len(filas))
+    return jsonify({'datos': [{'empresa': f['empresa'], 'total': int(f['total'] or 0)} for f in filas],
+                    'total': total, 'page': page, 'paginas': max(1, math.ceil(total / limite)), 'limite': limite})
+
+@app.route('/api/v1/gas95_madrid')
+def api_gas95_madrid():
+    provincia = request.args.get('provincia', 'Madrid')
+    return respuesta_paginada_api('gas95_madrid', sql_gas95_madrid(provincia),
+                                  lambda page, limite: pagina_gas95_madrid(provincia, page, limite))
+
+@app.route('/api/v1/gas95_maritima_top')
+def api_gas95_maritima_top():
+    return respuesta_paginada_api('gas95_maritima_top', sql_gas95_maritima_top(), pagina_gas95_maritima_top)
+
+@app.route('/api/v1/precios_provincia')
+def api_precios_provincia():
+    combustible = request.args.get('combustible') or 'gasolina_95_e5'
+    return respuesta_paginada_api('precios_provincia', sql_precios_provincia(combustible),
+                                  lambda page, limite: pagina_precios_provincia(combustible, page, limite))
+
+@app.route('/api/v1/cercanas')
+def api_cercanas():
+    filas, _, _, _ = estaciones_cercanas(request.args)
+    if modo_ndjson():
+        return respuesta_lista_ndjson(filas)
+    page = entero_api('page', 1)
+    limite = entero_api('limite', API_PAGE_SIZE, maximo=API_PAGE_SIZE_MAX)
+    inicio = (page - 1) * limite
+    pagina = filas[inicio:inicio + limite]
+    contar_filas_mostradas(len(pagina))
+    return jsonify({'datos': [fila_json(f) for f in pagina], 'total': len(filas),
+                    'page': page, 'paginas': max(1, math.ceil(len(filas) / limite)), 'limite': limite})
+
+@app.route('/api/v1/combustibles')
+def api_combustibles():
+    """Combustibles con su id y código canónico (valores admitidos en `combustible`)."""
+    return jsonify({'datos': catalogos()['combustibles']})
+
+# ---------------- Tendencias (histórico de precios) ----------------
+# precio_historico (una fila por hora) y precio_diario (mínimo/suma/máximo por día) los rellena
+# el importador. Se filtra por rango sobre la columna de partición (fecha / dia), así que MySQL
+# solo abre las particiones del intervalo, y dentro se usa la clave (id_estacion, id_combustible, fecha).
+TENDENCIA_DIAS = 30           # intervalo por defecto, hasta ahora
+TENDENCIA_HORAS_MAX_DIAS = 7  # resolucion=auto: horas hasta esta duración, días a partir de ella
+
+def fecha_api(nombre, defecto):
+    valor = request.args.get(nombre)
+    if not valor:
+        return defecto
+    try:
+        return datetime.datetime.fromisoformat(valor)
+    except ValueError:
+        raise ErrorAPI(f"'{nombre}' debe ser una fecha AAAA-MM-DD o AAAA-MM-DDTHH:MM")
+
+def intervalo_tendencia():
+    """(desde, hasta, resolucion, parámetros de fecha para la tabla de esa resolución); hasta es exclusivo."""
+    hasta = fecha_api('hasta', datetime.datetime.now())
+    desde = fecha_api('desde', hasta - datetime.timedelta(days=TENDENCIA_DIAS))
+    if desde >= hasta:
+        raise ErrorAPI("'desde' debe ser anterior a 'hasta'")
+    resolucion = request.args.get('resolucion', 'auto')
+    if resolucion == 'auto':
+        resolucion = 'hora' if hasta - desde <= datetime.timedelta(days=TENDENCIA_HORAS_MAX_DIAS) else 'dia'
+    if resolucion not in ('hora', 'dia'):
+        raise ErrorAPI("'resolucion' debe ser hora, dia o auto")
+    if resolucion == 'hora':
+        rango = (desde, hasta)
+    else:
+        # días completos: el de `desde` y hasta el de `hasta` (incluido si no es medianoche)
+        fin = hasta.date() if hasta.time() == datetime.time(0) else hasta.date() + datetime.timedelta(days=1)
+        rango = (desde.date(), fin)
+    return desde, hasta, resolucion, rango
+
+def consulta_tendencia(nombre, sql, params):
+    """Filas de una consulta del histórico; [] si la BD aún no tiene las tablas de histórico."""
+    conn = get_conn()
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute(sql, tuple(params), nombre=nombre)
+        filas = cur.fetchall()
+        contar_filas_mostradas(len(filas))
+        return [fila_json(f) for f in filas]
+    except mysql.connector.Error as e:
+        if e.errno != errorcode.ER_NO_SUCH_TABLE:
+            raise
+        return []
+    finally:
+        cur.close()
+        conn.close()
+
+@app.route('/api/v1/tendencia/estacion/<int:id_estacion>')
+def api_tendencia_estacion(id_estacion):
+    """Precios de una estación en [desde, hasta): por hora, o mínimo/media/máximo por día. `combustible` opcional."""
+    desde, hasta, resolucion, rango = intervalo_tendencia()
+    combustible = request.args.get('combustible')
+    filtro_sql, filtro_params = ("", ())
+    if combustible:
+        filtro_sql, filtro_params = filtro_combustible(combustible, columna='t.id_combustible')
+        filtro_sql = "AND " + filtro_sql
+    if resolucion == 'hora':
+        sql = f"""
+            SELECT t.fecha, c.codigo AS combustible, t.precio
+            FROM precio_historico t
+            JOIN combustible c ON c.id = t.id_combustible
+            WHERE t.id_estacion = %s {filtro_sql} AND t.fecha >= %s AND t.fecha < %s
+            ORDER BY t.id_combustible, t.fecha
+        """
+    else:
+        sql = f"""
+            SELECT t.dia AS fecha, c.codigo AS combustible, t.precio_min,
+                   ROUND(t.precio_suma / t.muestras, 4) AS precio_medio, t.precio_max, t.muestras
+            FROM precio_diario t
+            JOIN combustible c ON c.id = t.id_combustible
+            WHERE t.id_estacion = %s {filtro_sql} AND t.dia >= %s AND t.dia < %s
+            ORDER BY t.id_combustible, t.dia
+        """
+    datos = consulta_tendencia('tendencia_estacion', sql, (id_estacion,) + tuple(filtro_params) + rango)
+    return jsonify({'estacion': id_estacion, 'resolucion': resolucion, 'desde': desde.isoformat(),
+                    'hasta': hasta.isoformat(), 'datos': datos})
+
+@app.route('/api/v1/tendencia/provincia')
+def api_tendencia_provincia():
+    """Mínimo, media y máximo de un combustible en las estaciones de una provincia, por hora o por día."""
+    provincia = request.args.get('provincia')
+    if not provincia:
+        raise ErrorAPI("falta 'provincia'")
+    combustible = request.args.get('combustible') or 'gasolina_95_e5'
+    desde, hasta, resolucion, rango = intervalo_tendencia()
+    filtro_sql, filtro_params = filtro_combustible(combustible, columna='t.id_combustible')
+    if resolucion == 'hora':
+        sql = f"""
+            SELECT t.fecha, MIN(t.precio) AS precio_min, ROUND(AVG(t.precio), 4) AS precio_medio,
+                   MAX(t.precio) AS precio_max, COUNT(*) AS estaciones
+            FROM estacion s
+            JOIN precio_historico t ON t.id_estacion = s.id
+            WHERE s.provincia = %s AND {filtro_sql} AND t.fecha >= %s AND t.fecha < %s
+            GROUP BY t.fecha
+            ORDER BY t.fecha
+        """
+    else:
+        sql = f"""
+            SELECT t.dia AS fecha, MIN(t.precio_min) AS precio_min,
+                   ROUND(SUM(t.precio_suma) / SUM(t.muestras), 4) AS precio_medio,
+                   MAX(t.precio_max) AS precio_max, COUNT(*) AS estaciones
+            FROM estacion s
+            JOIN precio_diario t ON t.id_estacion = s.id
+            WHERE s.provincia = %s AND {filtro_sql} AND t.dia >= %s AND t.dia < %s
+            GROUP BY t.dia
+            ORDER BY t.dia
+        """
+    datos = consulta_tendencia('tendencia_provincia', sql, (provincia,) + tuple(filtro_params) + rango)
+    return jsonify({'provincia': provincia, 'combustible': (buscar_combustible(combustible) or {}).get('codigo', combustible),
+                    'resolucion': resolucion, 'desde': desde.isoformat(), 'hasta': hasta.isoformat(), 'datos': datos})
+
+# ---------------- Exportación ----------------
+# Vista completa estación + empresa + combustible + precio, con los filtros de /buscar,
+# en CSV o NDJSON comprimido con gzip según se lee de MySQL (sin cargarla en memoria).
+COLUMNAS_EXPORTACION = [
+    ('id_estacion', 's.id'), ('codigo_externo', 's.codigo_externo'), ('fuente', 's.fuente'),
+    ('provincia', 's.provincia'), ('municipio', 's.municipio'), ('localidad', 's.localidad'),
+    ('direccion', 's.direccion'), ('codigo_postal', 's.codigo_postal'), ('margen', 's.margen'),
+    ('latitud', 's.latitud'), ('longitud', 's.longitud'), ('horario', 's.horario'),
+    ('ultima_actualizacion', 's.ultima_actualizacion'), ('empresa', 'e.nombre'),
+    ('combustible', 'c.codigo'), ('combustible_nombre', 'c.nombre'), ('precio', 'p.precio'),
+    ('fecha_precio', 'p.fecha_registro'),
+]
+
+def bloques_csv(bloques):
+    buf = io.StringIO()
+    escritor = csv.writer(buf)
+    escritor.writerow([nombre for nombre, _ in COLUMNAS_EXPORTACION])
+    for filas in bloques:
+        contar_filas_mostradas(len(filas))
+        escritor.writerows(filas)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def gzip_stream(trozos, nivel=EXPORT_GZIP_NIVEL):
+    """Comprime con gzip una secuencia de textos (o bytes) sin juntarlos."""
+    compresor = zlib.compressobj(nivel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for trozo in trozos:
+            datos = compresor.compress(trozo.encode('utf-8') if isinstance(trozo, str) else trozo)
+            if datos:
+                yield datos
+        yield compresor.flush()
+    finally:
+        if hasattr(trozos, 'close'):
+            trozos.close()  # devuelve la conexión de filas_en_bloques si el cliente se va a mitad
+
+@app.route('/exportar')
+def exportar():
+    """
+    /exportar?formato=csv|ndjson más los filtros de /buscar (provincia, empresa, combustible, fuente).
+    Una fila por estación y combustible; el orden es el de lectura de MySQL.
+    """
+    formato = request.args.get('formato', 'csv')
+    if formato not in ('csv', 'ndjson'):
+        raise ErrorAPI("'formato' debe ser csv o ndjson")
+    _, where_clauses, params, _, _ = filtros_buscar(request.args)
+    where_sql = ("WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
+    columnas = ", ".join(f"{expr} AS {nombre}" for nombre, expr in COLUMNAS_EXPORTACION)
+    sql = f"""
+        SELECT {columnas}
+        FROM precio p
+        JOIN combustible c ON p.id_combustible = c.id
+        JOIN estacion s ON p.id_estacion = s.id
+        LEFT JOIN empresa e ON s.id_empresa = e.id
+        {where_sql}
+    """
+    if formato == 'csv':
+        trozos = bloques_csv(filas_en_bloques('exportar', sql, params, dictionary=False))
+    else:
+        trozos = bloques_ndjson(filas_en_bloques('exportar', sql, params))
+    respuesta = app.response_class(stream_with_context(gzip_stream(trozos)), mimetype='application/gzip')
+    respuesta.headers['Content-Disposition'] = f'attachment; filename="eess.{formato}.gz"'
+    return respuesta
+
+# Estado del pool de conexiones y de la caché de resultados de este worker
+@app.route('/estado')
+def estado():
+    motor = {'tipo': WEB_MOTOR}
+    if _instantanea is not None:
+        motor.update(_instantanea.stats())
+    return jsonify({'pool': pool_stats(), 'cache': cache_stats(), 'motor': motor})
+
+# Métricas en formato Prometheus: las de todos los workers si hay METRICAS_DIR, y el pool de este
+@app.route('/metrics')
+def metrics():
+    pid = {'pid': str(os.getpid())}
+    estado_pool = pool_stats()
+    gauges = [
+        ('eess_pool_conexiones', "Conexiones del pool de este worker por estado",
+         [(dict(pid, estado='en_uso'), estado_pool.get('en_uso', 0)), (dict(pid, estado='tamano'), DB_POOL_SIZE)]),
+        ('eess_importacion_generacion', "Última generación de importación vista por este worker",
+         [(pid, _generacion['valor'])]),
+    ]
+    if cache_resultados is not None:
+        gauges.append(('eess_cache_entradas', "Entradas en la caché de resultados de este worker",
+                       [(pid, cache_resultados.stats().get('entradas', 0))]))
+    try:
+        registro_metricas.volcar(METRICAS_DIR)
+    except OSError as e:
+        app.logger.warning("No se pudieron volcar las métricas en %s: %s", METRICAS_DIR, e)
+    return app.response_class(registro_metricas.exponer(METRICAS_DIR, gauges),
+                              mimetype='text/plain; version=0.0.4')
+
 # Endpoint para el diagrama ER (mermaid)
 @app.route('/esquema')
 def esquema():
@@ -472,5 +1808,14 @@ erDiagram
 """
     return render_template('esquema.html', mermaid=mermaid_text)
 
+# con el motor en memoria cada worker carga su instantánea al arrancar, sin esperar a la primera petición
+if WEB_MOTOR == 'memoria':
+    def _precargar_instantanea():
+        try:
+            instantanea()
+        except mysql.connector.Error as e:
+            app.logger.warning("No se pudo cargar la instantánea al arrancar: %s", e)
+    threading.Thread(target=_precargar_instantanea, daemon=True).start()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
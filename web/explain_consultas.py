@@ -0,0 +1,154 @@
+# web/explain_consultas.py
+# -*- coding: utf-8 -*-
+"""
+Revisión de planes de ejecución de las consultas de la web.
+
+Recorre las rutas de la aplicación con el cliente de pruebas de Flask contra la base de datos
+configurada (MYSQL_*), captura cada SELECT que lanzan y ejecuta EXPLAIN sobre ella con los
+mismos parámetros. Marca los accesos completos a tabla (type=ALL) y los 'Using filesort' /
+'Using temporary' sobre tablas con al menos --umbral filas estimadas.
+Sale con código 1 si hay alguno marcado, para detectar regresiones al crecer los datos.
+
+    docker compose run --rm web python explain_consultas.py
+    docker compose run --rm web python explain_consultas.py --umbral 500 '/buscar?fuente=maritima'
+"""
+import argparse
+import sys
+
+import app as web
+
+# Rutas representativas; {provincia} y {combustible} se rellenan con valores reales
+RUTAS = [
+    '/',
+    '/buscar?page=1',
+    '/buscar?page=50&sort=precio_desc',
+    '/buscar?paginacion=cursor&provincia={provincia}&combustible={combustible}',
+    '/buscar?paginacion=cursor&combustible={combustible}&cursor={cursor}',
+    '/buscar?paginacion=cursor&fuente=maritima&sort=precio_desc&cursor={cursor_ant}',
+    '/empresa_mayor?fuente=terrestre',
+    '/empresa_mayor?fuente=maritima&page=2',
+    '/gas95_madrid?provincia={provincia}',
+    '/gas95_maritima_top',
+    '/precios_provincia',
+    '/cercanas?lat=40.4168&lon=-3.7038&k=10',
+    '/gasoleo_cercano?lat=40.4168&lon=-3.7038&km=10',
+    '/api/v1/precios?combustible={combustible}&limite=100',
+    '/api/v1/precios?formato=ndjson&fuente=maritima',
+    '/api/v1/precios_provincia?limite=100',
+    '/exportar?fuente=maritima',
+    '/api/v1/tendencia/estacion/1?combustible={combustible}&desde=2025-01-01&hasta=2025-01-03',
+    '/api/v1/tendencia/provincia?provincia={provincia}&combustible={combustible}&desde=2025-01-01&hasta=2025-01-05',
+    '/api/v1/tendencia/provincia?provincia={provincia}&combustible={combustible}&desde=2025-01-01&hasta=2025-04-01',
+]
+
+class CursorRegistro:
+    """Cursor que apunta cada SELECT ejecutada antes de pasarla al cursor real."""
+    def __init__(self, cur, registro):
+        self._cur = cur
+        self._registro = registro
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def execute(self, sql, params=None, nombre='sin_nombre'):
+        if sql.lstrip().upper().startswith('SELECT'):
+            self._registro.append((nombre, sql, tuple(params) if params else ()))
+        return self._cur.execute(sql, params, nombre=nombre) if params else self._cur.execute(sql, nombre=nombre)
+
+class ConexionRegistro:
+    def __init__(self, conn, registro):
+        self._conn = conn
+        self._registro = registro
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return CursorRegistro(self._conn.cursor(*args, **kwargs), self._registro)
+
+def normalizar(sql):
+    return ' '.join(sql.split())
+
+def avisos_plan(plan, umbral):
+    """Líneas del EXPLAIN que merecen revisión."""
+    avisos = []
+    for fila in plan:
+        filas = int(fila.get('rows') or 0)
+        extra = fila.get('Extra') or ''
+        if filas < umbral:
+            continue
+        if fila.get('type') == 'ALL':
+            avisos.append(f"acceso completo a {fila.get('table')} (~{filas} filas)")
+        if 'Using filesort' in extra:
+            avisos.append(f"filesort en {fila.get('table')} (~{filas} filas)")
+        if 'Using temporary' in extra:
+            avisos.append(f"tabla temporal en {fila.get('table')} (~{filas} filas)")
+    return avisos
+
+def imprimir_plan(plan):
+    cols = ('table', 'partitions', 'type', 'key', 'rows', 'filtered', 'Extra')
+    for fila in plan:
+        print("      " + " | ".join(f"{c}={fila.get(c)}" for c in cols))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EXPLAIN de las consultas de la web")
+    parser.add_argument('rutas', nargs='*', help="rutas adicionales a revisar (con su query string)")
+    parser.add_argument('--umbral', type=int, default=1000,
+                        help="filas estimadas a partir de las que se marca un acceso completo o filesort")
+    parser.add_argument('-v', '--verbose', action='store_true', help="mostrar también los planes sin avisos")
+    args = parser.parse_args(argv)
+
+    # sin cachés: queremos que cada ruta llegue a MySQL
+    web.cache_resultados = None
+    web.BUSCAR_CONTEO_TTL = 0
+    web.CATALOGO_TTL = 0
+
+    cat = web.catalogos()
+    provincia = next((p for p in cat['provincias'] if p.upper() == 'MADRID'), cat['provincias'][0] if cat['provincias'] else '')
+    codigos = [c['codigo'] or str(c['id']) for c in cat['combustibles']]
+    combustible = next((c for c in codigos if '95' in c), codigos[0] if codigos else '')
+    valores = {'provincia': provincia, 'combustible': combustible,
+               'cursor': web.codificar_cursor('1.5', 1, 'sig'),
+               'cursor_ant': web.codificar_cursor('1.5', 1, 'ant')}
+
+    registro = []
+    get_conn_original = web.get_conn
+    web.get_conn = lambda: ConexionRegistro(get_conn_original(), registro)
+    cliente = web.app.test_client()
+
+    vistas = set()
+    marcadas = 0
+    for ruta in RUTAS + args.rutas:
+        url = ruta.format(**valores)
+        del registro[:]
+        resp = cliente.get(url)
+        print(f"{url} -> HTTP {resp.status_code}")
+        conn = get_conn_original()
+        cur = conn.cursor(dictionary=True)
+        try:
+            for nombre, sql, params in list(registro):
+                clave = normalizar(sql)
+                if clave in vistas:
+                    continue
+                vistas.add(clave)
+                if params:
+                    cur.execute("EXPLAIN " + sql, params, nombre='explain')
+                else:
+                    cur.execute("EXPLAIN " + sql, nombre='explain')
+                plan = cur.fetchall()
+                avisos = avisos_plan(plan, args.umbral)
+                if avisos or args.verbose:
+                    print(f"  [{nombre}] " + clave[:160] + ("..." if len(clave) > 160 else ""))
+                    imprimir_plan(plan)
+                for aviso in avisos:
+                    print("    AVISO:", aviso)
+                marcadas += 1 if avisos else 0
+        finally:
+            cur.close()
+            conn.close()
+
+    print(f"[OK] {len(vistas)} consultas revisadas, {marcadas} con avisos")
+    return 1 if marcadas else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
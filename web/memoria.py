@@ -0,0 +1,241 @@
+# web/memoria.py
+# -*- coding: utf-8 -*-
+"""
+Instantánea columnar de los datos cargados, para servir las consultas de la web sin MySQL
+(WEB_MOTOR=memoria en app.py).
+
+Los precios se guardan en arrays de NumPy ordenados por (precio, id): cualquier filtro es una
+máscara sobre ellos y el resultado sale ya ordenado, así que las páginas de /buscar (también
+por cursor) son un corte del array. Provincia, empresa, fuente y combustible son códigos enteros
+por fila. Los valores se devuelven con los mismos nombres y tipos que las consultas SQL
+(Decimal para precios y coordenadas), de modo que las plantillas no distinguen el motor.
+"""
+import math
+import time
+import unicodedata
+from decimal import Decimal
+
+import numpy as np
+
+RADIO_TIERRA_KM = 6371.0
+
+def clave_texto(valor):
+    """Clave de comparación equivalente a utf8mb4_unicode_ci: sin acentos, mayúsculas ni espacios finales."""
+    s = ''.join(ch for ch in unicodedata.normalize('NFKD', str(valor)) if not unicodedata.combining(ch))
+    return s.rstrip(' ').casefold()
+
+def _categorias(valores):
+    """(lista de valores distintos, array de códigos por fila); None -> -1."""
+    indice = {}
+    codigos = np.fromiter((-1 if v is None else indice.setdefault(v, len(indice)) for v in valores),
+                          dtype=np.int32, count=len(valores))
+    return list(indice), codigos
+
+def _decimal(x, decimales):
+    return None if x is None or math.isnan(x) else Decimal(f"{x:.{decimales}f}")
+
+def _float(v):
+    return float('nan') if v is None else float(v)
+
+class Instantanea:
+    """Estaciones y precios de una generación de importación."""
+
+    def __init__(self, generacion, empresas, combustibles, estaciones, precios):
+        t0 = time.monotonic()
+        self.generacion = generacion
+        self.combustibles = {int(id_): nombre for id_, nombre in combustibles}
+        nombre_empresa = {int(id_): nombre for id_, nombre in empresas}
+
+        # estaciones, ordenadas por id para localizar la fila de cada precio con searchsorted
+        estaciones = sorted(estaciones, key=lambda r: r[0])
+        (est_id, est_empresa, provincia, municipio, localidad, direccion, margen,
+         latitud, longitud, fuente) = (list(c) for c in zip(*estaciones)) if estaciones else ([],) * 10
+        self.est_id = np.array(est_id, dtype=np.int64)
+        self.est_empresa = np.array([-1 if e is None else int(e) for e in est_empresa], dtype=np.int64)
+        self.empresas = {id_: nombre_empresa.get(id_) for id_ in set(self.est_empresa.tolist()) if id_ != -1}
+        self.provincias, self.est_provincia = _categorias(provincia)
+        # provincias que solo difieren en mayúsculas/acentos son la misma (GROUP BY con collation _ci)
+        claves, grupo_provincia = _categorias([clave_texto(p) for p in self.provincias])
+        self.n_grupos_provincia = len(claves)
+        self.grupo_provincia = np.append(grupo_provincia, -1).astype(np.int32)  # código -1 -> grupo -1
+        self.fuentes, self.est_fuente = _categorias(fuente)
+        self.municipio, self.localidad, self.direccion, self.margen = municipio, localidad, direccion, margen
+        self.est_lat = np.array([_float(v) for v in latitud], dtype=np.float64)
+        self.est_lon = np.array([_float(v) for v in longitud], dtype=np.float64)
+
+        # precios ordenados por (precio, id): el orden de /buscar
+        pid, id_estacion, id_combustible, precio = ((list(c) for c in zip(*precios)) if precios else ([],) * 4)
+        pid = np.array(pid, dtype=np.int64)
+        precio = np.array([float(p) for p in precio], dtype=np.float64)
+        orden = np.lexsort((pid, precio))
+        self.id_precio = pid[orden]
+        self.precio = precio[orden]
+        self.combustible = np.array(id_combustible, dtype=np.int64)[orden]
+        self.estacion = np.searchsorted(self.est_id, np.array(id_estacion, dtype=np.int64)[orden])
+        # atributos de la estación repetidos por precio, para filtrar sin indirección
+        self.provincia = self.est_provincia[self.estacion]
+        self.fuente = self.est_fuente[self.estacion]
+        self.empresa = self.est_empresa[self.estacion]
+        self.segundos_carga = time.monotonic() - t0
+
+    @classmethod
+    def cargar(cls, cur, generacion):
+        """Lee las cuatro tablas con un cursor normal (tuplas) de la app, que nombra cada consulta."""
+        t0 = time.monotonic()
+        cur.execute("SELECT id, nombre FROM empresa", nombre='instantanea_empresas')
+        empresas = cur.fetchall()
+        cur.execute("SELECT id, nombre FROM combustible", nombre='instantanea_combustibles')
+        combustibles = cur.fetchall()
+        cur.execute("SELECT id, id_empresa, provincia, municipio, localidad, direccion, margen, "
+                    "latitud, longitud, fuente FROM estacion", nombre='instantanea_estaciones')
+        estaciones = cur.fetchall()
+        cur.execute("SELECT id, id_estacion, id_combustible, precio FROM precio", nombre='instantanea_precios')
+        precios = cur.fetchall()
+        inst = cls(generacion, empresas, combustibles, estaciones, precios)
+        inst.segundos_carga = time.monotonic() - t0
+        return inst
+
+    def stats(self):
+        return {'generacion': self.generacion, 'estaciones': int(len(self.est_id)),
+                'precios': int(len(self.precio)), 'segundos_carga': round(self.segundos_carga, 3)}
+
+    # ---------------- filtros ----------------
+    def _codigos(self, categorias, valor):
+        clave = clave_texto(valor)
+        return [i for i, v in enumerate(categorias) if clave_texto(v) == clave]
+
+    def seleccion(self, provincia=None, empresa=None, id_combustible=None, fuente=None):
+        """
+        Posiciones (en orden (precio, id) ascendente) de los precios que cumplen los filtros.
+        id_combustible=-1 no coincide con nada (combustible desconocido).
+        """
+        mascara = np.ones(len(self.precio), dtype=bool)
+        if provincia:
+            mascara &= np.isin(self.provincia, self._codigos(self.provincias, provincia))
+        if empresa:
+            clave = clave_texto(empresa)
+            ids = [id_ for id_, nombre in self.empresas.items() if nombre is not None and clave_texto(nombre) == clave]
+            mascara &= np.isin(self.empresa, ids)
+        if id_combustible is not None:
+            mascara &= self.combustible == id_combustible
+        if fuente:
+            mascara &= np.isin(self.fuente, self._codigos(self.fuentes, fuente))
+        return np.flatnonzero(mascara)
+
+    def _posicion(self, precio, id_precio, lado):
+        """Primera posición global con (precio, id) >= (lado='left') o > (lado='right') que la dada."""
+        precio = float(precio)
+        ini = int(np.searchsorted(self.precio, precio, 'left'))
+        fin = int(np.searchsorted(self.precio, precio, 'right'))
+        return ini + int(np.searchsorted(self.id_precio[ini:fin], int(id_precio), lado))
+
+    def pagina_keyset(self, sel, descendente, cursor, limite):
+        """Como consulta_keyset de app.py sobre una selección: (posiciones, hay_anterior, hay_siguiente)."""
+        atras = cursor is not None and cursor[2] == 'ant'
+        orden_desc = descendente != atras
+        if cursor is None:
+            candidatas = sel[::-1] if orden_desc else sel
+        elif orden_desc:
+            fin = np.searchsorted(sel, self._posicion(cursor[0], cursor[1], 'left'))
+            candidatas = sel[:fin][::-1]
+        else:
+            ini = np.searchsorted(sel, self._posicion(cursor[0], cursor[1], 'right'))
+            candidatas = sel[ini:]
+        tomadas = candidatas[:limite + 1]
+        hay_mas = len(tomadas) > limite
+        tomadas = tomadas[:limite]
+        if atras:
+            return tomadas[::-1], hay_mas, True
+        return tomadas, cursor is not None, hay_mas
+
+    def orden_precio_desc(self, sel):
+        """`sel` ordenada por precio descendente y, a igual precio, id ascendente."""
+        return sel[np.lexsort((self.id_precio[sel], -self.precio[sel]))]
+
+    # ---------------- filas ----------------
+    def _valor(self, columna, e, j):
+        """Valor de `columna` para la estación e y el precio j (posición global, o None)."""
+        if columna in ('id', 'id_estacion'):
+            return int(self.est_id[e])
+        if columna == 'provincia':
+            c = self.est_provincia[e]
+            return self.provincias[c] if c >= 0 else None
+        if columna == 'fuente':
+            c = self.est_fuente[e]
+            return self.fuentes[c] if c >= 0 else None
+        if columna == 'empresa':
+            return self.empresas.get(int(self.est_empresa[e]))
+        if columna in ('municipio', 'localidad', 'direccion', 'margen'):
+            return getattr(self, columna)[e]
+        if columna == 'latitud':
+            return _decimal(self.est_lat[e], 7)
+        if columna == 'longitud':
+            return _decimal(self.est_lon[e], 7)
+        if columna == 'precio':
+            return _decimal(self.precio[j], 4)
+        if columna == 'id_precio':
+            return int(self.id_precio[j])
+        if columna == 'combustible':
+            return self.combustibles.get(int(self.combustible[j]))
+        raise KeyError(columna)
+
+    def filas(self, posiciones, columnas):
+        """Diccionarios {columna: valor} de los precios en `posiciones`, en ese orden."""
+        return [{c: self._valor(c, self.estacion[j], j) for c in columnas} for j in posiciones]
+
+    # ---------------- agregados ----------------
+    def ranking_empresas(self, fuente):
+        """[{'empresa', 'total'}] de estaciones por empresa en `fuente`, de más a menos (como resumen_empresa)."""
+        en_fuente = np.isin(self.est_fuente, self._codigos(self.fuentes, fuente)) & (self.est_empresa >= 0)
+        ids, totales = np.unique(self.est_empresa[en_fuente], return_counts=True)
+        orden = np.lexsort((ids, -totales))
+        return [{'empresa': self.empresas.get(int(ids[i])), 'total': int(totales[i])}
+                for i in orden if self.empresas.get(int(ids[i])) is not None]
+
+    def precios_provincia(self, id_combustible, columnas):
+        """
+        Una fila por provincia (como resumen_precio): la estación más barata con `columnas`, más
+        n_estaciones, precio_medio y precio_max; ordenadas por precio y provincia.
+        """
+        sel = self.seleccion(id_combustible=id_combustible)
+        sel = sel[self.provincia[sel] >= 0]
+        grupo = self.grupo_provincia[self.provincia[sel]]
+        # sel está ordenada por (precio, id): la primera de cada grupo es la más barata
+        grupos, primera = np.unique(grupo, return_index=True)
+        n = np.bincount(grupo, minlength=self.n_grupos_provincia)
+        suma = np.bincount(grupo, weights=self.precio[sel], minlength=self.n_grupos_provincia)
+        maximo = np.full(self.n_grupos_provincia, -np.inf)
+        np.maximum.at(maximo, grupo, self.precio[sel])
+        filas = []
+        for g, i in zip(grupos, primera):
+            fila = self.filas([sel[i]], columnas)[0]
+            fila.update(n_estaciones=int(n[g]), precio_medio=_decimal(suma[g] / n[g], 4),
+                        precio_max=_decimal(maximo[g], 4))
+            filas.append(fila)
+        filas.sort(key=lambda f: (f['precio'], clave_texto(f['provincia'])))
+        return filas
+
+    def cercanas(self, id_combustible, lat0, lon0, columnas, km=None, k=None, radio_max=None):
+        """
+        Como buscar_cercanas de app.py: filas (con 'distancia') ordenadas por distancia a (lat0, lon0).
+        Solo km: las que están a <= km y después las que no tienen coordenadas.
+        Con k: las k más cercanas a <= km (o radio_max).
+        """
+        sel = self.seleccion(id_combustible=id_combustible)
+        e = self.estacion[sel]
+        lat, lon = np.radians(self.est_lat[e]), np.radians(self.est_lon[e])
+        phi0, lambda0 = math.radians(lat0), math.radians(lon0)
+        a = np.sin((lat - phi0) / 2.0) ** 2 + math.cos(phi0) * np.cos(lat) * np.sin((lon - lambda0) / 2.0) ** 2
+        distancia = 2 * RADIO_TIERRA_KM * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+        sin_coords = np.isnan(distancia)
+        if k:
+            radio = km if km else radio_max
+            dentro = np.flatnonzero(~sin_coords & (distancia <= radio))
+            dentro = dentro[np.argsort(distancia[dentro], kind='stable')][:k]
+        else:
+            dentro = np.flatnonzero(sin_coords | (distancia <= km))
+            dentro = dentro[np.argsort(distancia[dentro], kind='stable')]  # NaN al final
+        filas = self.filas(sel[dentro], columnas)
+        for fila, i in zip(filas, dentro):
+            fila['distancia'] = None if sin_coords[i] else float(distancia[i])
+        return filas
@@ -0,0 +1,135 @@
+# web/metricas.py
+# -*- coding: utf-8 -*-
+"""
+Métricas con el formato de exposición de texto de Prometheus (0.0.4), sin dependencias.
+
+Registro guarda contadores e histogramas con etiquetas en memoria del proceso. gunicorn tiene
+varios workers y cada petición a /metrics la atiende uno solo, así que, si se indica un directorio
+compartido, cada worker vuelca de vez en cuando su estado a <directorio>/<pid>.json y la exposición
+suma los ficheros de los demás al estado propio. Los contadores de un worker que ya no existe se
+siguen sumando (un contador no puede bajar); los valores instantáneos (gauges) los aporta quien
+responde, con la etiqueta pid.
+"""
+import glob
+import json
+import math
+import os
+import threading
+import time
+
+# límites de los histogramas de tiempos, en segundos
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _etiquetas(pares):
+    return '{' + ','.join(f'{k}="{_escapar(v)}"' for k, v in pares) + '}' if pares else ''
+
+def _numero(valor):
+    if isinstance(valor, float) and math.isinf(valor):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+class Registro:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._definiciones = {}  # nombre -> (tipo, ayuda, buckets)
+        self._contadores = {}    # (nombre, etiquetas) -> valor
+        self._histogramas = {}   # (nombre, etiquetas) -> [cuenta por bucket..., +Inf, suma]
+        self._volcado = 0.0
+
+    def contador(self, nombre, ayuda):
+        self._definiciones[nombre] = ('counter', ayuda, None)
+
+    def histograma(self, nombre, ayuda, buckets=BUCKETS_SEGUNDOS):
+        self._definiciones[nombre] = ('histogram', ayuda, tuple(buckets))
+
+    def sumar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        buckets = self._definiciones[nombre][2]
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        i = next((i for i, limite in enumerate(buckets) if valor <= limite), len(buckets))
+        with self._lock:
+            cuentas = self._histogramas.get(clave)
+            if cuentas is None:
+                cuentas = self._histogramas[clave] = [0] * (len(buckets) + 1) + [0.0]
+            cuentas[i] += 1
+            cuentas[-1] += valor
+
+    def estado(self):
+        """Copia serializable en JSON del estado del proceso."""
+        with self._lock:
+            return {'contadores': [[n, [list(p) for p in e], v] for (n, e), v in self._contadores.items()],
+                    'histogramas': [[n, [list(p) for p in e], list(c)] for (n, e), c in self._histogramas.items()]}
+
+    def volcar(self, directorio, cada=0):
+        """Escribe el estado en <directorio>/<pid>.json si han pasado `cada` segundos desde el último volcado."""
+        ahora = time.monotonic()
+        if not directorio or ahora - self._volcado < cada:
+            return
+        self._volcado = ahora
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, f"{os.getpid()}.json")
+        temporal = f"{ruta}.{threading.get_ident()}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(self.estado(), f)
+        os.replace(temporal, ruta)
+
+    def exponer(self, directorio=None, gauges=()):
+        """
+        Texto de /metrics: el estado propio más el volcado por los demás procesos en `directorio`.
+        `gauges`: [(nombre, ayuda, [(etiquetas dict, valor)])] del proceso que responde.
+        """
+        contadores = {}
+        histogramas = {}
+
+        def acumular(estado):
+            for nombre, etiquetas, valor in estado['contadores']:
+                clave = (nombre, tuple(tuple(p) for p in etiquetas))
+                contadores[clave] = contadores.get(clave, 0) + valor
+            for nombre, etiquetas, cuentas in estado['histogramas']:
+                clave = (nombre, tuple(tuple(p) for p in etiquetas))
+                previas = histogramas.get(clave)
+                histogramas[clave] = list(cuentas) if previas is None else [a + b for a, b in zip(previas, cuentas)]
+
+        acumular(self.estado())
+        if directorio:
+            propio = os.path.join(directorio, f"{os.getpid()}.json")
+            for ruta in glob.glob(os.path.join(directorio, '*.json')):
+                if ruta == propio:
+                    continue
+                try:
+                    with open(ruta, encoding='utf-8') as f:
+                        acumular(json.load(f))
+                except (OSError, ValueError):
+                    continue  # a medio escribir o ilegible: se suma en la siguiente
+
+        lineas = []
+        for nombre, (tipo, ayuda, buckets) in sorted(self._definiciones.items()):
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            if tipo == 'counter':
+                for (n, etiquetas), valor in sorted(contadores.items()):
+                    if n == nombre:
+                        lineas.append(f"{nombre}{_etiquetas(etiquetas)} {_numero(valor)}")
+                continue
+            for (n, etiquetas), cuentas in sorted(histogramas.items()):
+                if n != nombre:
+                    continue
+                acumulado = 0
+                for limite, cuenta in zip(buckets + (float('inf'),), cuentas):
+                    acumulado += cuenta
+                    lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas + (('le', _numero(float(limite))),))} {acumulado}")
+                lineas.append(f"{nombre}_sum{_etiquetas(etiquetas)} {_numero(cuentas[-1])}")
+                lineas.append(f"{nombre}_count{_etiquetas(etiquetas)} {acumulado}")
+        for nombre, ayuda, valores in gauges:
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} gauge")
+            for etiquetas, valor in valores:
+                lineas.append(f"{nombre}{_etiquetas(tuple(sorted(etiquetas.items())))} {_numero(valor)}")
+        return '\n'.join(lineas) + '\n'
@@ -0,0 +1,66 @@
+# web/tests/test_cercanas.py
+# -*- coding: utf-8 -*-
+"""
+Parámetros de /api/v1/cercanas: un km o unas coordenadas no finitos (nan, inf) o un km <= 0 se
+tratan como no válidos y se usa el valor por defecto, en vez de llegar a los BETWEEN de la caja.
+
+    cd web && python -m pytest -q tests
+"""
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as web
+
+class ConexionNula:
+    """Conexión y cursor sin filas (generación de importación, catálogos)."""
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, sql, params=None, nombre=None):
+        pass
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def llamadas(monkeypatch):
+    llamadas = []
+
+    def buscar_cercanas(cur, filtro_sql, filtro_params, lat0, lon0, km=None, k=None):
+        llamadas.append((lat0, lon0, km, k))
+        return []
+
+    monkeypatch.setattr(web, 'get_conn', ConexionNula)
+    monkeypatch.setattr(web, 'instantanea', lambda: None)
+    monkeypatch.setattr(web, 'buscar_combustible', lambda valor: {'id': 1, 'nombre': 'Gasóleo A'})
+    monkeypatch.setattr(web, 'buscar_cercanas', buscar_cercanas)
+    return llamadas
+
+@pytest.mark.parametrize('km', ['nan', 'inf', '-inf', '-5', '0', 'abc'])
+def test_km_no_valido_usa_el_defecto(llamadas, km):
+    respuesta = web.app.test_client().get(f'/api/v1/cercanas?lat=40.4&lon=-3.7&km={km}')
+    assert respuesta.status_code == 200
+    assert llamadas[-1][2:] == (10.0, None)
+
+def test_km_no_valido_con_k_no_limita_el_radio(llamadas):
+    respuesta = web.app.test_client().get('/api/v1/cercanas?lat=40.4&lon=-3.7&km=nan&k=3')
+    assert respuesta.status_code == 200
+    assert llamadas[-1][2:] == (None, 3)
+
+def test_coordenadas_no_finitas_usan_el_defecto(llamadas):
+    respuesta = web.app.test_client().get('/api/v1/cercanas?lat=nan&lon=inf&km=2,5')
+    assert respuesta.status_code == 200
+    lat0, lon0, km, _ = llamadas[-1]
+    assert math.isfinite(lat0) and math.isfinite(lon0)
+    assert km == 2.5
@@ -0,0 +1,112 @@
+# web/tests/test_exportar.py
+# -*- coding: utf-8 -*-
+"""
+/exportar lee la respuesta completa: el error de una columna inexistente salta dentro del generador,
+después de enviar el 200 y las cabeceras, así que mirar solo el estado no basta.
+La BD es un cursor falso que valida cada alias.columna de la consulta contra mysql-init/ddl_estaciones.sql
+y falla como MySQL ("Unknown column") si no existe.
+
+    cd web && python -m pytest -q tests
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import sys
+
+import mysql.connector
+import pytest
+
+DIR_WEB = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIR_WEB)
+
+import app as web
+
+DDL = os.path.join(DIR_WEB, '..', 'mysql-init', 'ddl_estaciones.sql')
+N_FILAS = 2500  # más de un bloque de API_STREAM_CHUNK
+
+def columnas_ddl():
+    with open(DDL, encoding='utf-8') as f:
+        texto = f.read()
+    tablas = {}
+    for tabla, cuerpo in re.findall(r'CREATE TABLE IF NOT EXISTS (\w+) \((.*?)\n\)', texto, re.S):
+        tablas[tabla] = {linea.split()[0] for linea in cuerpo.strip().splitlines()
+                         if linea.strip() and linea.split()[0].upper() not in
+                         ('UNIQUE', 'KEY', 'INDEX', 'PRIMARY', 'FOREIGN', 'CONSTRAINT', '--')}
+    return tablas
+
+class CursorFalso:
+    def __init__(self, tablas, dictionary=False):
+        self.tablas = tablas
+        self.dictionary = dictionary
+        self.pendientes = []
+        self.columnas = []
+
+    def execute(self, sql, params=None, nombre=None):
+        if 'FROM importacion' in sql:
+            self.columnas, self.pendientes = ['generacion', 'actualizado'], [(1, None)]
+            return
+        alias = dict((a, t) for t, a in re.findall(r'(?:FROM|JOIN)\s+(\w+)\s+(\w+)', sql))
+        for a, columna in re.findall(r'\b(\w+)\.(\w+)\b', sql):
+            if a in alias and columna not in self.tablas[alias[a]]:
+                raise mysql.connector.errors.ProgrammingError(
+                    msg=f"Unknown column '{a}.{columna}' in 'field list'", errno=1054)
+        self.columnas = re.findall(r'\bAS (\w+)', sql)
+        self.pendientes = [tuple(f"{c}{i}" for c in self.columnas) for i in range(N_FILAS)]
+
+    def _filas(self, filas):
+        return [dict(zip(self.columnas, f)) for f in filas] if self.dictionary else filas
+
+    def fetchone(self):
+        return self._filas(self.pendientes[:1])[0] if self.pendientes else None
+
+    def fetchmany(self, size=1):
+        filas, self.pendientes = self.pendientes[:size], self.pendientes[size:]
+        return self._filas(filas)
+
+    def close(self):
+        pass
+
+class ConexionFalsa:
+    def __init__(self, tablas):
+        self.tablas = tablas
+
+    def cursor(self, dictionary=False, **kwargs):
+        return CursorFalso(self.tablas, dictionary)
+
+    def consume_results(self):
+        pass
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def cliente(monkeypatch):
+    tablas = columnas_ddl()
+    monkeypatch.setattr(web, 'get_conn', lambda: ConexionFalsa(tablas))
+    monkeypatch.setattr(web, '_generacion', {'valor': 0, 'leida': None, 'actualizado': None})
+    return web.app.test_client()
+
+def test_columnas_exportacion_existen():
+    tablas = columnas_ddl()
+    alias = {'s': 'estacion', 'e': 'empresa', 'c': 'combustible', 'p': 'precio'}
+    for nombre, expr in web.COLUMNAS_EXPORTACION:
+        a, columna = expr.split('.')
+        assert columna in tablas[alias[a]], f"{nombre}: {expr} no existe en {alias[a]}"
+
+def test_exportar_csv_completo(cliente):
+    respuesta = cliente.get('/exportar?formato=csv')
+    assert respuesta.status_code == 200
+    filas = list(csv.reader(io.StringIO(gzip.decompress(respuesta.get_data()).decode('utf-8'))))
+    assert filas[0] == [nombre for nombre, _ in web.COLUMNAS_EXPORTACION]
+    assert len(filas) == N_FILAS + 1
+    assert filas[-1][-1] == f"fecha_precio{N_FILAS - 1}"
+
+def test_exportar_ndjson_completo(cliente):
+    respuesta = cliente.get('/exportar?formato=ndjson&fuente=maritima')
+    assert respuesta.status_code == 200
+    lineas = gzip.decompress(respuesta.get_data()).decode('utf-8').splitlines()
+    assert len(lineas) == N_FILAS
+    assert set(json.loads(lineas[-1])) == {nombre for nombre, _ in web.COLUMNAS_EXPORTACION}